@@ -1,3 +1,4 @@
+from enum import StrEnum
 from typing import Annotated
 
 from pydantic import BaseModel, ConfigDict, EmailStr, Field
@@ -5,6 +6,12 @@ from pydantic import BaseModel, ConfigDict, EmailStr, Field
 from if_else_2024.utils import NonEmptyStr
 
 
+class AccountSearchMode(StrEnum):
+    CONTAINS = "CONTAINS"
+    PREFIX = "PREFIX"
+    SIMILAR = "SIMILAR"
+
+
 class AccountDto(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
@@ -1,7 +1,7 @@
 # flake8: noqa: F821
 from typing import Optional
 
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import DDL, Index, UniqueConstraint, event, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from if_else_2024.core.db_manager import Base
@@ -23,5 +23,39 @@ class Account(Base):
         back_populates="account", cascade="save-update, merge, delete"
     )
 
-    # TODO: add indexes
-    __table_args__ = (UniqueConstraint("email"),)
+    __table_args__ = (
+        UniqueConstraint("email"),
+        # Trigram indexes serve both `ILIKE '%x%'` and similarity (`%`) lookups
+        Index(
+            "ix_accounts_first_name_trgm",
+            "first_name",
+            postgresql_using="gin",
+            postgresql_ops={"first_name": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_accounts_last_name_trgm",
+            "last_name",
+            postgresql_using="gin",
+            postgresql_ops={"last_name": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_accounts_email_trgm",
+            "email",
+            postgresql_using="gin",
+            postgresql_ops={"email": "gin_trgm_ops"},
+        ),
+    )
+
+
+""" B-tree index for the prefix search by email, independent of collation """
+Index(
+    "ix_accounts_email_lower_prefix",
+    func.lower(Account.email).label("email_lower"),
+    postgresql_ops={"email_lower": "text_pattern_ops"},
+)
+
+event.listen(
+    Account.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
@@ -1,12 +1,24 @@
-from sqlalchemy import and_, exists, select, true
+from sqlalchemy import and_, any_, exists, func, select, true
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from if_else_2024.accounts.dto import AccountSearchMode
 from if_else_2024.accounts.models import Account
+from if_else_2024.core.cache import EntityCache
+from if_else_2024.core.invalidation import publish_invalidation
+from if_else_2024.utils import ids_array, prefix_range
 
 
 class AccountRepository:
+    def __init__(self, cache: EntityCache[Account]):
+        self._cache = cache
+
     async def get_by_id(self, session: AsyncSession, id: int):
-        return await session.get(Account, id)
+        return await self._cache.get(session, id)
+
+    async def get_by_ids(self, session: AsyncSession, ids: list[int]):
+        q = select(Account).where(Account.id == any_(ids_array(ids)))
+        s = await session.execute(q)
+        return s.scalars().all()
 
     async def get_by_email(self, session: AsyncSession, email: str):
         q = select(Account).where(Account.email == email)
@@ -26,21 +38,37 @@ class AccountRepository:
         email: str | None,
         offset: int,
         size: int,
+        mode: AccountSearchMode = AccountSearchMode.CONTAINS,
+        rank_by_similarity: bool = False,
     ):
         conditions = [true()]
+        similarities = []
+
         if first_name is not None:
-            conditions.append(Account.first_name.icontains(first_name))
+            conditions.append(self._match(Account.first_name, first_name, mode))
+            similarities.append(func.similarity(Account.first_name, first_name))
 
         if last_name is not None:
-            conditions.append(Account.last_name.icontains(last_name))
+            conditions.append(self._match(Account.last_name, last_name, mode))
+            similarities.append(func.similarity(Account.last_name, last_name))
 
         if email is not None:
-            conditions.append(Account.email.icontains(email))
+            if mode == AccountSearchMode.PREFIX and email:
+                conditions.append(
+                    prefix_range(func.lower(Account.email), email.lower())
+                )
+            else:
+                conditions.append(self._match(Account.email, email, mode))
+            similarities.append(func.similarity(Account.email, email))
+
+        order_by = [Account.id]
+        if rank_by_similarity and similarities:
+            order_by.insert(0, sum(similarities[1:], similarities[0]).desc())
 
         q = (
             select(Account)
             .where(and_(*conditions))
-            .order_by(Account.id)
+            .order_by(*order_by)
             .offset(offset)
             .limit(size)
         )
@@ -50,9 +78,22 @@ class AccountRepository:
     async def save(self, session: AsyncSession, account: Account):
         session.add(account)
         await session.flush()
+        await publish_invalidation(session, Account.__tablename__, account.id)
         await session.commit()
         return account
 
     async def delete(self, session: AsyncSession, account: Account):
         await session.delete(account)
+        await publish_invalidation(session, Account.__tablename__, account.id)
         await session.commit()
+
+    @staticmethod
+    def _match(column, value: str, mode: AccountSearchMode):
+        """All of these operators are served by the `gin_trgm_ops` indexes"""
+        match mode:
+            case AccountSearchMode.PREFIX:
+                return column.istartswith(value, autoescape=True)
+            case AccountSearchMode.SIMILAR:
+                return column.op("%")(value)
+            case _:
+                return column.icontains(value, autoescape=True)
@@ -1,15 +1,16 @@
 from typing import Annotated
 
-from annotated_types import Ge
+from annotated_types import Ge, Len
 from fastapi import APIRouter, Depends, Path, Query, status
 
-from if_else_2024.accounts.dto import AccountDto, UpdateAccountDto
+from if_else_2024.accounts.dto import AccountDto, AccountSearchMode, UpdateAccountDto
 from if_else_2024.auth.dependencies import (
     AuthSessionDep,
     authenticate_user,
     is_authenticated,
 )
 from if_else_2024.core.dependencies import AccountServiceDep, DbSessionDep
+from if_else_2024.core.dto import BatchDto
 from if_else_2024.core.exceptions import ForbiddenException
 
 router = APIRouter(prefix="/accounts", tags=["Аккаунты"])
@@ -23,6 +24,13 @@ router = APIRouter(prefix="/accounts", tags=["Аккаунты"])
         "по соответствующим полям. Проверка идет без учета регистра и может "
         "использоваться для проверки только части строки от заданного параметра."
         "\n\n"
+        "Параметр `mode` задает способ сравнения строк:\n"
+        "- `CONTAINS` - поиск подстроки (по умолчанию)\n"
+        "- `PREFIX` - поиск по началу строки\n"
+        "- `SIMILAR` - нечеткий поиск по триграммам (допускает опечатки)\n\n"
+        "Если `rankBySimilarity` равен `true`, то результаты сортируются по "
+        "убыванию схожести с заданными параметрами."
+        "\n\n"
         "Параметры `from` и `size` позволяют реализовать пагинацию. Первый "
         "параметр отвечает за количество пропущенных элементов от начала. "
         "Второй - за количество элементов на странице"
@@ -37,11 +45,41 @@ async def search_accounts(
     email: Annotated[str | None, Query()] = None,
     offset: Annotated[int, Query(alias="from"), Ge(0)] = 0,
     size: Annotated[int, Query(), Ge(1)] = 10,
+    mode: Annotated[AccountSearchMode, Query()] = AccountSearchMode.CONTAINS,
+    rank_by_similarity: Annotated[bool, Query(alias="rankBySimilarity")] = False,
 ) -> list[AccountDto]:
-    accounts = await service.search(session, first_name, last_name, email, offset, size)
+    accounts = await service.search(
+        session,
+        first_name,
+        last_name,
+        email,
+        offset,
+        size,
+        mode,
+        rank_by_similarity,
+    )
     return list(map(AccountDto.model_validate, accounts))
 
 
+@router.get(
+    "/batch",
+    summary="Получить данные множества аккаунтов по id за один запрос",
+    description=(
+        "Параметр `id` указывается несколько раз (не более 1000). В поле "
+        "`found` возвращаются аккаунты по id, в поле `missing` - id, для "
+        "которых аккаунтов не существует."
+    ),
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_accounts_batch(
+    session: DbSessionDep,
+    service: AccountServiceDep,
+    ids: Annotated[list[int], Query(alias="id"), Len(1, 1000)],
+) -> BatchDto[AccountDto]:
+    accounts = await service.get_many(session, ids)
+    return BatchDto[AccountDto].of(ids, accounts)
+
+
 @router.get(
     "/{id}",
     summary="Получить данные аккаунта по id",
@@ -1,6 +1,6 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from if_else_2024.accounts.dto import UpdateAccountDto
+from if_else_2024.accounts.dto import AccountSearchMode, UpdateAccountDto
 from if_else_2024.accounts.repositories import AccountRepository
 from if_else_2024.auth.utils import pass_context
 from if_else_2024.core.exceptions import (
@@ -23,6 +23,11 @@ class AccountService:
             raise EntityNotFoundException("Account with given id was not found")
         return account
 
+    async def get_many(self, session: AsyncSession, ids: list[int]):
+        """Returns mapping from id to account, ids of missing accounts are omitted"""
+        accounts = await self._repository.get_by_ids(session, ids)
+        return {account.id: account for account in accounts}
+
     async def search(
         self,
         session: AsyncSession,
@@ -31,10 +36,19 @@ class AccountService:
         email: str | None,
         offset: int,
         size: int,
+        mode: AccountSearchMode = AccountSearchMode.CONTAINS,
+        rank_by_similarity: bool = False,
     ):
         return list(
             await self._repository.search(
-                session, first_name, last_name, email, offset, size
+                session,
+                first_name,
+                last_name,
+                email,
+                offset,
+                size,
+                mode,
+                rank_by_similarity,
             )
         )
 
@@ -0,0 +1,22 @@
+from datetime import datetime
+from typing import Annotated
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from if_else_2024.changes.models import ChangeEntity, ChangeOperation
+
+
+class ChangeDto(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    entity: ChangeEntity
+    entity_id: Annotated[int, Field(serialization_alias="entityId")]
+    region_id: Annotated[int, Field(serialization_alias="regionId")]
+    operation: ChangeOperation
+    changed_at: Annotated[datetime, Field(serialization_alias="changedAt")]
+
+
+class ChangesPageDto(BaseModel):
+    items: list[ChangeDto]
+    # Is returned even for an empty page, so it can be polled
+    next_cursor: Annotated[str, Field(serialization_alias="nextCursor")]
@@ -0,0 +1,40 @@
+from datetime import datetime
+from enum import StrEnum
+
+from sqlalchemy import BigInteger, Index, func, text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from if_else_2024.core.db_manager import Base
+
+
+class ChangeEntity(StrEnum):
+    WEATHER = "WEATHER"
+    FORECAST = "FORECAST"
+
+
+class ChangeOperation(StrEnum):
+    CREATE = "CREATE"
+    UPDATE = "UPDATE"
+    DELETE = "DELETE"
+
+
+class Change(Base):
+    """
+    Outbox of weather and forecasts changes, written in the transaction of the
+    change itself. Regions are not referenced by FK, so changes outlive them
+    """
+
+    __tablename__ = "changes"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    # Id of the writing transaction, see `ChangeRepository.get_after`
+    transaction_id: Mapped[int] = mapped_column(
+        BigInteger, server_default=text("pg_current_xact_id()::text::bigint")
+    )
+    entity: Mapped[ChangeEntity]
+    entity_id: Mapped[int]
+    region_id: Mapped[int]
+    operation: Mapped[ChangeOperation]
+    changed_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+    __table_args__ = (Index("ix_changes_transaction_id_id", "transaction_id", "id"),)
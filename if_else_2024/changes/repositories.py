@@ -0,0 +1,101 @@
+from sqlalchemy import (
+    BigInteger,
+    Text,
+    cast,
+    exists,
+    func,
+    insert,
+    literal,
+    select,
+    tuple_,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from if_else_2024.changes.models import Change, ChangeEntity, ChangeOperation
+from if_else_2024.forecasts.models import Forecast
+from if_else_2024.weather.models import Weather
+
+
+def finished_transactions_bound():
+    """Transactions with lower ids are finished, see `ChangeRepository.get_after`"""
+    return cast(
+        cast(func.pg_snapshot_xmin(func.pg_current_snapshot()), Text), BigInteger
+    )
+
+
+class ChangeRepository:
+    async def add_many(
+        self,
+        session: AsyncSession,
+        entity: ChangeEntity,
+        operation: ChangeOperation,
+        ids: list[tuple[int, int]],
+    ):
+        """`ids` are pairs of id of the changed entity and its region id"""
+        if len(ids) == 0:
+            return
+
+        await session.execute(
+            insert(Change),
+            [
+                {
+                    "entity": entity,
+                    "entity_id": id,
+                    "region_id": region_id,
+                    "operation": operation,
+                }
+                for id, region_id in ids
+            ],
+        )
+
+    async def add_region_deletes(self, session: AsyncSession, region_id: int):
+        """Records deletes of weather and forecasts cascaded from the region"""
+        for entity, model in (
+            (ChangeEntity.WEATHER, Weather),
+            (ChangeEntity.FORECAST, Forecast),
+        ):
+            await session.execute(
+                insert(Change).from_select(
+                    ["entity", "entity_id", "region_id", "operation"],
+                    select(
+                        literal(entity, Change.entity.type),
+                        model.id,
+                        model.region_id,
+                        literal(ChangeOperation.DELETE, Change.operation.type),
+                    ).where(model.region_id == region_id),
+                )
+            )
+
+    async def exists_by_id(self, session: AsyncSession, id: int):
+        q = select(exists().where(Change.id == id))
+        return (await session.execute(q)).scalar_one()
+
+    async def get_after(
+        self,
+        session: AsyncSession,
+        after: tuple[int, int] | None,
+        entity: ChangeEntity | None,
+        size: int,
+    ):
+        """
+        Changes are ordered by transaction id and id. Only changes of
+        transactions older than every running one are returned: those can not
+        be followed by a change with a lower position, so a reader which
+        continues after the last returned change never misses any
+        """
+        conditions = [Change.transaction_id < finished_transactions_bound()]
+
+        if after is not None:
+            conditions.append(tuple_(Change.transaction_id, Change.id) > tuple_(*after))
+
+        if entity is not None:
+            conditions.append(Change.entity == entity)
+
+        q = (
+            select(Change)
+            .where(*conditions)
+            .order_by(Change.transaction_id, Change.id)
+            .limit(size)
+        )
+        s = await session.execute(q)
+        return s.scalars().all()
@@ -0,0 +1,54 @@
+from typing import Annotated
+
+from annotated_types import Ge, Le
+from fastapi import APIRouter, Depends, Query, status
+
+from if_else_2024.auth.dependencies import authenticate_user
+from if_else_2024.changes.dto import ChangeDto, ChangesPageDto
+from if_else_2024.changes.models import ChangeEntity
+from if_else_2024.core.dependencies import ChangeServiceDep, DbSessionDep
+
+router = APIRouter(prefix="/changes", tags=["Журнал изменений"])
+
+
+@router.get(
+    "",
+    summary="Получить изменения погоды и прогнозов после курсора",
+    description=(
+        "Возвращает созданные, измененные и удаленные записи о погоде и "
+        "прогнозы в порядке изменения. Записи указываются по `entity` и "
+        "`entityId`, их актуальные данные можно получить пакетными запросами."
+        "\n\n"
+        "Без параметра `since` журнал читается с начала. В ответе всегда "
+        "возвращается `nextCursor`, который нужно передать в `since` в "
+        "следующем запросе, даже если страница пуста. Изменения еще не "
+        "завершенных транзакций возвращаются только после их завершения, "
+        "поэтому при чтении по курсору изменения не пропускаются."
+        "\n\n"
+        "Параметр `entity` оставляет изменения только указанного типа, "
+        "параметр `size` задает размер страницы."
+        "\n\n"
+        "Изменения старше срока, заданного политикой хранения `CHANGES`, "
+        "удаляются. Если изменение, на которое указывает курсор, уже удалено, "
+        "возвращается 410: часть изменений после курсора могла быть потеряна, "
+        "поэтому нужно заново загрузить актуальные данные и читать журнал с "
+        "начала."
+    ),
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"description": "Неверный курсор"},
+        status.HTTP_410_GONE: {"description": "Изменения после курсора удалены"},
+    },
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_changes(
+    session: DbSessionDep,
+    service: ChangeServiceDep,
+    since: Annotated[str | None, Query()] = None,
+    entity: Annotated[ChangeEntity | None, Query()] = None,
+    size: Annotated[int, Query(), Ge(1), Le(10000)] = 1000,
+) -> ChangesPageDto:
+    changes, next_cursor = await service.get_since(session, since, entity, size)
+    return ChangesPageDto(
+        items=list(map(ChangeDto.model_validate, changes)),
+        next_cursor=next_cursor,
+    )
@@ -0,0 +1,49 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from if_else_2024.changes.models import ChangeEntity
+from if_else_2024.changes.repositories import ChangeRepository
+from if_else_2024.core.exceptions import (
+    IntegrityBreachException,
+    ResourceGoneException,
+)
+from if_else_2024.utils import decode_cursor, encode_cursor
+
+
+class ChangeService:
+    def __init__(self, repository: ChangeRepository):
+        self._repository = repository
+
+    async def get_since(
+        self,
+        session: AsyncSession,
+        cursor: str | None,
+        entity: ChangeEntity | None,
+        size: int,
+    ):
+        """
+        Returns page of changes and the cursor to continue after it. Retention
+        deletes changes in the order of the log, so a cursor of a deleted
+        change may be followed by deleted changes and can not be continued
+        """
+        after = None if cursor is None else self._parse_cursor(cursor)
+        if after is not None and not await self._repository.exists_by_id(
+            session, after[1]
+        ):
+            raise ResourceGoneException("Changes after the cursor were deleted")
+        changes = list(await self._repository.get_after(session, after, entity, size))
+
+        if changes:
+            after = (changes[-1].transaction_id, changes[-1].id)
+        # Empty cursor points to the beginning of the log
+        return changes, encode_cursor([] if after is None else list(after))
+
+    @staticmethod
+    def _parse_cursor(cursor: str):
+        values = decode_cursor(cursor)
+        if values == []:
+            return None
+        try:
+            transaction_id, id = values
+            return int(transaction_id), int(id)
+        except (TypeError, ValueError):
+            raise IntegrityBreachException("Invalid cursor") from None
@@ -0,0 +1,166 @@
+import logging
+import math
+from enum import IntEnum
+from time import monotonic
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from if_else_2024.core.exceptions import (
+    ServiceUnavailableException,
+    handle_app_exception,
+)
+from if_else_2024.core.metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionPriority(IntEnum):
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+
+""" Part of the limit, which requests of the priority may occupy """
+ADMISSION_PRIORITY_SHARES = {
+    AdmissionPriority.LOW: 0.5,
+    AdmissionPriority.NORMAL: 0.8,
+    AdmissionPriority.HIGH: 1.0,
+}
+
+# Long-lived streams would hold their slots for the whole connection
+_EXCLUDED_PATHS = {"/metrics", "/region/weather/events"}
+_EXCLUDED_PREFIXES = ("/docs", "/redoc", "/openapi.json")
+_HIGH_PRIORITY_PATHS = {"/login", "/registration"}
+_LOW_PRIORITY_SUFFIXES = (
+    "/search",
+    "/export",
+    "/aggregate",
+    "/scores",
+    "/nearest",
+    "/within-radius",
+    "/within-box",
+    "/descendants",
+    "/ancestors",
+    "/changes",
+)
+# Batches carry many items and buffered writes do no database work, so their
+# latency tells nothing about the load
+_BULK_SUFFIXES = ("/batch", "/buffered")
+
+
+def classify_request(method: str, path: str) -> AdmissionPriority | None:
+    """Returns `None` for requests, which are not subject to admission control"""
+    if path in _EXCLUDED_PATHS or path.startswith(_EXCLUDED_PREFIXES):
+        return None
+    if method not in ("GET", "HEAD") or path in _HIGH_PRIORITY_PATHS:
+        return AdmissionPriority.HIGH
+    if path.endswith(_LOW_PRIORITY_SUFFIXES):
+        return AdmissionPriority.LOW
+    return AdmissionPriority.NORMAL
+
+
+def adapts_limit(priority: AdmissionPriority, path: str):
+    """
+    Searches, exports and bulk writes are slow by nature, so they would
+    shrink the limit on their own
+    """
+    return priority != AdmissionPriority.LOW and not path.endswith(_BULK_SUFFIXES)
+
+
+class AdmissionController:
+    """
+    Limits requests in flight of this process. The limit follows observed
+    latency: it grows by one per `limit` requests faster than
+    `latency_target` and is multiplied by `decrease_factor`, when they are
+    slower, at most once per `latency_target` seconds
+    """
+
+    def __init__(
+        self,
+        metrics: MetricsRegistry,
+        min_limit: int,
+        max_limit: int,
+        latency_target: float,
+        decrease_factor: float = 0.9,
+    ):
+        self._metrics = metrics
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._latency_target = latency_target
+        self._decrease_factor = decrease_factor
+        self._limit = float(max_limit)
+        self._in_flight = 0
+        self._decreased_at = 0.0
+        self._metrics.set("admission_limit", self._limit)
+        self._metrics.set("admission_in_flight", 0)
+
+    @property
+    def retry_after(self):
+        return max(math.ceil(self._latency_target), 1)
+
+    def try_acquire(self, priority: AdmissionPriority):
+        if self._in_flight >= self._limit * ADMISSION_PRIORITY_SHARES[priority]:
+            self._metrics.inc("admission_rejected_total", priority=priority.name)
+            return False
+
+        self._set_in_flight(1)
+        return True
+
+    def release(self, latency: float | None):
+        """`latency` is `None` for requests, which should not affect the limit"""
+        self._set_in_flight(-1)
+        if latency is None:
+            return
+
+        if latency <= self._latency_target:
+            self._limit = min(self._limit + 1 / self._limit, self._max_limit)
+        else:
+            now = monotonic()
+            if now - self._decreased_at < self._latency_target:
+                return
+            self._decreased_at = now
+            self._limit = max(self._limit * self._decrease_factor, self._min_limit)
+            logger.warning("Admission limit was decreased to %.1f", self._limit)
+        self._metrics.set("admission_limit", self._limit)
+
+    def _set_in_flight(self, delta: int):
+        self._in_flight += delta
+        self._metrics.set("admission_in_flight", self._in_flight)
+
+
+class AdmissionMiddleware:
+    """
+    Rejects requests with 503 right away, when the controller has no room for
+    them, instead of queueing them on the connection pool
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController):
+        self._app = app
+        self._controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self._app(scope, receive, send)
+
+        priority = classify_request(scope["method"], scope["path"])
+        if priority is None:
+            return await self._app(scope, receive, send)
+
+        if not self._controller.try_acquire(priority):
+            response = handle_app_exception(
+                None,
+                ServiceUnavailableException(
+                    "Server is overloaded", self._controller.retry_after
+                ),
+            )
+            return await response(scope, receive, send)
+
+        started_at = monotonic()
+        try:
+            await self._app(scope, receive, send)
+        finally:
+            self._controller.release(
+                monotonic() - started_at
+                if adapts_limit(priority, scope["path"])
+                else None
+            )
@@ -0,0 +1,83 @@
+from typing import Any, Generic, Hashable, Protocol, TypeVar
+
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+
+from if_else_2024.core.db_manager import Base
+from if_else_2024.core.metrics import MetricsRegistry
+
+T = TypeVar("T", bound=Base)
+
+""" Column values of an entity in the order of mapper columns """
+Snapshot = tuple[Any, ...]
+
+
+class CacheBackend(Protocol):
+    def get(self, key: Hashable) -> Any | None: ...
+
+    def set(self, key: Hashable, value: Any): ...
+
+    def delete(self, key: Hashable): ...
+
+    def clear(self): ...
+
+    def __len__(self) -> int: ...
+
+
+class EntityCache(Generic[T]):
+    """
+    Read-through cache of entities by id, shared by sessions of this process.
+    Keeps immutable snapshots of column values, hits are merged into the
+    session of the caller without loading, so returned entities are usual
+    persistent ones. Relationships are not cached and are loaded lazily.
+    Must be subscribed to invalidations of the entity table
+    """
+
+    def __init__(self, model: type[T], backend: CacheBackend, metrics: MetricsRegistry):
+        self._model = model
+        self._backend = backend
+        self._metrics = metrics
+        self._keys = [attr.key for attr in inspect(model).column_attrs]
+        # Snapshots loaded concurrently with an invalidation may be stale
+        self._version = 0
+
+    @property
+    def entity(self):
+        return self._model.__tablename__
+
+    async def get(self, session: AsyncSession, id: int) -> T | None:
+        # Entity of the session may have changes, which must not be overwritten
+        entity = session.identity_map.get(identity_key(self._model, id))
+        if entity is not None:
+            return entity
+
+        snapshot: Snapshot | None = self._backend.get(id)
+        if snapshot is not None:
+            self._metrics.inc("entity_cache_hits_total", entity=self.entity)
+            return await session.merge(self._restore(snapshot), load=False)
+
+        self._metrics.inc("entity_cache_misses_total", entity=self.entity)
+        version = self._version
+        entity = await session.get(self._model, id)
+        if entity is not None and version == self._version:
+            self._backend.set(id, tuple(getattr(entity, key) for key in self._keys))
+            self._update_size_metric()
+        return entity
+
+    def invalidate(self, id: int | None):
+        self._version += 1
+        if id is None:
+            self._backend.clear()
+        else:
+            self._backend.delete(id)
+        self._update_size_metric()
+
+    def _restore(self, snapshot: Snapshot) -> T:
+        entity = self._model(**dict(zip(self._keys, snapshot)))
+        make_transient_to_detached(entity)
+        return entity
+
+    def _update_size_metric(self):
+        self._metrics.set("entity_cache_size", len(self._backend), entity=self.entity)
@@ -1,9 +1,14 @@
 # flake8: noqa: E402
+import asyncio
 import logging
 from contextlib import asynccontextmanager
+from typing import Callable
 
+import psycopg
+from psycopg import sql
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import DeclarativeBase, Session
 
 logger = logging.getLogger(__name__)
 
@@ -18,12 +23,23 @@ from if_else_2024.auth.models import AuthSession
 from if_else_2024.regions.models import RegionType, Region
 from if_else_2024.forecasts.models import Forecast
 from if_else_2024.weather.models import Weather
+from if_else_2024.retention.models import WeatherArchive, ForecastArchive
+from if_else_2024.changes.models import Change
 
 
 class DatabaseManager:
-    def __init__(self, db_url: str):
+    def __init__(
+        self,
+        db_url: str,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_timeout: float = 30,
+    ):
         self._engine = create_async_engine(
             db_url,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
         )
         self._sessionmaker = async_sessionmaker(
             self._engine, expire_on_commit=False, autoflush=False
@@ -34,6 +50,57 @@ class DatabaseManager:
             await connection.run_sync(Base.metadata.create_all)
             logger.info("Database was successfully initialized")
 
+    def on_commit(self, callback: Callable[[Session], None]):
+        """Calls `callback` after each commit of sessions of this manager"""
+
+        def handle(session: Session):
+            if session.bind is self._engine.sync_engine:
+                callback(session)
+
+        event.listen(Session, "after_commit", handle)
+
+    async def listen(
+        self,
+        channel: str,
+        callback: Callable[[str], None],
+        on_connect: Callable[[], None] | None = None,
+        reconnect_delay: float = 1,
+    ):
+        """
+        Calls `callback` with payload of each notification from `channel` until
+        cancelled. Holds a dedicated connection outside of the pool and
+        reconnects, if it is lost. `on_connect` is called after each connection
+        """
+        url = self._engine.url.set(drivername="postgresql")
+        conninfo = url.render_as_string(hide_password=False)
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                    conninfo, autocommit=True
+                ) as connection:
+                    await connection.execute(
+                        sql.SQL("LISTEN {}").format(sql.Identifier(channel))
+                    )
+                    logger.info("Listening to notifications from %s", channel)
+                    if on_connect is not None:
+                        on_connect()
+
+                    async for notify in connection.notifies():
+                        try:
+                            callback(notify.payload)
+                        except Exception as ex:
+                            logger.error(
+                                "Exception was thrown during notification handling",
+                                exc_info=ex,
+                            )
+            except psycopg.OperationalError as ex:
+                logger.error(
+                    "Lost connection listening to %s. Reconnecting",
+                    channel,
+                    exc_info=ex,
+                )
+                await asyncio.sleep(reconnect_delay)
+
     async def dispose(self):
         await self._engine.dispose()
         logger.info("Closed connection with database")
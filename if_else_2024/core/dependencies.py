@@ -5,11 +5,13 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from if_else_2024.accounts.services import AccountService
 from if_else_2024.auth.services import AuthService
+from if_else_2024.changes.services import ChangeService
 from if_else_2024.core.db_manager import DatabaseManager
+from if_else_2024.core.metrics import MetricsRegistry
 from if_else_2024.core.settings import AppSettings
 from if_else_2024.forecasts.services import ForecastService
 from if_else_2024.regions.services import RegionService, RegionTypeService
-from if_else_2024.weather.services import WeatherService
+from if_else_2024.weather.services import WeatherBufferService, WeatherService
 
 
 def get_settings(request: Request) -> AppSettings:
@@ -20,6 +22,10 @@ def get_database_manager(request: Request) -> DatabaseManager:
     return request.app.state.database_manager
 
 
+def get_metrics_registry(request: Request) -> MetricsRegistry:
+    return request.app.state.metrics
+
+
 def get_account_service(request: Request) -> AccountService:
     return request.app.state.account_service
 
@@ -44,6 +50,14 @@ def get_weather_service(request: Request) -> WeatherService:
     return request.app.state.weather_service
 
 
+def get_change_service(request: Request) -> ChangeService:
+    return request.app.state.change_service
+
+
+def get_weather_buffer_service(request: Request) -> WeatherBufferService:
+    return request.app.state.weather_buffer_service
+
+
 async def get_db_session(db: Annotated[DatabaseManager, Depends(get_database_manager)]):
     async with db.create_session() as session:
         yield session
@@ -51,10 +65,15 @@ async def get_db_session(db: Annotated[DatabaseManager, Depends(get_database_man
 
 SettingsDep = Annotated[AppSettings, Depends(get_settings)]
 DatabaseManagerDep = Annotated[DatabaseManager, Depends(get_database_manager)]
+MetricsRegistryDep = Annotated[MetricsRegistry, Depends(get_metrics_registry)]
 AccountServiceDep = Annotated[AccountService, Depends(get_account_service)]
 AuthServiceDep = Annotated[AuthService, Depends(get_auth_service)]
 RegionServiceDep = Annotated[RegionService, Depends(get_region_service)]
 RegionTypeServiceDep = Annotated[RegionTypeService, Depends(get_region_type_service)]
 ForecastServiceDep = Annotated[ForecastService, Depends(get_forecast_service)]
 WeatherServiceDep = Annotated[WeatherService, Depends(get_weather_service)]
+WeatherBufferServiceDep = Annotated[
+    WeatherBufferService, Depends(get_weather_buffer_service)
+]
+ChangeServiceDep = Annotated[ChangeService, Depends(get_change_service)]
 DbSessionDep = Annotated[AsyncSession, Depends(get_db_session)]
@@ -0,0 +1,21 @@
+from typing import Generic, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class BatchDto(BaseModel, Generic[T]):
+    """Result of a batch read. Requested ids without an entity are `missing`"""
+
+    found: dict[int, T]
+    missing: list[int]
+
+    @classmethod
+    def of(cls, ids: list[int], entities: dict[int, object]):
+        """Keeps the order of requested ids and drops duplicates"""
+        ids = list(dict.fromkeys(ids))
+        return cls(
+            found={id: entities[id] for id in ids if id in entities},
+            missing=[id for id in ids if id not in entities],
+        )
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Hashable, Iterable
+
+from if_else_2024.core.metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+SSE_HEARTBEAT = ": heartbeat\n\n"
+
+
+def format_sse_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+class EventHub:
+    """
+    Fans out server-sent events published by key to subscribers of this
+    process. Every subscriber has a bounded queue and publishing never waits:
+    subscribers, which do not keep up, are disconnected and have to resubscribe
+    """
+
+    def __init__(
+        self,
+        name: str,
+        metrics: MetricsRegistry,
+        queue_size: int,
+        heartbeat_interval: float,
+    ):
+        self._name = name
+        self._metrics = metrics
+        self._queue_size = queue_size
+        self._heartbeat_interval = heartbeat_interval
+        self._subscribers: dict[Hashable, set[asyncio.Queue]] = {}
+        self._keys: dict[asyncio.Queue, set[Hashable]] = {}
+
+    def has_subscribers(self, key: Hashable):
+        return key in self._subscribers
+
+    def keys(self):
+        """Keys, which have subscribers"""
+        return list(self._subscribers)
+
+    def publish(self, key: Hashable, message: str):
+        """`message` is already encoded, so it is shared by all subscribers"""
+        for queue in list(self._subscribers.get(key, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drop(queue)
+
+    async def stream(self, keys: Iterable[Hashable]):
+        """
+        Yields messages published by any of `keys` until the subscriber is
+        dropped. Heartbeat comments are sent when there are no messages, so
+        proxies do not close idle connections
+        """
+        keys = set(keys)
+        queue: asyncio.Queue[str | None] = asyncio.Queue(self._queue_size)
+        self._keys[queue] = keys
+        for key in keys:
+            self._subscribers.setdefault(key, set()).add(queue)
+        self._update_subscribers_metric()
+
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(
+                        queue.get(), self._heartbeat_interval
+                    )
+                except TimeoutError:
+                    yield SSE_HEARTBEAT
+                    continue
+
+                if message is None:
+                    return
+                yield message
+        finally:
+            self._unsubscribe(queue)
+
+    def _drop(self, queue: asyncio.Queue):
+        # Subscriber is going to miss events anyway, so the pending ones are
+        # discarded and the end of the stream is delivered instead
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+        self._unsubscribe(queue)
+
+        self._metrics.inc("events_dropped_subscribers_total", hub=self._name)
+        logger.warning("Dropped slow subscriber of %s events", self._name)
+
+    def _unsubscribe(self, queue: asyncio.Queue):
+        for key in self._keys.pop(queue, ()):
+            queues = self._subscribers[key]
+            queues.discard(queue)
+            if len(queues) == 0:
+                del self._subscribers[key]
+        self._update_subscribers_metric()
+
+    def _update_subscribers_metric(self):
+        self._metrics.set("events_subscribers", len(self._keys), hub=self._name)
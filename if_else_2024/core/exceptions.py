@@ -9,9 +9,11 @@ class AppException(Exception):
         self,
         details: str | None = None,
         status_code: int = status.HTTP_500_INTERNAL_SERVER_ERROR,
+        headers: dict[str, str] | None = None,
     ):
         self.__details = "Unknown error" if details is None else details
         self.__status_code = status_code
+        self.__headers = headers
 
     @property
     def details(self):
@@ -21,6 +23,10 @@ class AppException(Exception):
     def status_code(self):
         return self.__status_code
 
+    @property
+    def headers(self):
+        return self.__headers
+
     def __str__(self) -> str:
         return self.__details
 
@@ -65,10 +71,28 @@ class IntegrityBreachException(AppException):
         )
 
 
+class ResourceGoneException(AppException):
+    def __init__(self, details: str | None = None):
+        super().__init__(
+            "Resource is gone" if details is None else details,
+            status.HTTP_410_GONE,
+        )
+
+
+class ServiceUnavailableException(AppException):
+    def __init__(self, details: str | None = None, retry_after: int = 1):
+        super().__init__(
+            "Service unavailable" if details is None else details,
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            {"Retry-After": str(retry_after)},
+        )
+
+
 def handle_app_exception(request: Request, exception: AppException):
     return JSONResponse(
         status_code=exception.status_code,
         content={"details": exception.details},
+        headers=exception.headers,
     )
 
 
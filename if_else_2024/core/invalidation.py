@@ -0,0 +1,95 @@
+import logging
+import time
+import uuid
+from typing import Callable
+
+from sqlalchemy import Text, cast, func, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from if_else_2024.core.metrics import MetricsRegistry
+from if_else_2024.utils import ids_array
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "invalidation"
+
+_COMMITTED_KEY = "invalidations"
+
+# Tells messages of this process, which are applied already at commit
+_ORIGIN = uuid.uuid4().hex
+
+""" Is called with id of changed entity or with `None`, if all were changed """
+InvalidationHandler = Callable[[int | None], None]
+
+
+async def publish_invalidation(session: AsyncSession, entity: str, id: int | None):
+    """
+    Sends `entity:id:timestamp:origin` through NOTIFY, id is empty, if all
+    entities were changed. Postgres delivers it to listeners only when the transaction
+    is committed, and drops it on rollback. Caches of this process are
+    invalidated right after the commit, see `InvalidationBus.dispatch_committed`
+    """
+    payload = f"{entity}:{'' if id is None else id}:{time.time():.6f}:{_ORIGIN}"
+    await session.execute(select(func.pg_notify(INVALIDATION_CHANNEL, payload)))
+    session.info.setdefault(_COMMITTED_KEY, []).append((entity, id))
+
+
+async def publish_invalidations(session: AsyncSession, entity: str, ids: list[int]):
+    """Same as `publish_invalidation` for each of `ids` in a single query"""
+    if len(ids) == 0:
+        return
+
+    values = func.unnest(ids_array(ids)).table_valued("id").render_derived()
+    payload = (
+        literal(f"{entity}:")
+        + cast(values.c.id, Text)
+        + literal(f":{time.time():.6f}:{_ORIGIN}")
+    )
+    await session.execute(select(func.pg_notify(INVALIDATION_CHANNEL, payload)))
+    session.info.setdefault(_COMMITTED_KEY, []).extend((entity, id) for id in ids)
+
+
+class InvalidationBus:
+    """Applies invalidation messages from all workers to caches of this one"""
+
+    def __init__(self, metrics: MetricsRegistry):
+        self._metrics = metrics
+        self._handlers: dict[str, list[InvalidationHandler]] = {}
+
+    def subscribe(self, entity: str, handler: InvalidationHandler):
+        self._handlers.setdefault(entity, []).append(handler)
+
+    def dispatch(self, payload: str):
+        try:
+            entity, id, sent_at, origin = payload.split(":")
+            id, sent_at = (int(id) if id else None), float(sent_at)
+        except ValueError:
+            logger.warning("Received malformed invalidation message %r", payload)
+            return
+
+        if origin != _ORIGIN:
+            self._invalidate(entity, id)
+
+        latency = max(time.time() - sent_at, 0)
+        self._metrics.inc("invalidation_messages_total", entity=entity)
+        self._metrics.inc("invalidation_latency_seconds_sum", latency, entity=entity)
+        self._metrics.set("invalidation_last_latency_seconds", latency, entity=entity)
+
+    def reset(self):
+        """Messages could be missed while listener was disconnected"""
+        for handlers in self._handlers.values():
+            for handler in handlers:
+                handler(None)
+
+    def dispatch_committed(self, session: Session):
+        """
+        Applies invalidations published in the committed transaction without
+        waiting for their notifications, so the worker reads its own writes
+        """
+        for entity, id in session.info.pop(_COMMITTED_KEY, ()):
+            self._invalidate(entity, id)
+
+    def _invalidate(self, entity: str, id: int | None):
+        for handler in self._handlers.get(entity, ()):
+            handler(id)
@@ -0,0 +1,57 @@
+from threading import Lock
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    """
+    In-process counters and gauges rendered in Prometheus text format.
+    Values are not shared between worker processes
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._types: dict[str, str] = {}
+        self._values: dict[str, dict[Labels, float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        with self._lock:
+            values = self._get_values(name, "counter")
+            key = self._labels_key(labels)
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str):
+        with self._lock:
+            self._get_values(name, "gauge")[self._labels_key(labels)] = value
+
+    def get(self, name: str, **labels: str) -> float | None:
+        with self._lock:
+            return self._values.get(name, {}).get(self._labels_key(labels))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, values in sorted(self._values.items()):
+                lines.append(f"# TYPE {name} {self._types[name]}")
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+        return "".join(line + "\n" for line in lines)
+
+    def _get_values(self, name: str, type: str):
+        if self._types.setdefault(name, type) != type:
+            raise ValueError(f"Metric {name} is already registered as another type")
+        return self._values.setdefault(name, {})
+
+    @staticmethod
+    def _labels_key(labels: dict[str, str]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    @staticmethod
+    def _format_labels(labels: Labels) -> str:
+        if len(labels) == 0:
+            return ""
+        pairs = ",".join(
+            '{}="{}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"'))
+            for key, value in labels
+        )
+        return "{" + pairs + "}"
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from if_else_2024.auth.dependencies import authenticate_user
+from if_else_2024.core.dependencies import MetricsRegistryDep
+
+router = APIRouter(tags=["Метрики"])
+
+
+@router.get(
+    "/metrics",
+    summary="Метрики приложения в текстовом формате Prometheus",
+    description=(
+        "Метрики хранятся в памяти процесса, поэтому при нескольких воркерах "
+        "каждый из них отдает свои значения."
+    ),
+    response_class=PlainTextResponse,
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_metrics(metrics: MetricsRegistryDep):
+    return metrics.render()
@@ -1,3 +1,5 @@
+from typing import Any
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -5,9 +7,40 @@ class AppSettings(BaseSettings):
     model_config = SettingsConfigDict(secrets_dir="/run/secrets")
 
     db_url: str
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
     server_url: str | None = None
     cors_allowed_origins: list[str]
     auth_session_lifetime: int = 3600
+    # Defaults to the size of the connection pool with overflow
+    admission_max_limit: int | None = None
+    admission_min_limit: int = 1
+    admission_latency_target: float = 0.5
+    weather_export_batch_size: int = 1000
+    weather_partitions_ahead: int = 3
+    weather_partitions_detach_after: int | None = None
+    weather_partitions_maintenance_interval: int = 3600
+    weather_events_queue_size: int = 16
+    weather_events_heartbeat_interval: float = 15
+    weather_buffer_size: int = 10000
+    weather_buffer_batch_size: int = 1000
+    weather_buffer_flush_interval: float = 1
+    weather_buffer_flush_retries: int = 5
+    weather_buffer_retry_delay: float = 0.5
+    # Per entity table overrides of the defaults below
+    entity_cache_ttls: dict[str, float] = {}
+    entity_cache_sizes: dict[str, int] = {}
+    entity_cache_ttl: float = 60
+    entity_cache_size: int = 10000
+    forecast_scores_batch_size: int = 100000
+    forecast_scores_cache_ttl: int = 300
+    forecast_scores_cache_size: int = 128
+    # Parsed by `parse_retention_policies`
+    retention_policies: list[dict[str, Any]] = []
+    retention_batch_size: int = 1000
+    retention_max_batches: int = 100
+    retention_interval: int = 3600
 
     create_fake_data: bool = False
     fake_accounts_count: int = 100
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import sys
 from contextlib import asynccontextmanager
@@ -11,28 +12,58 @@ from if_else_2024.core.db_manager import DatabaseManager
 
 # isort: on
 
+from if_else_2024.accounts.models import Account
 from if_else_2024.accounts.repositories import AccountRepository
 from if_else_2024.accounts.routers import router as accounts_router
 from if_else_2024.accounts.services import AccountService
 from if_else_2024.auth.repositories import AuthRepository
 from if_else_2024.auth.routers import router as auth_router
 from if_else_2024.auth.services import AuthService
+from if_else_2024.changes.repositories import ChangeRepository
+from if_else_2024.changes.routers import router as changes_router
+from if_else_2024.changes.services import ChangeService
+from if_else_2024.core.admission import AdmissionController, AdmissionMiddleware
+from if_else_2024.core.cache import EntityCache
+from if_else_2024.core.events import EventHub
 from if_else_2024.core.exceptions import (
     AppException,
     handle_app_exception,
     handle_validation_exception,
 )
+from if_else_2024.core.invalidation import INVALIDATION_CHANNEL, InvalidationBus
+from if_else_2024.core.metrics import MetricsRegistry
+from if_else_2024.core.routers import router as core_router
 from if_else_2024.core.settings import AppSettings
-from if_else_2024.core.utils import FakeDataCreator
+from if_else_2024.core.singleflight import SingleFlight
+from if_else_2024.core.utils import FakeDataCreator, run_periodically
+from if_else_2024.forecasts.models import Forecast
 from if_else_2024.forecasts.repositories import ForecastRepository
 from if_else_2024.forecasts.routers import router as forecast_router
 from if_else_2024.forecasts.services import ForecastService
+from if_else_2024.regions.models import Region, RegionType
 from if_else_2024.regions.repositories import RegionRepository, RegionTypeRepository
 from if_else_2024.regions.routers import router as regions_router
-from if_else_2024.regions.services import RegionService, RegionTypeService
-from if_else_2024.weather.repositories import WeatherRepository
+from if_else_2024.regions.services import (
+    RegionNameIndex,
+    RegionService,
+    RegionTypeCatalogue,
+    RegionTypeService,
+)
+from if_else_2024.retention.dto import parse_retention_policies
+from if_else_2024.retention.repositories import RetentionRepository
+from if_else_2024.retention.services import RetentionService
+from if_else_2024.utils import TtlCache
+from if_else_2024.weather.repositories import (
+    WeatherPartitionRepository,
+    WeatherRepository,
+    WeatherRollupRepository,
+)
 from if_else_2024.weather.routers import router as weather_router
-from if_else_2024.weather.services import WeatherService
+from if_else_2024.weather.services import (
+    WeatherBufferService,
+    WeatherPartitionService,
+    WeatherService,
+)
 
 
 def create_app() -> FastAPI:
@@ -53,10 +84,32 @@ def create_app() -> FastAPI:
 
     """ Setup global dependencies """
     app.state.settings = settings
-    app.state.database_manager = DatabaseManager(settings.db_url)
+    app.state.database_manager = DatabaseManager(
+        settings.db_url,
+        settings.db_pool_size,
+        settings.db_max_overflow,
+        settings.db_pool_timeout,
+    )
+    app.state.metrics = MetricsRegistry()
+    app.state.invalidation_bus = InvalidationBus(app.state.metrics)
+    app.state.database_manager.on_commit(app.state.invalidation_bus.dispatch_committed)
     _setup_app_dependencies(app)
 
     """ Setup middlewares """
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=AdmissionController(
+            app.state.metrics,
+            settings.admission_min_limit,
+            (
+                settings.db_pool_size + settings.db_max_overflow
+                if settings.admission_max_limit is None
+                else settings.admission_max_limit
+            ),
+            settings.admission_latency_target,
+        ),
+    )
+    # Added last, so rejected requests get CORS headers as well
     app.add_middleware(
         CORSMiddleware,
         allow_origins=settings.cors_allowed_origins,
@@ -71,6 +124,8 @@ def create_app() -> FastAPI:
     app.include_router(regions_router)
     app.include_router(forecast_router)
     app.include_router(weather_router)
+    app.include_router(changes_router)
+    app.include_router(core_router)
 
     """ Setup exception handlers """
     app.add_exception_handler(AppException, handle_app_exception)
@@ -82,38 +137,135 @@ def create_app() -> FastAPI:
 def _setup_app_dependencies(app: FastAPI):
     settings: AppSettings = app.state.settings
 
-    account_repository = AccountRepository()
+    account_repository = AccountRepository(_create_entity_cache(app, Account))
     auth_repository = AuthRepository()
-    region_repository = RegionRepository()
+    region_repository = RegionRepository(_create_entity_cache(app, Region))
     region_type_repository = RegionTypeRepository()
-    forecast_repository = ForecastRepository()
+    forecast_repository = ForecastRepository(_create_entity_cache(app, Forecast))
     weather_repository = WeatherRepository()
+    weather_rollup_repository = WeatherRollupRepository()
+    weather_partition_repository = WeatherPartitionRepository()
+    retention_repository = RetentionRepository()
+    change_repository = ChangeRepository()
 
     account_service = AccountService(account_repository, region_repository)
     auth_service = AuthService(
         auth_repository, account_repository, settings.auth_session_lifetime
     )
+    region_type_catalogue = RegionTypeCatalogue(region_type_repository)
+    app.state.invalidation_bus.subscribe(
+        RegionType.__tablename__, region_type_catalogue.invalidate
+    )
+
+    region_name_index = RegionNameIndex(region_repository)
+    app.state.invalidation_bus.subscribe(
+        Region.__tablename__, region_name_index.invalidate
+    )
+
     region_service = RegionService(
-        region_repository, region_type_repository, account_service
+        region_repository,
+        region_name_index,
+        change_repository,
+        SingleFlight("region", app.state.metrics),
+    )
+    region_type_service = RegionTypeService(
+        region_type_repository, region_repository, region_type_catalogue
+    )
+    forecast_service = ForecastService(
+        forecast_repository,
+        region_repository,
+        change_repository,
+        settings.forecast_scores_batch_size,
+        TtlCache(
+            settings.forecast_scores_cache_ttl, settings.forecast_scores_cache_size
+        ),
     )
-    region_type_service = RegionTypeService(region_type_repository, region_repository)
-    forecast_service = ForecastService(forecast_repository, region_repository)
     weather_service = WeatherService(
-        weather_repository, forecast_repository, region_repository
+        weather_repository,
+        weather_rollup_repository,
+        forecast_repository,
+        region_repository,
+        change_repository,
+        EventHub(
+            "weather",
+            app.state.metrics,
+            settings.weather_events_queue_size,
+            settings.weather_events_heartbeat_interval,
+        ),
+        SingleFlight("current_weather", app.state.metrics),
+        settings.weather_export_batch_size,
+    )
+    app.state.invalidation_bus.subscribe(
+        Region.__tablename__, weather_service.invalidate_current
+    )
+    weather_buffer_service = WeatherBufferService(
+        weather_service,
+        app.state.metrics,
+        settings.weather_buffer_size,
+        settings.weather_buffer_batch_size,
+        settings.weather_buffer_flush_interval,
+        settings.weather_buffer_flush_retries,
+        settings.weather_buffer_retry_delay,
+    )
+    weather_partition_service = WeatherPartitionService(
+        weather_partition_repository,
+        settings.weather_partitions_ahead,
+        settings.weather_partitions_detach_after,
+    )
+    change_service = ChangeService(change_repository)
+    retention_service = RetentionService(
+        retention_repository,
+        weather_rollup_repository,
+        app.state.metrics,
+        parse_retention_policies(settings.retention_policies),
+        settings.retention_batch_size,
+        settings.retention_max_batches,
     )
 
     app.state.account_service = account_service
     app.state.auth_service = auth_service
     app.state.region_service = region_service
     app.state.region_type_service = region_type_service
+    app.state.region_type_catalogue = region_type_catalogue
+    app.state.region_name_index = region_name_index
     app.state.forecast_service = forecast_service
     app.state.weather_service = weather_service
+    app.state.weather_buffer_service = weather_buffer_service
+    app.state.weather_partition_service = weather_partition_service
+    app.state.retention_service = retention_service
+    app.state.change_service = change_service
+
+
+def _create_entity_cache(app: FastAPI, model: type):
+    settings: AppSettings = app.state.settings
+    invalidation_bus: InvalidationBus = app.state.invalidation_bus
+
+    entity = model.__tablename__
+    cache = EntityCache(
+        model,
+        TtlCache(
+            settings.entity_cache_ttls.get(entity, settings.entity_cache_ttl),
+            settings.entity_cache_sizes.get(entity, settings.entity_cache_size),
+        ),
+        app.state.metrics,
+    )
+    invalidation_bus.subscribe(entity, cache.invalidate)
+    return cache
 
 
 @asynccontextmanager
 async def _app_lifespan(app: FastAPI):
     settings: AppSettings = app.state.settings
     db: DatabaseManager = app.state.database_manager
+    weather_service: WeatherService = app.state.weather_service
+    weather_buffer_service: WeatherBufferService = app.state.weather_buffer_service
+    weather_partition_service: WeatherPartitionService = (
+        app.state.weather_partition_service
+    )
+    retention_service: RetentionService = app.state.retention_service
+    region_type_catalogue: RegionTypeCatalogue = app.state.region_type_catalogue
+    region_name_index: RegionNameIndex = app.state.region_name_index
+    invalidation_bus: InvalidationBus = app.state.invalidation_bus
     fake_data_creator = FakeDataCreator(
         settings.fake_accounts_count,
         settings.fake_region_types_count,
@@ -122,13 +274,62 @@ async def _app_lifespan(app: FastAPI):
         settings.fake_weather_count,
     )
 
+    async def maintain_weather_partitions():
+        async with db.create_session() as session:
+            await weather_partition_service.maintain(session)
+
+    async def apply_retention():
+        async with db.create_session() as session:
+            await retention_service.run(session)
+
     await db.initialize()
+    await maintain_weather_partitions()
 
     if settings.create_fake_data:
         async with db.create_session() as session:
             await fake_data_creator.create(session)
+            # Fake weather is inserted bypassing the service
+            await weather_service.rebuild_rollups(session)
+
+    listening = asyncio.Event()
+
+    def on_listen():
+        invalidation_bus.reset()
+        listening.set()
+
+    background_tasks = [
+        asyncio.create_task(
+            db.listen(INVALIDATION_CHANNEL, invalidation_bus.dispatch, on_listen)
+        ),
+        asyncio.create_task(
+            run_periodically(
+                settings.weather_partitions_maintenance_interval,
+                maintain_weather_partitions,
+            )
+        ),
+        asyncio.create_task(
+            run_periodically(settings.retention_interval, apply_retention)
+        ),
+        asyncio.create_task(weather_service.publish_events(db)),
+    ]
+
+    weather_buffer_task = asyncio.create_task(weather_buffer_service.run(db))
+
+    # Changes made before the listener is connected would not be noticed
+    await listening.wait()
+    async with db.create_session() as session:
+        await region_type_catalogue.get_snapshot(session)
+        await region_name_index.load(session)
 
     yield
+
+    # Buffered weather is already acknowledged, so it is flushed before exit
+    weather_buffer_service.close()
+    await weather_buffer_task
+
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
     await db.dispose()
 
     if settings.create_fake_data:
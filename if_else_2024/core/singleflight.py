@@ -0,0 +1,51 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+from if_else_2024.core.metrics import MetricsRegistry
+
+T = TypeVar("T")
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key of this process into one:
+    callers, which come while the call is in flight, wait for it and share its
+    result or exception. Results must not depend on the session of a caller,
+    so the call opens its own one and returns detached values (DTOs)
+    """
+
+    def __init__(self, name: str, metrics: MetricsRegistry):
+        self._name = name
+        self._metrics = metrics
+        self._flights: dict[Hashable, _Flight] = {}
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(call()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self._metrics.inc("singleflight_coalesced_total", flight=self._name)
+        self._metrics.inc("singleflight_calls_total", flight=self._name)
+
+        # Cancellation of a caller must not cancel the call shared with others
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Nobody waits for the result anymore
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _forget(self, key: Hashable, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
@@ -1,3 +1,7 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
 from faker import Faker
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -6,8 +10,21 @@ from if_else_2024.accounts.models import Account
 from if_else_2024.auth.utils import pass_context
 from if_else_2024.forecasts.models import Forecast
 from if_else_2024.regions.models import Region, RegionType
+from if_else_2024.regions.utils import make_region_path
 from if_else_2024.weather.models import Weather, WeatherCondition
 
+logger = logging.getLogger(__name__)
+
+
+async def run_periodically(interval: float, job: Callable[[], Awaitable]):
+    """Runs job every `interval` seconds until cancelled, starting after delay"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception as ex:
+            logger.error("Exception was thrown during periodic job", exc_info=ex)
+
 
 class FakeDataCreator:
     def __init__(
@@ -80,6 +97,15 @@ class FakeDataCreator:
         session.add_all(regions)
         await session.flush()
 
+        # Parents always precede their children in the list
+        paths = {region.id: region.path for region in regions}
+        for region in regions:
+            if region.path == "":
+                region.path = make_region_path(
+                    paths.get(region.parent_region_id), region.id
+                )
+                paths[region.id] = region.path
+
         for i in range(self.__forecasts_count - len(forecasts)):
             forecasts.append(
                 Forecast(
@@ -19,6 +19,11 @@ class ForecastDto(BaseModel):
     region_id: Annotated[int, Field(serialization_alias="regionId")]
 
 
+class ForecastPageDto(BaseModel):
+    items: list[ForecastDto]
+    next_cursor: Annotated[str | None, Field(serialization_alias="nextCursor")]
+
+
 class CreateForecastDto(BaseModel):
     region_id: Annotated[int, Ge(1), Field(validation_alias="regionId")]
     date_time: Annotated[datetime, Field(validation_alias="dateTime")]
@@ -34,3 +39,28 @@ class UpdateForecastDto(BaseModel):
         WeatherCondition, Field(validation_alias="weatherCondition")
     ]
     date_time: Annotated[datetime, Field(validation_alias="dateTime")]
+
+
+class UpsertForecastsResultDto(BaseModel):
+    inserted: int
+    updated: int
+    unchanged: int
+
+
+class TemperatureScoreDto(BaseModel):
+    mae: float
+    rmse: float
+    bias: float
+
+
+class ForecastScoreDto(BaseModel):
+    region_id: Annotated[int, Field(serialization_alias="regionId")]
+    lead_time_from: Annotated[int, Field(serialization_alias="leadTimeFrom")]
+    lead_time_to: Annotated[int | None, Field(serialization_alias="leadTimeTo")]
+    count: int
+    temperature: TemperatureScoreDto
+    condition_accuracy: Annotated[float, Field(serialization_alias="conditionAccuracy")]
+    condition_confusion: Annotated[
+        dict[WeatherCondition, dict[WeatherCondition, int]],
+        Field(serialization_alias="conditionConfusion"),
+    ]
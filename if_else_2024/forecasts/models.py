@@ -1,7 +1,7 @@
 # flake8: noqa: F821
 from datetime import datetime
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from if_else_2024.core.db_manager import Base
@@ -16,10 +16,21 @@ class Forecast(Base):
     temperature: Mapped[float]
     weather_condition: Mapped[WeatherCondition]
     region_id: Mapped[int] = mapped_column(ForeignKey("regions.id"))
+    # Lead time of the forecast is measured from it
+    issued_at: Mapped[datetime] = mapped_column(default=datetime.now)
 
     region: Mapped["Region"] = relationship(back_populates="forecasts")
     weather: Mapped[list["Weather"]] = relationship(
         back_populates="forecasts",
         secondary=weather_forecast_table,
+        primaryjoin="Forecast.id == foreign(weather_forecast.c.forecast_id)",
+        secondaryjoin="foreign(weather_forecast.c.weather_id) == Weather.id",
         cascade="save-update, merge",
     )
+
+    __table_args__ = (
+        # Also serves as the index for lookups by region and time
+        UniqueConstraint("region_id", "date_time"),
+        # Order of the search, when it is not limited by regions
+        Index("ix_forecasts_date_time_id", "date_time", "id"),
+    )
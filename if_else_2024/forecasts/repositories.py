@@ -1,28 +1,271 @@
-from sqlalchemy import select
+from datetime import datetime
+
+from sqlalchemy import (
+    Boolean,
+    Float,
+    and_,
+    any_,
+    case,
+    cast,
+    func,
+    literal_column,
+    select,
+    true,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from if_else_2024.core.cache import EntityCache
+from if_else_2024.core.invalidation import (
+    publish_invalidation,
+    publish_invalidations,
+)
 from if_else_2024.forecasts.models import Forecast
+from if_else_2024.forecasts.utils import CONDITIONS
+from if_else_2024.utils import ids_array
+from if_else_2024.weather.models import (
+    Weather,
+    WeatherCondition,
+    weather_forecast_table,
+)
+
+""" Keeps the number of bound parameters per statement well below the limit """
+UPSERT_CHUNK_SIZE = 5000
 
 
 class ForecastRepository:
+    def __init__(self, cache: EntityCache[Forecast]):
+        self._cache = cache
+
     async def get_by_id(self, session: AsyncSession, id: int):
-        return await session.get(Forecast, id)
+        return await self._cache.get(session, id)
 
-    async def get_by_region_and_id(
-        self, session: AsyncSession, region_id: int, id: int
+    async def get_by_ids(self, session: AsyncSession, ids: list[int]):
+        q = select(Forecast).where(Forecast.id == any_(ids_array(ids)))
+        s = await session.execute(q)
+        return s.scalars().all()
+
+    async def get_by_region_and_ids(
+        self, session: AsyncSession, region_id: int, ids: list[int]
     ):
+        """
+        Returns forecasts of the region in order of `ids` without duplicates
+        and ids, which were not found in the region
+        """
+        if len(ids) == 0:
+            return [], []
+
         q = select(Forecast).where(
-            (Forecast.id == id) & (Forecast.region_id == region_id)
+            (Forecast.id == any_(ids_array(ids))) & (Forecast.region_id == region_id)
         )
         s = await session.execute(q)
-        return s.scalar_one_or_none()
+        found = {forecast.id: forecast for forecast in s.scalars().all()}
+
+        ids = list(dict.fromkeys(ids))
+        forecasts = [found[id] for id in ids if id in found]
+        missing = [id for id in ids if id not in found]
+        return forecasts, missing
+
+    async def get_region_ids_by_ids(self, session: AsyncSession, ids: set[int]):
+        """Returns mapping from id of each existing forecast to its region id"""
+        q = select(Forecast.id, Forecast.region_id).where(
+            Forecast.id == any_(ids_array(ids))
+        )
+        s = await session.execute(q)
+        return {id: region_id for id, region_id in s.all()}
+
+    async def search(
+        self,
+        session: AsyncSession,
+        region_ids: list[int] | None,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        weather_condition: WeatherCondition | None,
+        after: tuple[datetime, int] | None,
+        size: int,
+    ):
+        """Forecasts are ordered by date time and id, the page starts after `after`"""
+        conditions = self._search_conditions(
+            region_ids, start_date_time, end_date_time, weather_condition
+        )
+        if after is not None:
+            conditions.append(tuple_(Forecast.date_time, Forecast.id) > after)
+
+        q = (
+            select(Forecast)
+            .where(and_(*conditions))
+            .order_by(Forecast.date_time, Forecast.id)
+            .limit(size)
+        )
+        s = await session.execute(q)
+        return s.scalars().all()
+
+    async def search_latest(
+        self,
+        session: AsyncSession,
+        region_ids: list[int] | None,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        weather_condition: WeatherCondition | None,
+        after_region_id: int | None,
+        size: int,
+    ):
+        """
+        Returns the latest of matching forecasts for each region, ordered by
+        region id. `DISTINCT ON` is served by the (region_id, date_time) index
+        """
+        conditions = self._search_conditions(
+            region_ids, start_date_time, end_date_time, weather_condition
+        )
+        if after_region_id is not None:
+            conditions.append(Forecast.region_id > after_region_id)
+
+        q = (
+            select(Forecast)
+            .distinct(Forecast.region_id)
+            .where(and_(*conditions))
+            .order_by(Forecast.region_id, Forecast.date_time.desc())
+            .limit(size)
+        )
+        s = await session.execute(q)
+        return s.scalars().all()
+
+    async def upsert_many(self, session: AsyncSession, values: list[dict]):
+        """
+        Inserts forecasts or updates existing ones with the same region and
+        date time. Rows whose values did not change are left untouched.
+        Returns id, region id and whether it was inserted for each affected row
+        """
+        affected: list[tuple[int, int, bool]] = []
+        for start in range(0, len(values), UPSERT_CHUNK_SIZE):
+            q = insert(Forecast).values(values[start : start + UPSERT_CHUNK_SIZE])
+            q = q.on_conflict_do_update(
+                index_elements=[Forecast.region_id, Forecast.date_time],
+                set_={
+                    Forecast.temperature: q.excluded.temperature,
+                    Forecast.weather_condition: q.excluded.weather_condition,
+                    Forecast.issued_at: q.excluded.issued_at,
+                },
+                where=(Forecast.temperature != q.excluded.temperature)
+                | (Forecast.weather_condition != q.excluded.weather_condition),
+            ).returning(
+                Forecast.id,
+                Forecast.region_id,
+                # xmax of a freshly inserted row version is always zero
+                literal_column("xmax = 0", Boolean),
+            )
+            s = await session.execute(q)
+            affected.extend(s.tuples().all())
+
+        await publish_invalidations(
+            session,
+            Forecast.__tablename__,
+            [id for id, _, is_inserted in affected if not is_inserted],
+        )
+        return affected
+
+    async def stream_score_pairs(
+        self,
+        session: AsyncSession,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        region_id: int | None,
+        batch_size: int,
+    ):
+        """
+        Yields batches of forecasts matched with weather they were linked to.
+        A batch covers a range of `batch_size` weather ids and is a list of
+        numeric columns aggregated into arrays by the database, see
+        `ForecastScoreAccumulator.add`
+        """
+        conditions = [true(), Forecast.issued_at <= Forecast.date_time]
+        if start_date_time is not None:
+            conditions.append(Weather.measurement_date_time >= start_date_time)
+        if end_date_time is not None:
+            conditions.append(Weather.measurement_date_time <= end_date_time)
+        if region_id is not None:
+            conditions.append(Weather.region_id == region_id)
+
+        # Pairs are split by ranges of weather ids, so every chunk is found
+        # with indexes and the query is streamed chunk by chunk
+        start = (
+            func.generate_series(
+                select(func.min(Weather.id)).scalar_subquery(),
+                select(func.max(Weather.id)).scalar_subquery(),
+                batch_size,
+            )
+            .table_valued("id")
+            .render_derived()
+        )
+        lead_time = func.extract("epoch", Forecast.date_time - Forecast.issued_at)
+        columns = (
+            Weather.region_id,
+            cast(lead_time, Float) / 3600,
+            Forecast.temperature,
+            Weather.temperature,
+            self._condition_index(Forecast.weather_condition),
+            self._condition_index(Weather.weather_condition),
+        )
+        chunk = (
+            select(*(func.array_agg(column) for column in columns))
+            .join(
+                weather_forecast_table,
+                weather_forecast_table.c.weather_id == Weather.id,
+            )
+            .join(Forecast, Forecast.id == weather_forecast_table.c.forecast_id)
+            .where(
+                Weather.id >= start.c.id,
+                Weather.id < start.c.id + batch_size,
+                *conditions,
+            )
+            .having(func.count() > 0)
+            .lateral("chunk")
+        )
+        q = select(chunk).select_from(start).join(chunk, true())
+        s = await session.stream(q, execution_options={"yield_per": 1})
+
+        async for row in s:
+            yield list(row)
 
     async def save(self, session: AsyncSession, forecast: Forecast):
         session.add(forecast)
         await session.flush()
+        await publish_invalidation(session, Forecast.__tablename__, forecast.id)
         await session.commit()
         return forecast
 
     async def delete(self, session: AsyncSession, forecast: Forecast):
         await session.delete(forecast)
+        await publish_invalidation(session, Forecast.__tablename__, forecast.id)
         await session.commit()
+
+    @staticmethod
+    def _search_conditions(
+        region_ids: list[int] | None,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        weather_condition: WeatherCondition | None,
+    ):
+        conditions = [true()]
+
+        if region_ids:
+            conditions.append(Forecast.region_id == any_(ids_array(region_ids)))
+
+        if start_date_time is not None:
+            conditions.append(Forecast.date_time >= start_date_time)
+
+        if end_date_time is not None:
+            conditions.append(Forecast.date_time <= end_date_time)
+
+        if weather_condition is not None:
+            conditions.append(Forecast.weather_condition == weather_condition)
+
+        return conditions
+
+    @staticmethod
+    def _condition_index(column):
+        return case(
+            {condition: index for index, condition in enumerate(CONDITIONS)},
+            value=column,
+        )
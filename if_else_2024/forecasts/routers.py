@@ -1,15 +1,127 @@
+from datetime import datetime
 from typing import Annotated
 
-from annotated_types import Ge
-from fastapi import APIRouter, Depends, Path, status
+from annotated_types import Ge, Le, Len
+from fastapi import APIRouter, Body, Depends, Path, Query, status
 
 from if_else_2024.auth.dependencies import authenticate_user, is_authenticated
 from if_else_2024.core.dependencies import DbSessionDep, ForecastServiceDep
-from if_else_2024.forecasts.dto import CreateForecastDto, ForecastDto, UpdateForecastDto
+from if_else_2024.core.dto import BatchDto
+from if_else_2024.forecasts.dto import (
+    CreateForecastDto,
+    ForecastDto,
+    ForecastPageDto,
+    ForecastScoreDto,
+    UpdateForecastDto,
+    UpsertForecastsResultDto,
+)
+from if_else_2024.forecasts.models import WeatherCondition
 
 router = APIRouter(prefix="/region/weather/forecast", tags=["Прогнозы погоды"])
 
 
+@router.get(
+    "/search",
+    summary="Запрос для поиска прогнозов погоды",
+    description=(
+        "Параметр `regionId` может быть указан несколько раз, тогда ищутся "
+        "прогнозы для любого из указанных регионов. Параметры `startDateTime` и "
+        "`endDateTime` задают период по `dateTime`, параметр `weatherCondition` "
+        "фильтрует по соответствующему полю."
+        "\n\n"
+        "Прогнозы упорядочены по `dateTime` и `id`. Если `latest` равен `true`, "
+        "то для каждого региона возвращается только самый поздний из "
+        "подходящих прогнозов, а прогнозы упорядочены по `regionId`."
+        "\n\n"
+        "Для пагинации используется курсор: если в ответе `nextCursor` не "
+        "равен `null`, то его нужно передать в параметре `cursor` с теми же "
+        "фильтрами для получения следующей страницы. Параметр `size` задает "
+        "размер страницы."
+    ),
+    responses={
+        status.HTTP_400_BAD_REQUEST: {"description": "Неверный курсор"},
+    },
+    dependencies=[Depends(authenticate_user)],
+)
+async def search_forecasts(
+    session: DbSessionDep,
+    service: ForecastServiceDep,
+    region_ids: Annotated[list[int] | None, Query(alias="regionId")] = None,
+    start_date_time: Annotated[datetime | None, Query(alias="startDateTime")] = None,
+    end_date_time: Annotated[datetime | None, Query(alias="endDateTime")] = None,
+    weather_condition: Annotated[
+        WeatherCondition | None, Query(alias="weatherCondition")
+    ] = None,
+    latest: Annotated[bool, Query()] = False,
+    cursor: Annotated[str | None, Query()] = None,
+    size: Annotated[int, Query(), Ge(1), Le(1000)] = 10,
+) -> ForecastPageDto:
+    forecasts, next_cursor = await service.search(
+        session,
+        region_ids,
+        start_date_time,
+        end_date_time,
+        weather_condition,
+        latest,
+        cursor,
+        size,
+    )
+    return ForecastPageDto(
+        items=list(map(ForecastDto.model_validate, forecasts)),
+        next_cursor=next_cursor,
+    )
+
+
+@router.get(
+    "/scores",
+    summary="Оценка качества прогнозов погоды",
+    description=(
+        "Сравнивает прогнозы с погодой, к которой они привязаны через "
+        "`weatherForecast`. Для каждого региона и интервала заблаговременности "
+        "прогноза (в часах от выпуска прогноза до `dateTime`) возвращает "
+        "количество пар, среднюю абсолютную и среднеквадратичную ошибки и "
+        "смещение прогноза температуры, а также долю верно предсказанных "
+        "`weatherCondition` и матрицу ошибок (фактическое состояние -> "
+        "предсказанное)."
+        "\n\n"
+        "Параметры `startDateTime`, `endDateTime` и `regionId` фильтруют "
+        "погоду по `measurementDateTime` и региону. Результат кэшируется на "
+        "несколько минут."
+        "\n\n"
+        "_Отличия от задания:_ прогноз хранит время выпуска, которое "
+        "обновляется при изменении прогноза."
+    ),
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_forecast_scores(
+    session: DbSessionDep,
+    service: ForecastServiceDep,
+    start_date_time: Annotated[datetime | None, Query(alias="startDateTime")] = None,
+    end_date_time: Annotated[datetime | None, Query(alias="endDateTime")] = None,
+    region_id: Annotated[int | None, Query(alias="regionId")] = None,
+) -> list[ForecastScoreDto]:
+    return await service.get_scores(session, start_date_time, end_date_time, region_id)
+
+
+@router.get(
+    "/batch",
+    summary="Получить множество прогнозов погоды по id за один запрос",
+    description=(
+        "Параметр `id` указывается несколько раз (не более 1000). В поле "
+        "`found` возвращаются прогнозы по id, в поле `missing` - id, для "
+        "которых прогнозов не существует."
+    ),
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_forecasts_batch(
+    session: DbSessionDep,
+    service: ForecastServiceDep,
+    ids: Annotated[list[int], Query(alias="id"), Len(1, 1000)],
+) -> BatchDto[ForecastDto]:
+    forecasts = await service.get_many(session, ids)
+    return BatchDto[ForecastDto].of(ids, forecasts)
+
+
 @router.get(
     "/{id}",
     summary="Получить прогноз погоды по id",
@@ -39,6 +151,9 @@ async def get_forecast_by_id(
         status.HTTP_404_NOT_FOUND: {
             "description": "Региона с указанным regionId не существует"
         },
+        status.HTTP_409_CONFLICT: {
+            "description": "Прогноз для региона на указанное время уже существует"
+        },
     },
     dependencies=[Depends(authenticate_user)],
 )
@@ -49,6 +164,38 @@ async def create_forecast(
     return ForecastDto.model_validate(forecast)
 
 
+@router.put(
+    "/batch",
+    summary="Загрузить множество прогнозов погоды",
+    description=(
+        "Принимает массив прогнозов в формате `POST /region/weather/forecast` "
+        "(не более 100000 за запрос). Прогноз однозначно определяется парой "
+        "`regionId` и `dateTime`: новые прогнозы создаются, а существующие "
+        "обновляются. Если в запросе несколько прогнозов с одинаковой парой, "
+        "то используется последний из них."
+        "\n\n"
+        "Запрос выполняется целиком или не выполняется вовсе. В ответе "
+        "возвращается количество созданных, обновленных и не изменившихся "
+        "прогнозов."
+    ),
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Запрос от неавторизованного аккаунта"
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Регионов с некоторыми из указанных regionId не существует"
+        },
+    },
+    dependencies=[Depends(is_authenticated)],
+)
+async def upsert_forecasts(
+    session: DbSessionDep,
+    service: ForecastServiceDep,
+    dtos: Annotated[list[CreateForecastDto], Body(), Len(1, 100000)],
+) -> UpsertForecastsResultDto:
+    return await service.upsert_many(session, dtos)
+
+
 @router.put(
     "/{id}",
     summary="Обновить прогноз погоды по id",
@@ -59,6 +206,9 @@ async def create_forecast(
         status.HTTP_404_NOT_FOUND: {
             "description": "Прогноза погоды с указанным id не существует"
         },
+        status.HTTP_409_CONFLICT: {
+            "description": "Прогноз для региона на указанное время уже существует"
+        },
     },
     dependencies=[Depends(authenticate_user)],
 )
@@ -1,18 +1,59 @@
+import asyncio
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from if_else_2024.core.exceptions import EntityNotFoundException
-from if_else_2024.forecasts.dto import CreateForecastDto, UpdateForecastDto
-from if_else_2024.forecasts.models import Forecast
+from if_else_2024.changes.models import ChangeEntity, ChangeOperation
+from if_else_2024.changes.repositories import ChangeRepository
+from if_else_2024.core.exceptions import (
+    EntityAlreadyExistsException,
+    EntityNotFoundException,
+    IntegrityBreachException,
+)
+from if_else_2024.forecasts.dto import (
+    CreateForecastDto,
+    ForecastScoreDto,
+    TemperatureScoreDto,
+    UpdateForecastDto,
+    UpsertForecastsResultDto,
+)
+from if_else_2024.forecasts.models import Forecast, WeatherCondition
 from if_else_2024.forecasts.repositories import ForecastRepository
+from if_else_2024.forecasts.utils import (
+    CONDITIONS,
+    LEAD_TIME_BINS,
+    ForecastScoreAccumulator,
+)
 from if_else_2024.regions.repositories import RegionRepository
+from if_else_2024.utils import TtlCache, decode_cursor, encode_cursor
+
+""" Exceptions raised on violations of constraints of forecasts table """
+_CONSTRAINT_EXCEPTIONS = {
+    "forecasts_region_id_date_time_key": lambda: EntityAlreadyExistsException(
+        "Forecast for given region and date time already exists"
+    ),
+    "forecasts_region_id_fkey": lambda: EntityNotFoundException(
+        "Region with given id was not found"
+    ),
+}
 
 
 class ForecastService:
     def __init__(
-        self, repository: ForecastRepository, region_repository: RegionRepository
+        self,
+        repository: ForecastRepository,
+        region_repository: RegionRepository,
+        change_repository: ChangeRepository,
+        scores_batch_size: int,
+        scores_cache: TtlCache,
     ):
         self._repository = repository
         self._region_repository = region_repository
+        self._change_repository = change_repository
+        self._scores_batch_size = scores_batch_size
+        self._scores_cache = scores_cache
 
     async def create(self, session: AsyncSession, dto: CreateForecastDto):
         region = await self._region_repository.get_by_id(session, dto.region_id)
@@ -23,8 +64,49 @@ class ForecastService:
             **dto.model_dump(exclude=["region_id"]),
             region=region,
         )
+        # Uniqueness of region and date time is checked by the constraint on
+        # insert, see `_map_integrity_error`
+        try:
+            session.add(forecast)
+            await session.flush()
+            await self._add_change(session, forecast, ChangeOperation.CREATE)
+            return await self._repository.save(session, forecast)
+        except IntegrityError as ex:
+            raise self._map_integrity_error(ex) from None
+
+    async def upsert_many(self, session: AsyncSession, dtos: list[CreateForecastDto]):
+        region_ids = {dto.region_id for dto in dtos}
+        missing_region_ids = (
+            region_ids
+            - await self._region_repository.get_existing_ids(session, region_ids)
+        )
+        if missing_region_ids:
+            raise EntityNotFoundException(
+                "Regions with given ids were not found: "
+                + ", ".join(map(str, sorted(missing_region_ids)))
+            )
 
-        return await self._repository.save(session, forecast)
+        # The same row can not be affected twice by one statement, so the last
+        # of duplicated forecasts wins
+        values = {(dto.region_id, dto.date_time): dto.model_dump() for dto in dtos}
+
+        affected = await self._repository.upsert_many(session, list(values.values()))
+        inserted = [(id, region_id) for id, region_id, is_new in affected if is_new]
+        updated = [(id, region_id) for id, region_id, is_new in affected if not is_new]
+
+        await self._change_repository.add_many(
+            session, ChangeEntity.FORECAST, ChangeOperation.CREATE, inserted
+        )
+        await self._change_repository.add_many(
+            session, ChangeEntity.FORECAST, ChangeOperation.UPDATE, updated
+        )
+        await session.commit()
+
+        return UpsertForecastsResultDto(
+            inserted=len(inserted),
+            updated=len(updated),
+            unchanged=len(values) - len(affected),
+        )
 
     async def get_by_id(self, session: AsyncSession, id: int):
         forecast = await self._repository.get_by_id(session, id)
@@ -32,6 +114,83 @@ class ForecastService:
             raise EntityNotFoundException("Forecast with given id was not found")
         return forecast
 
+    async def get_many(self, session: AsyncSession, ids: list[int]):
+        """Returns mapping from id to forecast, ids of missing forecasts are omitted"""
+        forecasts = await self._repository.get_by_ids(session, ids)
+        return {forecast.id: forecast for forecast in forecasts}
+
+    async def search(
+        self,
+        session: AsyncSession,
+        region_ids: list[int] | None,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        weather_condition: WeatherCondition | None,
+        latest: bool,
+        cursor: str | None,
+        size: int,
+    ) -> tuple[list[Forecast], str | None]:
+        """Returns a page of forecasts and cursor of the next page, if any"""
+        after = None if cursor is None else self._parse_cursor(cursor, latest)
+
+        if latest:
+            forecasts = await self._repository.search_latest(
+                session,
+                region_ids,
+                start_date_time,
+                end_date_time,
+                weather_condition,
+                after,
+                size,
+            )
+        else:
+            forecasts = await self._repository.search(
+                session,
+                region_ids,
+                start_date_time,
+                end_date_time,
+                weather_condition,
+                after,
+                size,
+            )
+
+        next_cursor = None
+        if len(forecasts) == size:
+            last = forecasts[-1]
+            next_cursor = encode_cursor(
+                [last.region_id] if latest else [last.date_time.isoformat(), last.id]
+            )
+        return list(forecasts), next_cursor
+
+    async def get_scores(
+        self,
+        session: AsyncSession,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        region_id: int | None,
+    ) -> list[ForecastScoreDto]:
+        key = (start_date_time, end_date_time, region_id)
+        scores = self._scores_cache.get(key)
+        if scores is not None:
+            return scores
+
+        accumulator = ForecastScoreAccumulator()
+        async for columns in self._repository.stream_score_pairs(
+            session,
+            start_date_time,
+            end_date_time,
+            region_id,
+            self._scores_batch_size,
+        ):
+            # Columns come as arrays, so they are copied without rows in between
+            pairs = np.array(columns, dtype=np.float64).T
+            # NumPy releases GIL, so batches are reduced off the event loop
+            await asyncio.to_thread(accumulator.add, pairs)
+
+        scores = self._to_score_dtos(accumulator)
+        self._scores_cache.set(key, scores)
+        return scores
+
     async def update_by_id(
         self, session: AsyncSession, id: int, dto: UpdateForecastDto
     ):
@@ -42,11 +201,87 @@ class ForecastService:
         forecast.temperature = dto.temperature
         forecast.weather_condition = dto.weather_condition
         forecast.date_time = dto.date_time
-
-        return await self._repository.save(session, forecast)
+        forecast.issued_at = datetime.now()
+        try:
+            await self._add_change(session, forecast, ChangeOperation.UPDATE)
+            return await self._repository.save(session, forecast)
+        except IntegrityError as ex:
+            raise self._map_integrity_error(ex) from None
 
     async def delete_by_id(self, session: AsyncSession, id: int):
         forecast = await self._repository.get_by_id(session, id)
         if forecast is None:
             raise EntityNotFoundException("Forecast with given id was not found")
+        await self._add_change(session, forecast, ChangeOperation.DELETE)
         await self._repository.delete(session, forecast)
+
+    async def _add_change(
+        self, session: AsyncSession, forecast: Forecast, operation: ChangeOperation
+    ):
+        await self._change_repository.add_many(
+            session,
+            ChangeEntity.FORECAST,
+            operation,
+            [(forecast.id, forecast.region_id)],
+        )
+
+    @staticmethod
+    def _map_integrity_error(ex: IntegrityError):
+        """
+        Unique constraints also cover concurrent writes, which checks made
+        before them would miss. Unknown violations are passed as is
+        """
+        exception = _CONSTRAINT_EXCEPTIONS.get(ex.orig.diag.constraint_name)
+        return ex if exception is None else exception()
+
+    @staticmethod
+    def _parse_cursor(cursor: str, latest: bool):
+        values = decode_cursor(cursor)
+        try:
+            if latest:
+                (region_id,) = values
+                return int(region_id)
+            date_time, id = values
+            return datetime.fromisoformat(date_time), int(id)
+        except (TypeError, ValueError):
+            raise IntegrityBreachException("Invalid cursor") from None
+
+    @staticmethod
+    def _to_score_dtos(accumulator: ForecastScoreAccumulator):
+        count, error, abs_error, squared_error = accumulator.sums.T
+        accuracy = np.trace(accumulator.confusion, axis1=1, axis2=2) / count
+        bounds = LEAD_TIME_BINS.tolist() + [None]
+
+        return [
+            ForecastScoreDto(
+                region_id=region_id,
+                lead_time_from=bounds[bin],
+                lead_time_to=bounds[bin + 1],
+                count=count,
+                temperature=TemperatureScoreDto(mae=mae, rmse=rmse, bias=bias),
+                condition_accuracy=condition_accuracy,
+                condition_confusion={
+                    observed: dict(zip(CONDITIONS, row))
+                    for observed, row in zip(CONDITIONS, confusion)
+                },
+            )
+            for (
+                region_id,
+                bin,
+                count,
+                mae,
+                rmse,
+                bias,
+                condition_accuracy,
+                confusion,
+            ) in zip(
+                accumulator.region_ids().tolist(),
+                accumulator.lead_time_bins().tolist(),
+                count.astype(np.int64).tolist(),
+                (abs_error / count).tolist(),
+                np.sqrt(squared_error / count).tolist(),
+                (error / count).tolist(),
+                accuracy.tolist(),
+                accumulator.confusion.tolist(),
+            )
+        ]
@@ -0,0 +1,74 @@
+import numpy as np
+
+from if_else_2024.weather.models import WeatherCondition
+
+""" Lower bounds of lead time bins in hours, the last bin is unbounded """
+LEAD_TIME_BINS = np.array([0, 6, 12, 24, 48, 72, 120, 168])
+CONDITIONS = list(WeatherCondition)
+
+
+class ForecastScoreAccumulator:
+    """
+    Accumulates sums of temperature errors and condition confusion matrices per
+    region and lead time bin. Every batch of pairs is reduced with
+    `np.bincount`, so there is no Python loop per pair
+    """
+
+    def __init__(self):
+        self.keys = np.zeros(0, dtype=np.int64)
+        # Count, sum of errors, sum of absolute errors, sum of squared errors
+        self.sums = np.zeros((0, 4))
+        self.confusion = np.zeros((0, len(CONDITIONS), len(CONDITIONS)), np.int64)
+
+    def add(self, pairs: np.ndarray):
+        """
+        Columns of `pairs` are region id, lead time in hours, forecasted and
+        observed temperatures, indexes of forecasted and observed conditions
+        """
+        if len(pairs) == 0:
+            return
+
+        bins = np.searchsorted(LEAD_TIME_BINS, pairs[:, 1], side="right") - 1
+        keys = pairs[:, 0].astype(np.int64) * len(LEAD_TIME_BINS) + bins
+        batch_keys, inverse = np.unique(keys, return_inverse=True)
+        n = len(batch_keys)
+
+        error = pairs[:, 2] - pairs[:, 3]
+        sums = np.stack(
+            [
+                np.bincount(inverse, minlength=n),
+                np.bincount(inverse, error, n),
+                np.bincount(inverse, np.abs(error), n),
+                np.bincount(inverse, error * error, n),
+            ],
+            axis=1,
+        )
+        size = len(CONDITIONS)
+        forecasted = pairs[:, 4].astype(np.int64)
+        observed = pairs[:, 5].astype(np.int64)
+        cells = (inverse * size + observed) * size + forecasted
+        confusion = np.bincount(cells, minlength=n * size * size).reshape(n, size, size)
+
+        self._extend(batch_keys)
+        rows = np.searchsorted(self.keys, batch_keys)
+        self.sums[rows] += sums
+        self.confusion[rows] += confusion
+
+    def region_ids(self):
+        return self.keys // len(LEAD_TIME_BINS)
+
+    def lead_time_bins(self):
+        return self.keys % len(LEAD_TIME_BINS)
+
+    def _extend(self, batch_keys: np.ndarray):
+        keys = np.union1d(self.keys, batch_keys)
+        if len(keys) == len(self.keys):
+            return
+
+        rows = np.searchsorted(keys, self.keys)
+        sums = np.zeros((len(keys), *self.sums.shape[1:]))
+        sums[rows] = self.sums
+        confusion = np.zeros((len(keys), *self.confusion.shape[1:]), np.int64)
+        confusion[rows] = self.confusion
+
+        self.keys, self.sums, self.confusion = keys, sums, confusion
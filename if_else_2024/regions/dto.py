@@ -1,3 +1,4 @@
+from enum import StrEnum
 from typing import Annotated
 
 from annotated_types import Ge
@@ -6,8 +7,13 @@ from pydantic import AliasPath, BaseModel, ConfigDict, Field
 from if_else_2024.utils import NonEmptyStr
 
 
+class RegionNameMatchMode(StrEnum):
+    PREFIX = "PREFIX"
+    CONTAINS = "CONTAINS"
+
+
 class RegionTypeDto(BaseModel):
-    model_config = ConfigDict(from_attributes=True)
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
     id: int
     type: str
@@ -41,6 +47,12 @@ class RegionDto(BaseModel):
     longitude: float
 
 
+class RegionWithDistanceDto(BaseModel):
+    region: RegionDto
+    # Great-circle distance in meters
+    distance: float
+
+
 class CreateRegionDto(BaseModel):
     name: Annotated[str, NonEmptyStr]
     parent_region_name: Annotated[str | None, Field(alias="parentRegion"), NonEmptyStr]
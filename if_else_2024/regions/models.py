@@ -1,7 +1,7 @@
 # flake8: noqa: F821
 from typing import Optional
 
-from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy import DDL, ForeignKey, Index, UniqueConstraint, event, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from if_else_2024.core.db_manager import Base
@@ -24,13 +24,20 @@ class Region(Base):
     __tablename__ = "regions"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    region_type_id: Mapped[int] = mapped_column(ForeignKey("regions_types.id"))
-    account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"))
+    region_type_id: Mapped[int] = mapped_column(
+        ForeignKey("regions_types.id", name="regions_region_type_id_fkey")
+    )
+    account_id: Mapped[int] = mapped_column(
+        ForeignKey("accounts.id", name="regions_account_id_fkey")
+    )
     name: Mapped[str]
     parent_region_id: Mapped[int | None] = mapped_column(ForeignKey("regions.id"))
+    # Materialized path, see `make_region_path`. Maintained by `RegionService`
+    path: Mapped[str] = mapped_column(default="")
     latitude: Mapped[float]
     longitude: Mapped[float]
-    current_weather_id: Mapped[int | None] = mapped_column(ForeignKey("weather.id"))
+    # Weather is partitioned, so this reference is maintained by the application
+    current_weather_id: Mapped[int | None]
 
     region_type: Mapped[RegionType] = relationship(back_populates="regions")
     account: Mapped["Account"] = relationship(back_populates="regions")
@@ -42,7 +49,8 @@ class Region(Base):
         back_populates="region", cascade="save-update, merge, delete"
     )
     current_weather: Mapped[Optional[Weather]] = relationship(
-        foreign_keys=[current_weather_id], post_update=True
+        primaryjoin="foreign(Region.current_weather_id) == Weather.id",
+        post_update=True,
     )
     weather: Mapped[list[Weather]] = relationship(
         back_populates="region",
@@ -50,8 +58,45 @@ class Region(Base):
         foreign_keys=[Weather.region_id],
     )
 
-    # TODO: add indexes
+    # Names are referred by `RegionService` to tell violated constraints apart
     __table_args__ = (
-        UniqueConstraint("name"),
-        UniqueConstraint("latitude", "longitude"),
+        UniqueConstraint("name", name="regions_name_key"),
+        UniqueConstraint(
+            "latitude", "longitude", name="regions_latitude_longitude_key"
+        ),
+        Index("ix_regions_path", "path", postgresql_ops={"path": "text_pattern_ops"}),
+        # Filters of the search with ids for keyset pagination
+        Index("ix_regions_region_type_id_id", "region_type_id", "id"),
+        Index("ix_regions_account_id_id", "account_id", "id"),
+        Index("ix_regions_parent_region_id_id", "parent_region_id", "id"),
+        Index(
+            "ix_regions_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+    )
+
+
+""" B-tree index for the prefix search by name, independent of collation """
+Index(
+    "ix_regions_name_lower_prefix",
+    func.lower(Region.name).label("name_lower"),
+    postgresql_ops={"name_lower": "text_pattern_ops"},
+)
+
+""" GiST index of points on the earth surface for nearest and radius lookups """
+Index(
+    "ix_regions_location_earth",
+    func.ll_to_earth(Region.latitude, Region.longitude),
+    postgresql_using="gist",
+)
+
+for extension in ("pg_trgm", "cube", "earthdistance"):
+    event.listen(
+        Region.__table__,
+        "before_create",
+        DDL(f"CREATE EXTENSION IF NOT EXISTS {extension}").execute_if(
+            dialect="postgresql"
+        ),
     )
@@ -1,13 +1,39 @@
-from sqlalchemy import exists, select
+from sqlalchemy import (
+    Float,
+    and_,
+    any_,
+    exists,
+    func,
+    or_,
+    select,
+    text,
+    true,
+    update,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, joinedload
 
+from if_else_2024.core.cache import EntityCache
+from if_else_2024.core.invalidation import (
+    publish_invalidation,
+    publish_invalidations,
+)
+from if_else_2024.forecasts.models import Forecast
+from if_else_2024.regions.dto import RegionNameMatchMode
 from if_else_2024.regions.models import Region, RegionType
+from if_else_2024.utils import ids_array, prefix_range
+from if_else_2024.weather.models import Weather
 
 
 class RegionTypeRepository:
     async def get_by_id(self, session: AsyncSession, id: int):
         return await session.get(RegionType, id)
 
+    async def get_all(self, session: AsyncSession):
+        q = select(RegionType).order_by(RegionType.id)
+        s = await session.execute(q)
+        return s.scalars().all()
+
     async def exists_by_type(self, session: AsyncSession, type: str):
         q = select(exists().where(RegionType.type == type))
         s = await session.execute(q)
@@ -16,27 +42,216 @@ class RegionTypeRepository:
     async def save(self, session: AsyncSession, region_type: RegionType):
         session.add(region_type)
         await session.flush()
+        await publish_invalidation(session, RegionType.__tablename__, region_type.id)
         await session.commit()
         return region_type
 
     async def delete(self, session: AsyncSession, region_type: RegionType):
         await session.delete(region_type)
+        await publish_invalidation(session, RegionType.__tablename__, region_type.id)
         await session.commit()
 
 
 class RegionRepository:
+    def __init__(self, cache: EntityCache[Region]):
+        self._cache = cache
+
     async def get_by_id(self, session: AsyncSession, id: int):
-        return await session.get(Region, id)
+        return await self._cache.get(session, id)
+
+    async def get_existing_ids(self, session: AsyncSession, ids: set[int]):
+        q = select(Region.id).where(Region.id == any_(ids_array(ids)))
+        s = await session.execute(q)
+        return set(s.scalars().all())
+
+    async def get_by_ids(self, session: AsyncSession, ids: list[int]):
+        q = (
+            select(Region)
+            .options(joinedload(Region.parent_region))
+            .where(Region.id == any_(ids_array(ids)))
+        )
+        s = await session.execute(q)
+        return s.scalars().all()
+
+    async def search(
+        self,
+        session: AsyncSession,
+        name: str | None,
+        name_mode: RegionNameMatchMode,
+        region_type_id: int | None,
+        account_id: int | None,
+        parent_region_id: int | None,
+        box: tuple[float, float, float, float] | None,
+        after_id: int | None,
+        size: int,
+    ):
+        """
+        Regions are ordered by id and the page starts after `after_id`, so
+        deep pages cost the same as the first one. `box` is min and max
+        latitude, then min and max longitude
+        """
+        conditions = [true()]
+
+        if name:
+            if name_mode == RegionNameMatchMode.PREFIX:
+                conditions.append(prefix_range(func.lower(Region.name), name.lower()))
+            else:
+                # Served by the `gin_trgm_ops` index
+                conditions.append(Region.name.icontains(name, autoescape=True))
+
+        if region_type_id is not None:
+            conditions.append(Region.region_type_id == region_type_id)
+
+        if account_id is not None:
+            conditions.append(Region.account_id == account_id)
+
+        if parent_region_id is not None:
+            conditions.append(Region.parent_region_id == parent_region_id)
+
+        if box is not None:
+            conditions.append(self._box_condition(*box))
+
+        if after_id is not None:
+            conditions.append(Region.id > after_id)
+
+        q = (
+            select(Region)
+            .options(joinedload(Region.parent_region))
+            .where(and_(*conditions))
+            .order_by(Region.id)
+            .limit(size)
+        )
+        s = await session.execute(q)
+        return s.scalars().all()
+
+    async def get_nearest(
+        self, session: AsyncSession, latitude: float, longitude: float, count: int
+    ):
+        """
+        Returns pairs of region and distance in meters. Ordering by `<->` is
+        served by the GiST index as a nearest neighbours scan
+        """
+        location, point = self._earth_location(), func.ll_to_earth(latitude, longitude)
+        q = (
+            select(Region, func.earth_distance(location, point))
+            .options(joinedload(Region.parent_region))
+            .order_by(location.op("<->", return_type=Float)(point))
+            .limit(count)
+        )
+        s = await session.execute(q)
+        return s.tuples().all()
+
+    async def get_within_radius(
+        self,
+        session: AsyncSession,
+        latitude: float,
+        longitude: float,
+        radius: float,
+        offset: int,
+        size: int,
+    ):
+        """
+        Returns pairs of region and distance in meters, nearest first. The
+        index is searched by `earth_box`, which is then refined by exact distance
+        """
+        location, point = self._earth_location(), func.ll_to_earth(latitude, longitude)
+        distance = func.earth_distance(location, point)
+        q = (
+            select(Region, distance)
+            .options(joinedload(Region.parent_region))
+            .where(
+                func.earth_box(point, radius).op("@>")(location),
+                distance <= radius,
+            )
+            .order_by(distance, Region.id)
+            .offset(offset)
+            .limit(size)
+        )
+        s = await session.execute(q)
+        return s.tuples().all()
+
+    async def get_within_box(
+        self,
+        session: AsyncSession,
+        min_latitude: float,
+        max_latitude: float,
+        min_longitude: float,
+        max_longitude: float,
+        offset: int,
+        size: int,
+    ):
+        q = (
+            select(Region)
+            .options(joinedload(Region.parent_region))
+            .where(
+                self._box_condition(
+                    min_latitude, max_latitude, min_longitude, max_longitude
+                )
+            )
+            .order_by(Region.id)
+            .offset(offset)
+            .limit(size)
+        )
+        s = await session.execute(q)
+        return s.scalars().all()
+
+    async def get_descendants(self, session: AsyncSession, region: Region):
+        q = (
+            select(Region)
+            .options(joinedload(Region.parent_region))
+            .where(prefix_range(Region.path, region.path), Region.id != region.id)
+            .order_by(Region.path)
+        )
+        s = await session.execute(q)
+        return s.scalars().all()
+
+    async def get_by_ids_ordered_by_depth(self, session: AsyncSession, ids: list[int]):
+        q = (
+            select(Region)
+            .options(joinedload(Region.parent_region))
+            .where(Region.id == any_(ids_array(ids)))
+            .order_by(func.length(Region.path))
+        )
+        s = await session.execute(q)
+        return s.scalars().all()
+
+    async def lock_hierarchy(self, session: AsyncSession):
+        """Serializes changes of regions parents until commit"""
+        await session.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext('regions_hierarchy'))")
+        )
+
+    async def move_subtree(self, session: AsyncSession, old_path: str, new_path: str):
+        """
+        Replaces `old_path` prefix of the region and all its descendants.
+        Loaded regions are not synchronized
+        """
+        q = (
+            update(Region)
+            .where(prefix_range(Region.path, old_path))
+            .values(path=new_path + func.substr(Region.path, len(old_path) + 1))
+            .returning(Region.id)
+            .execution_options(synchronize_session=False)
+        )
+        s = await session.execute(q)
+        await publish_invalidations(session, Region.__tablename__, s.scalars().all())
+
+    async def get_fresh_by_id(self, session: AsyncSession, id: int):
+        """Reads current values of the region bypassing the cache"""
+        return await session.get(Region, id, populate_existing=True)
 
     async def get_by_name(self, session: AsyncSession, name: str):
         q = select(Region).where(Region.name == name)
         s = await session.execute(q)
         return s.scalar_one_or_none()
 
-    async def exists_by_name(self, session: AsyncSession, name: str):
-        q = select(exists().where(Region.name == name))
+    async def get_names(self, session: AsyncSession, ids: list[int] | None = None):
+        """Returns pairs of id and name of given regions or of all of them"""
+        q = select(Region.id, Region.name)
+        if ids is not None:
+            q = q.where(Region.id == any_(ids_array(ids)))
         s = await session.execute(q)
-        return s.scalar_one()
+        return s.tuples().all()
 
     async def exists_by_type_id(self, session: AsyncSession, region_type_id: int):
         q = select(exists().where(Region.region_type_id == region_type_id))
@@ -53,23 +268,80 @@ class RegionRepository:
         s = await session.execute(q)
         return s.scalar_one()
 
-    async def exists_by_location(
-        self, session: AsyncSession, latitude: float, longitude: float
+    async def set_current_weather_if_newer(
+        self, session: AsyncSession, weather_ids: list[int]
     ):
-        q = select(
-            exists().where(
-                (Region.latitude == latitude) & (Region.longitude == longitude)
+        """
+        Makes each of given weather current for its region, unless the region
+        already has a current weather with later measurement date time. Returns
+        ids of updated regions
+        """
+        current = aliased(Weather)
+        q = (
+            update(Region)
+            .where(
+                (Weather.id == any_(ids_array(weather_ids)))
+                & (Region.id == Weather.region_id)
+                & or_(
+                    Region.current_weather_id.is_(None),
+                    ~exists().where(
+                        (current.id == Region.current_weather_id)
+                        & (
+                            current.measurement_date_time
+                            > Weather.measurement_date_time
+                        )
+                    ),
+                )
             )
+            .values(current_weather_id=Weather.id)
+            .returning(Region.id)
+            .execution_options(synchronize_session=False)
         )
         s = await session.execute(q)
-        return s.scalar_one()
+        ids = s.scalars().all()
+        await publish_invalidations(session, Region.__tablename__, ids)
+        return ids
+
+    async def add(self, session: AsyncSession, region: Region):
+        """Inserts the region without commit, so its id is assigned"""
+        session.add(region)
+        await session.flush()
+        return region
 
     async def save(self, session: AsyncSession, region: Region):
         session.add(region)
         await session.flush()
+        await publish_invalidation(session, Region.__tablename__, region.id)
         await session.commit()
         return region
 
     async def delete(self, session: AsyncSession, region: Region):
+        # Forecasts are deleted with the region, so they are loaded anyway
+        forecasts: list[Forecast] = await region.awaitable_attrs.forecasts
         await session.delete(region)
+        await publish_invalidation(session, Region.__tablename__, region.id)
+        await publish_invalidations(
+            session, Forecast.__tablename__, [forecast.id for forecast in forecasts]
+        )
         await session.commit()
+
+    @staticmethod
+    def _box_condition(
+        min_latitude: float,
+        max_latitude: float,
+        min_longitude: float,
+        max_longitude: float,
+    ):
+        """Box crosses the antimeridian if `min_longitude` > `max_longitude`"""
+        if min_longitude <= max_longitude:
+            longitude_condition = Region.longitude.between(min_longitude, max_longitude)
+        else:
+            longitude_condition = (Region.longitude >= min_longitude) | (
+                Region.longitude <= max_longitude
+            )
+        return Region.latitude.between(min_latitude, max_latitude) & longitude_condition
+
+    @staticmethod
+    def _earth_location():
+        """Has to match the expression of `ix_regions_location_earth` index"""
+        return func.ll_to_earth(Region.latitude, Region.longitude)
@@ -1,7 +1,7 @@
 from typing import Annotated
 
-from annotated_types import Ge
-from fastapi import APIRouter, Depends, Path, status
+from annotated_types import Ge, Gt, Le, Len
+from fastapi import APIRouter, Depends, Header, Path, Query, Response, status
 
 from if_else_2024.auth.dependencies import (
     AuthSessionDep,
@@ -9,21 +9,199 @@ from if_else_2024.auth.dependencies import (
     is_authenticated,
 )
 from if_else_2024.core.dependencies import (
+    DatabaseManagerDep,
     DbSessionDep,
     RegionServiceDep,
     RegionTypeServiceDep,
 )
+from if_else_2024.core.dto import BatchDto
 from if_else_2024.regions.dto import (
     CreateRegionDto,
     CreateRegionTypeDto,
     RegionDto,
+    RegionNameMatchMode,
     RegionTypeDto,
+    RegionWithDistanceDto,
     UpdateRegionDto,
     UpdateRegionTypeDto,
 )
 
 regions_router = APIRouter(prefix="/region", tags=["Регионы"])
 
+Latitude = Annotated[float, Ge(-90), Le(90)]
+Longitude = Annotated[float, Ge(-180), Le(180)]
+
+
+@regions_router.get(
+    "/search",
+    summary="Запрос для поиска регионов",
+    description=(
+        "Параметр `name` фильтрует регионы по имени без учета регистра. "
+        "Параметр `nameMode` задает способ сравнения: `CONTAINS` - поиск "
+        "подстроки (по умолчанию), `PREFIX` - поиск по началу имени."
+        "\n\n"
+        "Параметры `regionType`, `accountId` и `parentRegionId` используются для "
+        "фильтрации по соответствующим полям. Параметры `minLatitude`, "
+        "`maxLatitude`, `minLongitude` и `maxLongitude` задают прямоугольник "
+        "координат, как в `GET /region/within-box`, и указываются только вместе."
+        "\n\n"
+        "Регионы упорядочены по `id`. Для пагинации используется параметр "
+        "`afterId`: возвращаются регионы с `id` больше указанного, поэтому для "
+        "получения следующей страницы следует передать `id` последнего "
+        "региона текущей страницы. Параметр `size` задает размер страницы."
+    ),
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "description": (
+                "Указаны не все границы прямоугольника\n"
+                "`minLatitude` больше `maxLatitude`"
+            )
+        },
+    },
+    dependencies=[Depends(authenticate_user)],
+)
+async def search_regions(
+    session: DbSessionDep,
+    service: RegionServiceDep,
+    name: Annotated[str | None, Query()] = None,
+    name_mode: Annotated[
+        RegionNameMatchMode, Query(alias="nameMode")
+    ] = RegionNameMatchMode.CONTAINS,
+    region_type_id: Annotated[int | None, Query(alias="regionType")] = None,
+    account_id: Annotated[int | None, Query(alias="accountId")] = None,
+    parent_region_id: Annotated[int | None, Query(alias="parentRegionId")] = None,
+    min_latitude: Annotated[Latitude | None, Query(alias="minLatitude")] = None,
+    max_latitude: Annotated[Latitude | None, Query(alias="maxLatitude")] = None,
+    min_longitude: Annotated[Longitude | None, Query(alias="minLongitude")] = None,
+    max_longitude: Annotated[Longitude | None, Query(alias="maxLongitude")] = None,
+    after_id: Annotated[int | None, Query(alias="afterId")] = None,
+    size: Annotated[int, Query(), Ge(1), Le(1000)] = 10,
+) -> list[RegionDto]:
+    regions = await service.search(
+        session,
+        name,
+        name_mode,
+        region_type_id,
+        account_id,
+        parent_region_id,
+        (min_latitude, max_latitude, min_longitude, max_longitude),
+        after_id,
+        size,
+    )
+    return list(map(RegionDto.model_validate, regions))
+
+
+@regions_router.get(
+    "/nearest",
+    summary="Найти ближайшие к точке регионы",
+    description=(
+        "Возвращает не более `count` регионов, ближайших к точке с координатами "
+        "`latitude` и `longitude`, в порядке увеличения расстояния. Расстояние "
+        "указывается в метрах по поверхности Земли."
+    ),
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_nearest_regions(
+    session: DbSessionDep,
+    service: RegionServiceDep,
+    latitude: Annotated[Latitude, Query()],
+    longitude: Annotated[Longitude, Query()],
+    count: Annotated[int, Query(), Ge(1), Le(100)] = 10,
+) -> list[RegionWithDistanceDto]:
+    regions = await service.get_nearest(session, latitude, longitude, count)
+    return [
+        RegionWithDistanceDto(region=RegionDto.model_validate(region), distance=d)
+        for region, d in regions
+    ]
+
+
+@regions_router.get(
+    "/within-radius",
+    summary="Найти регионы в радиусе от точки",
+    description=(
+        "Возвращает регионы на расстоянии не более `radius` метров от точки с "
+        "координатами `latitude` и `longitude` в порядке увеличения расстояния."
+        "\n\n"
+        "Параметры `from` и `size` позволяют реализовать пагинацию."
+    ),
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_regions_within_radius(
+    session: DbSessionDep,
+    service: RegionServiceDep,
+    latitude: Annotated[Latitude, Query()],
+    longitude: Annotated[Longitude, Query()],
+    radius: Annotated[float, Query(), Gt(0)],
+    offset: Annotated[int, Query(alias="from"), Ge(0)] = 0,
+    size: Annotated[int, Query(), Ge(1)] = 10,
+) -> list[RegionWithDistanceDto]:
+    regions = await service.get_within_radius(
+        session, latitude, longitude, radius, offset, size
+    )
+    return [
+        RegionWithDistanceDto(region=RegionDto.model_validate(region), distance=d)
+        for region, d in regions
+    ]
+
+
+@regions_router.get(
+    "/within-box",
+    summary="Найти регионы внутри прямоугольника координат",
+    description=(
+        "Возвращает регионы, у которых `latitude` лежит в промежутке от "
+        "`minLatitude` до `maxLatitude`, а `longitude` - от `minLongitude` до "
+        "`maxLongitude`. Если `minLongitude` больше `maxLongitude`, то "
+        "прямоугольник пересекает 180-й меридиан."
+        "\n\n"
+        "Параметры `from` и `size` позволяют реализовать пагинацию."
+    ),
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "`minLatitude` больше `maxLatitude`"
+        },
+    },
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_regions_within_box(
+    session: DbSessionDep,
+    service: RegionServiceDep,
+    min_latitude: Annotated[Latitude, Query(alias="minLatitude")],
+    max_latitude: Annotated[Latitude, Query(alias="maxLatitude")],
+    min_longitude: Annotated[Longitude, Query(alias="minLongitude")],
+    max_longitude: Annotated[Longitude, Query(alias="maxLongitude")],
+    offset: Annotated[int, Query(alias="from"), Ge(0)] = 0,
+    size: Annotated[int, Query(), Ge(1)] = 10,
+) -> list[RegionDto]:
+    regions = await service.get_within_box(
+        session,
+        min_latitude,
+        max_latitude,
+        min_longitude,
+        max_longitude,
+        offset,
+        size,
+    )
+    return list(map(RegionDto.model_validate, regions))
+
+
+@regions_router.get(
+    "/batch",
+    summary="Получить данные множества регионов по id за один запрос",
+    description=(
+        "Параметр `id` указывается несколько раз (не более 1000). В поле "
+        "`found` возвращаются регионы по id, в поле `missing` - id, для "
+        "которых регионов не существует."
+    ),
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_regions_batch(
+    session: DbSessionDep,
+    service: RegionServiceDep,
+    ids: Annotated[list[int], Query(alias="id"), Len(1, 1000)],
+) -> BatchDto[RegionDto]:
+    regions = await service.get_many(session, ids)
+    return BatchDto[RegionDto].of(ids, regions)
+
 
 @regions_router.get(
     "/{id}",
@@ -36,10 +214,50 @@ regions_router = APIRouter(prefix="/region", tags=["Регионы"])
     dependencies=[Depends(authenticate_user)],
 )
 async def get_region_by_id(
-    session: DbSessionDep, service: RegionServiceDep, id: Annotated[int, Ge(1), Path()]
+    db: DatabaseManagerDep,
+    service: RegionServiceDep,
+    id: Annotated[int, Ge(1), Path()],
 ) -> RegionDto:
-    region = await service.get_by_id(session, id)
-    return RegionDto.model_validate(region)
+    return await service.get_dto_by_id(db, id)
+
+
+@regions_router.get(
+    "/{id}/descendants",
+    summary="Получить все дочерние регионы региона по id на любой глубине",
+    description=(
+        "Регионы упорядочены в порядке обхода дерева в глубину, каждый регион "
+        "следует за своим родителем."
+    ),
+    responses={
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Региона с указанным id не существует"
+        }
+    },
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_region_descendants(
+    session: DbSessionDep, service: RegionServiceDep, id: Annotated[int, Ge(1), Path()]
+) -> list[RegionDto]:
+    regions = await service.get_descendants(session, id)
+    return list(map(RegionDto.model_validate, regions))
+
+
+@regions_router.get(
+    "/{id}/ancestors",
+    summary="Получить цепочку родительских регионов региона по id",
+    description="Регионы упорядочены от корневого до непосредственного родителя.",
+    responses={
+        status.HTTP_404_NOT_FOUND: {
+            "description": "Региона с указанным id не существует"
+        }
+    },
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_region_ancestors(
+    session: DbSessionDep, service: RegionServiceDep, id: Annotated[int, Ge(1), Path()]
+) -> list[RegionDto]:
+    regions = await service.get_ancestors(session, id)
+    return list(map(RegionDto.model_validate, regions))
 
 
 @regions_router.post(
@@ -95,7 +313,8 @@ async def create_region(
         "см. описание метода `POST /region`"
         "\n\n"
         "Также добавлен ошибка с кодом 400, если осуществляется попытка сделать "
-        "регион своим родителем."
+        "регион своим родителем или дочерним регионом одного из своих "
+        "потомков."
     ),
     dependencies=[Depends(is_authenticated)],
     responses={
@@ -154,6 +373,35 @@ async def delete_region_by_id(
 regions_types_router = APIRouter(prefix="/region/types", tags=["Типы регионов"])
 
 
+@regions_types_router.get(
+    "",
+    summary="Получить все типы регионов",
+    description=(
+        "Типы регионов упорядочены по `id`. Ответ содержит заголовок `ETag`: "
+        "если передать его значение в заголовке `If-None-Match`, то при "
+        "отсутствии изменений будет возвращен код 304 без тела ответа."
+    ),
+    responses={
+        status.HTTP_304_NOT_MODIFIED: {"description": "Типы регионов не изменились"}
+    },
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_all_region_types(
+    session: DbSessionDep,
+    service: RegionTypeServiceDep,
+    response: Response,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> list[RegionTypeDto]:
+    snapshot = await service.get_all(session)
+    if if_none_match == snapshot.etag:
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": snapshot.etag}
+        )
+
+    response.headers["ETag"] = snapshot.etag
+    return snapshot.region_types
+
+
 @regions_types_router.get(
     "/{id}",
     summary="Получить тип региона по id",
@@ -247,5 +495,6 @@ async def delete_region_type_by_id(
 
 
 router = APIRouter()
-router.include_router(regions_router)
+# Otherwise `GET /region/types` is matched by `GET /region/{id}`
 router.include_router(regions_types_router)
+router.include_router(regions_router)
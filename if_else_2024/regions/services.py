@@ -1,27 +1,186 @@
+import asyncio
+import hashlib
+import json
+from types import MappingProxyType
+from typing import Iterable, Mapping, NamedTuple
+
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from if_else_2024.accounts.repositories import AccountRepository
+from if_else_2024.changes.repositories import ChangeRepository
+from if_else_2024.core.db_manager import DatabaseManager
 from if_else_2024.core.exceptions import (
     EntityAlreadyExistsException,
     EntityNotFoundException,
     IntegrityBreachException,
 )
+from if_else_2024.core.singleflight import SingleFlight
 from if_else_2024.regions.dto import (
     CreateRegionDto,
     CreateRegionTypeDto,
+    RegionDto,
+    RegionNameMatchMode,
+    RegionTypeDto,
     UpdateRegionDto,
     UpdateRegionTypeDto,
 )
 from if_else_2024.regions.models import Region, RegionType
 from if_else_2024.regions.repositories import RegionRepository, RegionTypeRepository
+from if_else_2024.regions.utils import make_region_path, parse_region_path
+
+
+class RegionTypeSnapshot(NamedTuple):
+    region_types: tuple[RegionTypeDto, ...]
+    by_id: Mapping[int, RegionTypeDto]
+    # Depends only on the content, so it is the same in all workers
+    etag: str
+
+    @classmethod
+    def of(cls, region_types: Iterable[RegionType]):
+        dtos = tuple(RegionTypeDto.model_validate(item) for item in region_types)
+        content = json.dumps([[dto.id, dto.type] for dto in dtos])
+        return cls(
+            dtos,
+            MappingProxyType({dto.id: dto for dto in dtos}),
+            f'"{hashlib.sha1(content.encode()).hexdigest()}"',
+        )
+
+
+class RegionTypeCatalogue:
+    """
+    All region types of this process as an immutable snapshot. Any change of
+    the table drops the snapshot and the next reader loads a new one, so
+    readers see either the whole old or the whole new catalogue. Must be
+    subscribed to invalidations of the table
+    """
+
+    def __init__(self, repository: RegionTypeRepository):
+        self._repository = repository
+        self._snapshot: RegionTypeSnapshot | None = None
+        self._version = 0
+        self._lock = asyncio.Lock()
+
+    async def get_snapshot(self, session: AsyncSession):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+
+        async with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+
+            version = self._version
+            snapshot = RegionTypeSnapshot.of(await self._repository.get_all(session))
+            # Otherwise the snapshot may miss the change and is used only once
+            if version == self._version:
+                self._snapshot = snapshot
+            return snapshot
+
+    async def get(self, session: AsyncSession, id: int):
+        return (await self.get_snapshot(session)).by_id.get(id)
+
+    def invalidate(self, id: int | None):
+        self._version += 1
+        self._snapshot = None
+
+
+class RegionNameIndex:
+    """
+    Names of all regions of this process mapped to their ids. Names of
+    invalidated regions are reloaded by ids on the next miss, so a miss costs
+    no queries, unless some regions were changed since the previous one.
+    Regions created by other workers are missed until their invalidation
+    arrives, so misses have to be checked against the database.
+    Must be subscribed to invalidations of the table
+    """
+
+    def __init__(self, repository: RegionRepository):
+        self._repository = repository
+        self._ids: dict[str, int] = {}
+        self._names: dict[int, str] = {}
+        self._loaded = False
+        # Regions, whose names are unknown since their invalidation
+        self._stale: set[int] = set()
+        # Is changed, when all regions are invalidated
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    async def load(self, session: AsyncSession):
+        await self._refresh(session)
+
+    async def get_id(self, session: AsyncSession, name: str) -> int | None:
+        id = self._ids.get(name)
+        if id is None and (not self._loaded or self._stale):
+            await self._refresh(session)
+            id = self._ids.get(name)
+        return id
+
+    def put(self, id: int, name: str | None):
+        """Records committed name of the region, `None` if it was deleted"""
+        self._stale.discard(id)
+        if name is None:
+            self._remove(id)
+        else:
+            self._set(id, name)
+
+    def invalidate(self, id: int | None):
+        if id is None:
+            self._generation += 1
+            self._loaded = False
+            self._ids, self._names = {}, {}
+            self._stale.clear()
+        else:
+            self._remove(id)
+            self._stale.add(id)
+
+    async def _refresh(self, session: AsyncSession):
+        async with self._lock:
+            if self._loaded and not self._stale:
+                return
+
+            generation = self._generation
+            stale = self._stale
+            ids = list(stale) if self._loaded else None
+            self._stale = set()
+            try:
+                rows = await self._repository.get_names(session, ids)
+            except BaseException:
+                # Failed or cancelled, so the names are left for the next refresh
+                if generation == self._generation:
+                    self._stale |= stale
+                raise
+            if generation != self._generation:
+                return
+
+            if ids is None:
+                self._ids, self._names = {}, {}
+            for id, name in rows:
+                # Invalidated again while loading, so the name may be stale
+                if id not in self._stale:
+                    self._set(id, name)
+            self._loaded = True
+
+    def _set(self, id: int, name: str):
+        self._remove(id)
+        self._ids[name] = id
+        self._names[id] = name
+
+    def _remove(self, id: int):
+        name = self._names.pop(id, None)
+        if name is not None and self._ids.get(name) == id:
+            del self._ids[name]
 
 
 class RegionTypeService:
     def __init__(
-        self, repository: RegionTypeRepository, region_repository: RegionRepository
+        self,
+        repository: RegionTypeRepository,
+        region_repository: RegionRepository,
+        catalogue: RegionTypeCatalogue,
     ):
         self._repository = repository
         self._region_repository = region_repository
+        self._catalogue = catalogue
 
     async def create(self, session: AsyncSession, dto: CreateRegionTypeDto):
         if await self._repository.exists_by_type(session, dto.type):
@@ -34,11 +193,14 @@ class RegionTypeService:
         return await self._repository.save(session, region_type)
 
     async def get_by_id(self, session: AsyncSession, id: int):
-        region_type = await self._repository.get_by_id(session, id)
+        region_type = await self._catalogue.get(session, id)
         if region_type is None:
             raise EntityNotFoundException("RegionType with given id was not found")
         return region_type
 
+    async def get_all(self, session: AsyncSession):
+        return await self._catalogue.get_snapshot(session)
+
     async def update_by_id(
         self, session: AsyncSession, id: int, dto: UpdateRegionTypeDto
     ):
@@ -70,39 +232,43 @@ class RegionTypeService:
         await self._repository.delete(session, region_type)
 
 
+""" Exceptions raised on violations of constraints of regions table """
+_CONSTRAINT_EXCEPTIONS = {
+    "regions_latitude_longitude_key": lambda: EntityAlreadyExistsException(
+        "Region with given latitude and longitude already exists"
+    ),
+    "regions_name_key": lambda: EntityAlreadyExistsException(
+        "Region with given name already exists"
+    ),
+    "regions_region_type_id_fkey": lambda: EntityNotFoundException(
+        "RegionType with given id was not found"
+    ),
+    "regions_account_id_fkey": lambda: EntityNotFoundException(
+        "Account with given id was not found"
+    ),
+}
+
+
 class RegionService:
     def __init__(
         self,
         repository: RegionRepository,
-        region_type_repository: RegionTypeRepository,
-        account_repository: AccountRepository,
+        names: RegionNameIndex,
+        change_repository: ChangeRepository,
+        flights: SingleFlight,
     ):
         self._repository = repository
-        self._region_type_repository = region_type_repository
-        self._account_repository = account_repository
+        self._names = names
+        self._change_repository = change_repository
+        self._flights = flights
 
     async def create(
         self, session: AsyncSession, account_id: int, dto: CreateRegionDto
     ):
-        if await self._repository.exists_by_location(
-            session, dto.latitude, dto.longitude
-        ):
-            raise EntityAlreadyExistsException(
-                "Region with given latitude and longitude already exists"
-            )
-
-        if await self._repository.exists_by_name(session, dto.name):
-            raise EntityAlreadyExistsException("Region with given name already exists")
-
-        region_type = await self._region_type_repository.get_by_id(
-            session, dto.region_type_id
-        )
-        if region_type is None:
-            raise EntityNotFoundException("RegionType with given id was not found")
-
         parent_region = None
         if dto.parent_region_name is not None:
-            parent_region = await self._repository.get_by_name(
+            await self._repository.lock_hierarchy(session)
+            parent_region = await self._get_parent_by_name(
                 session, dto.parent_region_name
             )
             if parent_region is None:
@@ -110,18 +276,23 @@ class RegionService:
                     "Parent Region with given name was not found"
                 )
 
-        account = await self._account_repository.get_by_id(session, account_id)
-        if account is None:
-            raise EntityNotFoundException("Account with given id was not found")
-
         region = Region(
-            **dto.model_dump(exclude=["parent_region_name", "region_type_id"]),
-            region_type=region_type,
-            account=account,
-            parent_region=parent_region
+            **dto.model_dump(exclude=["parent_region_name"]),
+            account_id=account_id,
+            parent_region=parent_region,
         )
-
-        return await self._repository.save(session, region)
+        # Uniqueness of name and location and existence of account and region
+        # type are checked by constraints on insert, see `_map_integrity_error`
+        try:
+            await self._repository.add(session, region)
+            region.path = make_region_path(
+                None if parent_region is None else parent_region.path, region.id
+            )
+            region = await self._repository.save(session, region)
+        except IntegrityError as ex:
+            raise self._map_integrity_error(ex) from None
+        self._names.put(region.id, region.name)
+        return region
 
     async def get_by_id(self, session: AsyncSession, id: int):
         region = await self._repository.get_by_id(session, id)
@@ -130,45 +301,129 @@ class RegionService:
         await region.awaitable_attrs.parent_region
         return region
 
-    async def update_by_id(
-        self, session: AsyncSession, id: int, account_id: int, dto: UpdateRegionDto
+    async def get_dto_by_id(self, db: DatabaseManager, id: int):
+        """Concurrent lookups of the same region share one query"""
+        return await self._flights.do(id, lambda: self._load_dto(db, id))
+
+    async def get_many(self, session: AsyncSession, ids: list[int]):
+        """Returns mapping from id to region, ids of missing regions are omitted"""
+        regions = await self._repository.get_by_ids(session, ids)
+        return {region.id: region for region in regions}
+
+    async def search(
+        self,
+        session: AsyncSession,
+        name: str | None,
+        name_mode: RegionNameMatchMode,
+        region_type_id: int | None,
+        account_id: int | None,
+        parent_region_id: int | None,
+        box: tuple[float | None, float | None, float | None, float | None],
+        after_id: int | None,
+        size: int,
+    ):
+        if all(value is None for value in box):
+            box = None
+        elif any(value is None for value in box):
+            raise IntegrityBreachException(
+                "All bounds of the box have to be given together"
+            )
+        else:
+            self._check_box(box[0], box[1])
+
+        return list(
+            await self._repository.search(
+                session,
+                name,
+                name_mode,
+                region_type_id,
+                account_id,
+                parent_region_id,
+                box,
+                after_id,
+                size,
+            )
+        )
+
+    async def get_nearest(
+        self, session: AsyncSession, latitude: float, longitude: float, count: int
+    ):
+        return list(
+            await self._repository.get_nearest(session, latitude, longitude, count)
+        )
+
+    async def get_within_radius(
+        self,
+        session: AsyncSession,
+        latitude: float,
+        longitude: float,
+        radius: float,
+        offset: int,
+        size: int,
+    ):
+        return list(
+            await self._repository.get_within_radius(
+                session, latitude, longitude, radius, offset, size
+            )
+        )
+
+    async def get_within_box(
+        self,
+        session: AsyncSession,
+        min_latitude: float,
+        max_latitude: float,
+        min_longitude: float,
+        max_longitude: float,
+        offset: int,
+        size: int,
     ):
+        self._check_box(min_latitude, max_latitude)
+        return list(
+            await self._repository.get_within_box(
+                session,
+                min_latitude,
+                max_latitude,
+                min_longitude,
+                max_longitude,
+                offset,
+                size,
+            )
+        )
+
+    async def get_descendants(self, session: AsyncSession, id: int):
         region = await self._repository.get_by_id(session, id)
         if region is None:
             raise EntityNotFoundException("Region with given id was not found")
+        return list(await self._repository.get_descendants(session, region))
 
-        if (
-            dto.latitude != region.latitude or dto.longitude != region.longitude
-        ) and await self._repository.exists_by_location(
-            session, dto.latitude, dto.longitude
-        ):
-            raise EntityAlreadyExistsException(
-                "Region with given latitude and longitude already exists"
+    async def get_ancestors(self, session: AsyncSession, id: int):
+        """Returns ancestors from the root down to the direct parent"""
+        region = await self._repository.get_by_id(session, id)
+        if region is None:
+            raise EntityNotFoundException("Region with given id was not found")
+        return list(
+            await self._repository.get_by_ids_ordered_by_depth(
+                session, parse_region_path(region.path)[:-1]
             )
+        )
 
-        if dto.name != region.name and await self._repository.exists_by_name(
-            session, dto.name
-        ):
-            raise EntityAlreadyExistsException("Region with given name already exists")
-
-        if (
-            dto.latitude != region.latitude
-            and dto.longitude != region.longitude
-            and await self._repository.exists_by_location(
-                session, dto.latitude, dto.longitude
-            )
-        ):
-            raise EntityAlreadyExistsException(
-                "Region with latitude and longitude name already exists"
-            )
+    async def update_by_id(
+        self, session: AsyncSession, id: int, account_id: int, dto: UpdateRegionDto
+    ):
+        region = await self._repository.get_by_id(session, id)
+        if region is None:
+            raise EntityNotFoundException("Region with given id was not found")
 
         parent_region = await region.awaitable_attrs.parent_region
         parent_region_name = None if parent_region is None else parent_region.name
         if dto.parent_region_name != parent_region_name:
+            await self._repository.lock_hierarchy(session)
+            await session.refresh(region, ["path"])
+
             if dto.parent_region_name is None:
-                region.parent_region = None
+                parent_region = None
             else:
-                parent_region = await self._repository.get_by_name(
+                parent_region = await self._get_parent_by_name(
                     session, dto.parent_region_name
                 )
                 if parent_region is None:
@@ -177,27 +432,32 @@ class RegionService:
                     )
                 if parent_region.id == id:
                     raise IntegrityBreachException("Region can not be parent of itself")
-                region.parent_region = parent_region
+                if parent_region.path.startswith(region.path):
+                    raise IntegrityBreachException(
+                        "Region can not be child of its descendant"
+                    )
 
-        if dto.region_type_id != region.region_type_id:
-            region_type = await self._region_type_repository.get_by_id(
-                session, dto.region_type_id
+            path = make_region_path(
+                None if parent_region is None else parent_region.path, id
             )
-            if region_type is None:
-                raise EntityNotFoundException("RegionType with given id was not found")
-            region.region_type = region_type
-
-        if account_id != region.account_id:
-            account = await self._account_repository.get_by_id(session, account_id)
-            if account is None:
-                raise EntityNotFoundException("Account with given id was not found")
-            region.account = account
+            await self._repository.move_subtree(session, region.path, path)
+            region.parent_region = parent_region
+            region.path = path
 
+        # Existence of the region type is checked by its constraint on update
+        region.region_type_id = dto.region_type_id
+        region.account_id = account_id
         region.name = dto.name
         region.latitude = dto.latitude
         region.longitude = dto.longitude
 
-        return await self._repository.save(session, region)
+        try:
+            region = await self._repository.save(session, region)
+        except IntegrityError as ex:
+            # Changes of the subtree are rolled back together with the region
+            raise self._map_integrity_error(ex) from None
+        self._names.put(region.id, region.name)
+        return region
 
     async def delete_by_id(self, session: AsyncSession, id: int):
         region = await self._repository.get_by_id(session, id)
@@ -207,4 +467,40 @@ class RegionService:
         if await self._repository.exists_by_parent_id(session, id):
             raise IntegrityBreachException("Region is parent of some regions")
 
+        await self._change_repository.add_region_deletes(session, id)
         await self._repository.delete(session, region)
+        self._names.put(id, None)
+
+    async def _get_parent_by_name(self, session: AsyncSession, name: str):
+        """
+        Must be called holding the hierarchy lock. The path is read from the
+        database, because other workers may have just moved the region
+        """
+        id = await self._names.get_id(session, name)
+        region = None
+        if id is not None:
+            region = await self._repository.get_fresh_by_id(session, id)
+        if region is None or region.name != name:
+            # The index lags behind changes made by other workers
+            return await self._repository.get_by_name(session, name)
+        return region
+
+    async def _load_dto(self, db: DatabaseManager, id: int):
+        async with db.create_session() as session:
+            return RegionDto.model_validate(await self.get_by_id(session, id))
+
+    @staticmethod
+    def _map_integrity_error(ex: IntegrityError):
+        """
+        Unique constraints also cover concurrent inserts, which checks made
+        before them would miss. Unknown violations are passed as is
+        """
+        exception = _CONSTRAINT_EXCEPTIONS.get(ex.orig.diag.constraint_name)
+        return ex if exception is None else exception()
+
+    @staticmethod
+    def _check_box(min_latitude: float, max_latitude: float):
+        if min_latitude > max_latitude:
+            raise IntegrityBreachException(
+                "Min latitude can not be greater than max latitude"
+            )
@@ -0,0 +1,7 @@
+def make_region_path(parent_path: str | None, id: int) -> str:
+    """Path of a region is ids from the root down to it, e.g. `/1/5/`"""
+    return f"{parent_path or '/'}{id}/"
+
+
+def parse_region_path(path: str) -> list[int]:
+    return [int(id) for id in path.strip("/").split("/")]
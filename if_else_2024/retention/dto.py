@@ -0,0 +1,42 @@
+from enum import StrEnum
+from typing import Annotated, Any
+
+from annotated_types import Ge
+from pydantic import BaseModel, Field, TypeAdapter, model_validator
+
+
+class RetentionTarget(StrEnum):
+    WEATHER = "WEATHER"
+    FORECASTS = "FORECASTS"
+    CHANGES = "CHANGES"
+
+
+class RetentionAction(StrEnum):
+    DELETE = "DELETE"
+    DOWNSAMPLE_HOURLY = "DOWNSAMPLE_HOURLY"
+    DOWNSAMPLE_DAILY = "DOWNSAMPLE_DAILY"
+    ARCHIVE = "ARCHIVE"
+
+
+class RetentionPolicy(BaseModel):
+    target: RetentionTarget
+    action: RetentionAction
+    after_days: Annotated[int, Field(validation_alias="afterDays"), Ge(1)]
+
+    @model_validator(mode="after")
+    def check_action(self):
+        if self.target == RetentionTarget.FORECASTS and self.action in (
+            RetentionAction.DOWNSAMPLE_HOURLY,
+            RetentionAction.DOWNSAMPLE_DAILY,
+        ):
+            raise ValueError("Forecasts can not be downsampled")
+        if (
+            self.target == RetentionTarget.CHANGES
+            and self.action != RetentionAction.DELETE
+        ):
+            raise ValueError("Changes can only be deleted")
+        return self
+
+
+def parse_retention_policies(policies: list[dict[str, Any]]) -> list[RetentionPolicy]:
+    return TypeAdapter(list[RetentionPolicy]).validate_python(policies)
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+from sqlalchemy import ARRAY, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+
+from if_else_2024.core.db_manager import Base
+from if_else_2024.weather.models import WeatherCondition
+
+
+class WeatherArchive(Base):
+    """Weather moved out by retention. Regions are not referenced by FK"""
+
+    __tablename__ = "weather_archive"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    region_id: Mapped[int]
+    temperature: Mapped[float]
+    humidity: Mapped[float]
+    wind_speed: Mapped[float]
+    weather_condition: Mapped[WeatherCondition]
+    precipitation_amount: Mapped[float]
+    measurement_date_time: Mapped[datetime]
+    forecast_ids: Mapped[list[int]] = mapped_column(ARRAY(Integer))
+    archived_at: Mapped[datetime]
+
+
+class ForecastArchive(Base):
+    """Forecasts moved out by retention. Regions are not referenced by FK"""
+
+    __tablename__ = "forecasts_archive"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    date_time: Mapped[datetime]
+    temperature: Mapped[float]
+    weather_condition: Mapped[WeatherCondition]
+    region_id: Mapped[int]
+    issued_at: Mapped[datetime]
+    archived_at: Mapped[datetime]
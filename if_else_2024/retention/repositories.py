@@ -0,0 +1,289 @@
+from datetime import datetime
+
+from sqlalchemy import (
+    ARRAY,
+    Integer,
+    and_,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    tuple_,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from if_else_2024.changes.models import Change, ChangeEntity, ChangeOperation
+from if_else_2024.changes.repositories import finished_transactions_bound
+from if_else_2024.core.invalidation import (
+    publish_invalidation,
+    publish_invalidations,
+)
+from if_else_2024.forecasts.models import Forecast
+from if_else_2024.regions.models import Region
+from if_else_2024.retention.models import ForecastArchive, WeatherArchive
+from if_else_2024.weather.models import (
+    RollupGranularity,
+    Weather,
+    WeatherRollup,
+    weather_forecast_table,
+)
+from if_else_2024.weather.repositories import (
+    merge_weather_rollups,
+    select_weather_rollups,
+)
+
+
+class RetentionRepository:
+    """
+    Every batch is a single statement, which deletes up to `batch_size` rows,
+    records their deletes in the change log and, if requested, copies them
+    into archive. Rows locked by other transactions are skipped until the next
+    batch
+    """
+
+    async def delete_weather_batch(
+        self,
+        session: AsyncSession,
+        cutoff: datetime,
+        batch_size: int,
+        archive: bool,
+        granularities: list[RollupGranularity],
+    ) -> list[tuple[int, datetime]]:
+        """
+        Merges deleted weather into retained rollups of given granularities.
+        Returns pairs of region id and measurement date time of deleted
+        weather, whose buckets of existing weather have to be refreshed
+        """
+        batch = (
+            select(Weather.id, Weather.measurement_date_time)
+            .where(and_(*self._expired_weather_conditions(cutoff)))
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .cte("batch")
+        )
+        deleted = (
+            delete(Weather)
+            .where(tuple_(Weather.id, Weather.measurement_date_time).in_(select(batch)))
+            .returning(*Weather.__table__.columns)
+            .cte("deleted")
+        )
+        changes = self._record_deletes(ChangeEntity.WEATHER, deleted)
+        # Links are not referenced by FK, so they are deleted along with weather
+        links = (
+            delete(weather_forecast_table)
+            .where(weather_forecast_table.c.weather_id.in_(select(deleted.c.id)))
+            .returning(
+                weather_forecast_table.c.weather_id,
+                weather_forecast_table.c.forecast_id,
+            )
+            .cte("links")
+        )
+        q = select(deleted.c.region_id, deleted.c.measurement_date_time).add_cte(
+            links,
+            changes,
+            *(
+                merge_weather_rollups(
+                    select_weather_rollups(granularity, deleted, retained=True)
+                ).cte(f"retained_{granularity.lower()}")
+                for granularity in granularities
+            ),
+        )
+
+        if archive:
+            forecast_ids = func.coalesce(
+                select(func.array_agg(links.c.forecast_id))
+                .where(links.c.weather_id == deleted.c.id)
+                .scalar_subquery(),
+                literal([], ARRAY(Integer)),
+            )
+            archived = (
+                insert(WeatherArchive)
+                .from_select(
+                    [
+                        *(column.name for column in Weather.__table__.columns),
+                        "forecast_ids",
+                        "archived_at",
+                    ],
+                    select(*deleted.columns, forecast_ids, func.now()),
+                )
+                .cte("archived")
+            )
+            q = q.add_cte(archived)
+
+        s = await session.execute(q)
+        return list(s.tuples().all())
+
+    async def delete_forecasts_batch(
+        self,
+        session: AsyncSession,
+        cutoff: datetime,
+        batch_size: int,
+        archive: bool,
+    ) -> int:
+        batch = (
+            select(Forecast.id)
+            .where(and_(*self._expired_forecast_conditions(cutoff)))
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .cte("batch")
+        )
+        deleted = (
+            delete(Forecast)
+            .where(Forecast.id.in_(select(batch)))
+            .returning(*Forecast.__table__.columns)
+            .cte("deleted")
+        )
+        changes = self._record_deletes(ChangeEntity.FORECAST, deleted)
+        links = (
+            delete(weather_forecast_table)
+            .where(weather_forecast_table.c.forecast_id.in_(select(deleted.c.id)))
+            .returning(weather_forecast_table.c.weather_id)
+            .cte("links")
+        )
+        q = select(
+            select(func.count()).select_from(deleted).scalar_subquery(),
+            select(func.array_agg(links.c.weather_id.distinct())).scalar_subquery(),
+        ).add_cte(changes)
+
+        if archive:
+            archived = (
+                insert(ForecastArchive)
+                .from_select(
+                    [
+                        *(column.name for column in Forecast.__table__.columns),
+                        "archived_at",
+                    ],
+                    select(*deleted.columns, func.now()),
+                )
+                .cte("archived")
+            )
+            q = q.add_cte(archived)
+
+        count, weather_ids = (await session.execute(q)).one()
+        if count > 0:
+            # Ids of deleted forecasts are not returned, so all are invalidated
+            await publish_invalidation(session, Forecast.__tablename__, None)
+        # Weather lists ids of its forecasts
+        await publish_invalidations(session, Weather.__tablename__, weather_ids or [])
+        return count
+
+    async def delete_changes_batch(
+        self,
+        session: AsyncSession,
+        cutoff: datetime,
+        batch_size: int,
+        archive: bool,
+    ) -> int:
+        """
+        Changes are deleted from the head of the log up to the first kept one,
+        so a reader never misses deleted changes without its cursor being
+        deleted too. Order of the log is the order of transactions ids, which
+        differs from the order of their start, the time of their changes.
+        Changes are not archived
+        """
+        head = (
+            select(Change.id, Change.transaction_id, Change.changed_at)
+            .where(Change.transaction_id < finished_transactions_bound())
+            .order_by(Change.transaction_id, Change.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .cte("head")
+        )
+        first_kept = (
+            select(head.c.transaction_id, head.c.id)
+            .where(head.c.changed_at >= cutoff)
+            .order_by(head.c.transaction_id, head.c.id)
+            .limit(1)
+        )
+        deleted = (
+            delete(Change)
+            .where(
+                Change.id.in_(
+                    select(head.c.id).where(
+                        or_(
+                            ~first_kept.exists(),
+                            tuple_(head.c.transaction_id, head.c.id)
+                            < first_kept.scalar_subquery(),
+                        )
+                    )
+                )
+            )
+            .returning(Change.id)
+            .cte("deleted")
+        )
+        q = select(func.count()).select_from(deleted)
+        return (await session.execute(q)).scalar_one()
+
+    async def delete_rollups(
+        self,
+        session: AsyncSession,
+        granularity: RollupGranularity,
+        before: datetime,
+    ):
+        """Rollups of existing weather are kept in sync with it"""
+        await session.execute(
+            delete(WeatherRollup).where(
+                WeatherRollup.granularity == granularity,
+                WeatherRollup.bucket < before,
+                WeatherRollup.retained,
+            )
+        )
+
+    async def get_oldest_weather_date_time(
+        self, session: AsyncSession, cutoff: datetime
+    ) -> datetime | None:
+        q = select(func.min(Weather.measurement_date_time)).where(
+            *self._expired_weather_conditions(cutoff)
+        )
+        return (await session.execute(q)).scalar_one()
+
+    async def get_oldest_forecast_date_time(
+        self, session: AsyncSession, cutoff: datetime
+    ) -> datetime | None:
+        q = select(func.min(Forecast.date_time)).where(
+            *self._expired_forecast_conditions(cutoff)
+        )
+        return (await session.execute(q)).scalar_one()
+
+    async def get_oldest_change_date_time(
+        self, session: AsyncSession, cutoff: datetime
+    ) -> datetime | None:
+        q = (
+            select(Change.changed_at)
+            .where(Change.transaction_id < finished_transactions_bound())
+            .order_by(Change.transaction_id, Change.id)
+            .limit(1)
+        )
+        changed_at = (await session.execute(q)).scalar_one_or_none()
+        return changed_at if changed_at is not None and changed_at < cutoff else None
+
+    @staticmethod
+    def _record_deletes(entity: ChangeEntity, deleted):
+        return (
+            insert(Change)
+            .from_select(
+                ["entity", "entity_id", "region_id", "operation"],
+                select(
+                    literal(entity, Change.entity.type),
+                    deleted.c.id,
+                    deleted.c.region_id,
+                    literal(ChangeOperation.DELETE, Change.operation.type),
+                ),
+            )
+            .cte("changes")
+        )
+
+    @staticmethod
+    def _expired_weather_conditions(cutoff: datetime):
+        """Current weather of regions is kept regardless of its age"""
+        return [
+            Weather.measurement_date_time < cutoff,
+            ~exists().where(Region.current_weather_id == Weather.id),
+        ]
+
+    @staticmethod
+    def _expired_forecast_conditions(cutoff: datetime):
+        return [Forecast.date_time < cutoff]
@@ -0,0 +1,118 @@
+import logging
+from datetime import datetime, timedelta
+from functools import partial
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from if_else_2024.core.metrics import MetricsRegistry
+from if_else_2024.retention.dto import RetentionAction, RetentionPolicy, RetentionTarget
+from if_else_2024.retention.repositories import RetentionRepository
+from if_else_2024.weather.models import RollupGranularity
+from if_else_2024.weather.repositories import WeatherRollupRepository
+from if_else_2024.weather.utils import rollup_bucket_length, truncate_date_time
+
+logger = logging.getLogger(__name__)
+
+""" Rollups kept by actions as the downsampled history of deleted weather """
+KEPT_ROLLUPS = {
+    RetentionAction.DELETE: [],
+    RetentionAction.DOWNSAMPLE_HOURLY: [RollupGranularity.HOUR, RollupGranularity.DAY],
+    RetentionAction.DOWNSAMPLE_DAILY: [RollupGranularity.DAY],
+    RetentionAction.ARCHIVE: [RollupGranularity.HOUR, RollupGranularity.DAY],
+}
+
+
+class RetentionService:
+    def __init__(
+        self,
+        repository: RetentionRepository,
+        rollup_repository: WeatherRollupRepository,
+        metrics: MetricsRegistry,
+        policies: list[RetentionPolicy],
+        batch_size: int,
+        max_batches: int,
+    ):
+        self._repository = repository
+        self._rollup_repository = rollup_repository
+        self._metrics = metrics
+        self._policies = policies
+        self._batch_size = batch_size
+        self._max_batches = max_batches
+
+    async def run(self, session: AsyncSession, now: datetime | None = None):
+        """
+        Applies all policies. Every batch is committed separately and at most
+        `max_batches` batches are run per policy, the rest is left to next run
+        """
+        now = datetime.now() if now is None else now
+        for policy in self._policies:
+            await self._apply(session, policy, now - timedelta(days=policy.after_days))
+
+    async def _apply(
+        self, session: AsyncSession, policy: RetentionPolicy, cutoff: datetime
+    ):
+        labels = {"target": policy.target.lower(), "action": policy.action.lower()}
+        archive = policy.action == RetentionAction.ARCHIVE
+
+        kept = KEPT_ROLLUPS[policy.action]
+        if policy.target == RetentionTarget.WEATHER:
+            if kept:
+                # Retained buckets are whole, none of them has weather left
+                cutoff = truncate_date_time(cutoff, max(kept, key=rollup_bucket_length))
+            delete_batch = partial(self._delete_weather_batch, granularities=kept)
+            get_oldest = self._repository.get_oldest_weather_date_time
+        elif policy.target == RetentionTarget.FORECASTS:
+            delete_batch = self._repository.delete_forecasts_batch
+            get_oldest = self._repository.get_oldest_forecast_date_time
+        else:
+            delete_batch = self._repository.delete_changes_batch
+            get_oldest = self._repository.get_oldest_change_date_time
+
+        total = 0
+        for _ in range(self._max_batches):
+            count = await delete_batch(session, cutoff, self._batch_size, archive)
+            await session.commit()
+
+            total += count
+            self._metrics.inc("retention_rows_total", count, **labels)
+            if count < self._batch_size:
+                break
+
+        if policy.target == RetentionTarget.WEATHER:
+            for granularity in RollupGranularity:
+                if granularity not in kept:
+                    await self._repository.delete_rollups(
+                        session, granularity, truncate_date_time(cutoff, granularity)
+                    )
+            await session.commit()
+
+        oldest = await get_oldest(session, cutoff)
+        lag = 0 if oldest is None else (cutoff - oldest).total_seconds()
+        self._metrics.set("retention_lag_seconds", lag, **labels)
+        self._metrics.set(
+            "retention_last_run_timestamp_seconds", datetime.now().timestamp(), **labels
+        )
+
+        if total > 0:
+            logger.info(
+                "Retention %s of %s processed %d rows",
+                policy.action,
+                policy.target,
+                total,
+            )
+
+    async def _delete_weather_batch(
+        self,
+        session: AsyncSession,
+        cutoff: datetime,
+        batch_size: int,
+        archive: bool,
+        granularities: list[RollupGranularity],
+    ):
+        keys = await self._repository.delete_weather_batch(
+            session, cutoff, batch_size, archive, granularities
+        )
+        if keys:
+            # Deleted weather is moved from rollups of existing weather to retained
+            await self._rollup_repository.refresh(session, set(keys))
+        return len(keys)
@@ -1,4 +1,81 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Hashable, Iterable
+
 from pydantic import StringConstraints
+from sqlalchemy import Integer, literal
+from sqlalchemy.dialects.postgresql import ARRAY
 
 """ Often used constrains """
 NonEmptyStr = StringConstraints(strip_whitespace=True, min_length=1)
+
+
+def ids_array(ids: Iterable[int]):
+    """
+    Binds ids as a single array parameter, so `column == any_(ids_array(ids))`
+    compiles to `column = ANY(:ids)` regardless of the number of ids
+    """
+    return literal(list(ids), ARRAY(Integer))
+
+
+def prefix_range(column, prefix: str):
+    """
+    Explicit range on `text_pattern_ops` operators instead of `LIKE 'x%'`,
+    so the index is used by prepared (generic) plans as well
+    """
+    upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return column.op("~>=~")(prefix) & column.op("~<~")(upper_bound)
+
+
+def encode_cursor(values: list) -> str:
+    """Cursors are opaque for clients, so the format can be changed freely"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list | None:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+class TtlCache:
+    """
+    Keeps values for `ttl` seconds, the least recently used are evicted above
+    `max_size`
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._items.pop(key, None)
+        self._items[key] = (monotonic() + self._ttl, value)
+        while len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
@@ -1,8 +1,16 @@
 from datetime import datetime
+from enum import StrEnum
 from typing import Annotated, Any
 
 from annotated_types import Ge
-from pydantic import AliasPath, BaseModel, BeforeValidator, ConfigDict, Field
+from pydantic import (
+    AliasChoices,
+    AliasPath,
+    BaseModel,
+    BeforeValidator,
+    ConfigDict,
+    Field,
+)
 
 from if_else_2024.forecasts.models import Forecast
 from if_else_2024.utils import NonEmptyStr
@@ -10,14 +18,33 @@ from if_else_2024.weather.models import WeatherCondition
 
 
 def convert_weather_forecast_to_ids(v: Any) -> list[int]:
+    """Accepts both loaded `Forecast` entities and already aggregated ids"""
+    if v is None:
+        return []
     assert isinstance(v, list)
     a = []
     for forecast in v:
+        if isinstance(forecast, int):
+            a.append(forecast)
+            continue
         assert isinstance(forecast, Forecast)
         a.append(forecast.id)
     return a
 
 
+class WeatherExportFormat(StrEnum):
+    NDJSON = "NDJSON"
+    CSV = "CSV"
+
+
+class AggregationGranularity(StrEnum):
+    HOUR = "HOUR"
+    DAY = "DAY"
+    WEEK = "WEEK"
+    MONTH = "MONTH"
+    YEAR = "YEAR"
+
+
 class WeatherDto(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
@@ -26,7 +53,7 @@ class WeatherDto(BaseModel):
         str,
         Field(
             serialization_alias="regionName",
-            validation_alias=AliasPath("region", "name"),
+            validation_alias=AliasChoices(AliasPath("region", "name"), "region_name"),
         ),
     ]
     temperature: float
@@ -43,11 +70,20 @@ class WeatherDto(BaseModel):
     ]
     weather_forecast: Annotated[
         list[int],
-        Field(serialization_alias="weatherForecast", validation_alias="forecasts"),
+        Field(
+            serialization_alias="weatherForecast",
+            validation_alias=AliasChoices("forecasts", "weather_forecast"),
+        ),
         BeforeValidator(convert_weather_forecast_to_ids),
     ]
 
 
+class WeatherEventDto(BaseModel):
+    region_id: Annotated[int, Field(serialization_alias="regionId")]
+    # Is null, when the region has no current weather anymore
+    weather: WeatherDto | None
+
+
 class CreateWeatherDto(BaseModel):
     region_id: Annotated[int, Field(validation_alias="regionId"), Ge(1)]
     temperature: float
@@ -80,3 +116,31 @@ class UpdateWeatherDto(BaseModel):
         datetime, Field(validation_alias="measurementDateTime")
     ]
     weather_forecast: Annotated[list[int], Field(validation_alias="weatherForecast")]
+
+
+class BatchWeatherResultDto(BaseModel):
+    index: int
+    status_code: Annotated[int, Field(serialization_alias="statusCode")]
+    id: int | None = None
+    details: str | None = None
+
+
+class AggregatedValueDto(BaseModel):
+    avg: float
+    min: float
+    max: float
+
+
+class WeatherAggregateDto(BaseModel):
+    region_id: Annotated[int, Field(serialization_alias="regionId")]
+    bucket_start: Annotated[datetime, Field(serialization_alias="bucketStart")]
+    count: int
+    temperature: AggregatedValueDto
+    humidity: AggregatedValueDto
+    wind_speed: Annotated[AggregatedValueDto, Field(serialization_alias="windSpeed")]
+    precipitation_amount: Annotated[
+        AggregatedValueDto, Field(serialization_alias="precipitationAmount")
+    ]
+    weather_conditions: Annotated[
+        dict[WeatherCondition, int], Field(serialization_alias="weatherConditions")
+    ]
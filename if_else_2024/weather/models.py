@@ -2,7 +2,7 @@
 from datetime import datetime
 from enum import StrEnum
 
-from sqlalchemy import Column, ForeignKey, Table
+from sqlalchemy import DDL, Column, ForeignKey, Index, Integer, Table, event
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from if_else_2024.core.db_manager import Base
@@ -17,10 +17,11 @@ class WeatherCondition(StrEnum):
     STORM = "STORM"
 
 
+""" Weather is partitioned, so `weather.id` alone can not be referenced by FK """
 weather_forecast_table = Table(
     "weather_forecast",
     Base.metadata,
-    Column("weather_id", ForeignKey("weather.id"), primary_key=True),
+    Column("weather_id", Integer, primary_key=True),
     Column("forecast_id", ForeignKey("forecasts.id"), primary_key=True),
 )
 
@@ -28,21 +29,92 @@ weather_forecast_table = Table(
 class Weather(Base):
     __tablename__ = "weather"
 
-    id: Mapped[int] = mapped_column(primary_key=True)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     region_id: Mapped[int] = mapped_column(ForeignKey("regions.id"))
     temperature: Mapped[float]
     humidity: Mapped[float]
     wind_speed: Mapped[float]
     weather_condition: Mapped[WeatherCondition]
     precipitation_amount: Mapped[float]
-    measurement_date_time: Mapped[datetime]
+    # Partition key has to be a part of the primary key
+    measurement_date_time: Mapped[datetime] = mapped_column(primary_key=True)
 
+    # Relationships are loaded on demand with options of `WeatherRepository`
     region: Mapped["Region"] = relationship(
-        back_populates="weather", foreign_keys=[region_id], lazy="joined"
+        back_populates="weather", foreign_keys=[region_id]
     )
     forecasts: Mapped[list["Forecast"]] = relationship(
         back_populates="weather",
         secondary=weather_forecast_table,
+        primaryjoin="Weather.id == foreign(weather_forecast.c.weather_id)",
+        secondaryjoin="foreign(weather_forecast.c.forecast_id) == Forecast.id",
         cascade="save-update, merge",
-        lazy="selectin",
     )
+
+    __table_args__ = (
+        Index("ix_weather_measurement_date_time", "measurement_date_time"),
+        Index(
+            "ix_weather_region_id_measurement_date_time",
+            "region_id",
+            "measurement_date_time",
+        ),
+        {"postgresql_partition_by": "RANGE (measurement_date_time)"},
+    )
+    # Ids are unique on their own, so they still identify weather in the session
+    __mapper_args__ = {"primary_key": [id]}
+
+
+""" Catches measurements out of the range of monthly partitions """
+event.listen(
+    Weather.__table__,
+    "after_create",
+    DDL(
+        "CREATE TABLE IF NOT EXISTS weather_default PARTITION OF weather DEFAULT"
+    ).execute_if(dialect="postgresql"),
+)
+
+
+class RollupGranularity(StrEnum):
+    HOUR = "HOUR"
+    DAY = "DAY"
+
+
+class WeatherRollup(Base):
+    """
+    Aggregates of weather per region and hour/day bucket. Sums are stored
+    instead of averages, so buckets can be merged and updated incrementally.
+    A bucket has up to two rows, which are summed up by readers
+    """
+
+    __tablename__ = "weather_rollups"
+
+    region_id: Mapped[int] = mapped_column(
+        ForeignKey("regions.id", ondelete="CASCADE"), primary_key=True
+    )
+    granularity: Mapped[RollupGranularity] = mapped_column(primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(primary_key=True)
+    count: Mapped[int]
+
+    temperature_sum: Mapped[float]
+    temperature_min: Mapped[float]
+    temperature_max: Mapped[float]
+    humidity_sum: Mapped[float]
+    humidity_min: Mapped[float]
+    humidity_max: Mapped[float]
+    wind_speed_sum: Mapped[float]
+    wind_speed_min: Mapped[float]
+    wind_speed_max: Mapped[float]
+    precipitation_amount_sum: Mapped[float]
+    precipitation_amount_min: Mapped[float]
+    precipitation_amount_max: Mapped[float]
+
+    clear_count: Mapped[int]
+    cloudy_count: Mapped[int]
+    rain_count: Mapped[int]
+    snow_count: Mapped[int]
+    fog_count: Mapped[int]
+    storm_count: Mapped[int]
+
+    # Aggregates weather deleted by retention, which can not be recomputed, so
+    # it is kept apart from the aggregates of existing weather of the bucket
+    retained: Mapped[bool] = mapped_column(primary_key=True, default=False)
@@ -1,14 +1,78 @@
 from datetime import datetime
 
-from sqlalchemy import and_, select, true
+from sqlalchemy import (
+    FromClause,
+    Select,
+    and_,
+    any_,
+    column,
+    delete,
+    func,
+    insert,
+    literal,
+    literal_column,
+    or_,
+    select,
+    table,
+    text,
+    true,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 
-from if_else_2024.weather.models import Weather, WeatherCondition
+from if_else_2024.changes.models import Change, ChangeEntity, ChangeOperation
+from if_else_2024.core.invalidation import (
+    publish_invalidation,
+    publish_invalidations,
+)
+from if_else_2024.regions.models import Region
+from if_else_2024.utils import ids_array, prefix_range
+from if_else_2024.weather.models import (
+    RollupGranularity,
+    Weather,
+    WeatherCondition,
+    WeatherRollup,
+    weather_forecast_table,
+)
+from if_else_2024.weather.utils import (
+    ROLLUP_METRICS,
+    rollup_bucket_length,
+    truncate_date_time,
+)
 
 
 class WeatherRepository:
-    async def get_by_id(self, session: AsyncSession, id: int):
-        return await session.get(Weather, id)
+    async def get_by_id(
+        self,
+        session: AsyncSession,
+        id: int,
+        with_region: bool = False,
+        with_forecasts: bool = False,
+    ):
+        """Relationships are not loaded unless requested"""
+        q = (
+            select(Weather)
+            .options(*self._load_options(with_region, with_forecasts))
+            .where(Weather.id == id)
+        )
+        s = await session.execute(q)
+        return s.scalar_one_or_none()
+
+    async def get_current_for_regions(
+        self, session: AsyncSession, region_ids: list[int]
+    ):
+        """Returns mapping from region id to its current weather"""
+        q = (
+            select(Weather)
+            .options(*self._load_options(with_region=True, with_forecasts=True))
+            .join(Region, Region.current_weather_id == Weather.id)
+            .where(Region.id == any_(ids_array(region_ids)))
+        )
+        s = await session.execute(q)
+        return {weather.region_id: weather for weather in s.scalars().all()}
 
     async def search(
         self,
@@ -19,6 +83,100 @@ class WeatherRepository:
         weather_condition: WeatherCondition | None,
         offset: int,
         size: int,
+        subtree_path: str | None = None,
+    ):
+        conditions = self._search_conditions(
+            start_date_time, end_date_time, region_id, weather_condition, subtree_path
+        )
+
+        q = (
+            self._rows_query()
+            .where(and_(*conditions))
+            .order_by(Weather.id)
+            .offset(offset)
+            .limit(size)
+        )
+        s = await session.execute(q)
+
+        return s.all()
+
+    async def stream(
+        self,
+        session: AsyncSession,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        region_id: int | None,
+        weather_condition: WeatherCondition | None,
+        subtree_path: str | None,
+        batch_size: int,
+    ):
+        """
+        Yields batches of plain rows with the same filters as `search`. Rows are
+        fetched from a server-side cursor, so only one batch is held in memory
+        """
+        conditions = self._search_conditions(
+            start_date_time, end_date_time, region_id, weather_condition, subtree_path
+        )
+
+        q = self._rows_query().where(and_(*conditions)).order_by(Weather.id)
+        s = await session.stream(q, execution_options={"yield_per": batch_size})
+
+        async for partition in s.partitions():
+            yield partition
+
+    async def insert_many(
+        self,
+        session: AsyncSession,
+        values: list[dict],
+        forecast_ids: list[list[int]],
+    ):
+        """
+        Inserts weather with multi-row INSERT statements and links each of them
+        with the corresponding forecast ids, repeated ids are linked once.
+        Returns ids in order of `values`
+        """
+        q = insert(Weather).returning(Weather.id, sort_by_parameter_order=True)
+        s = await session.execute(q, values)
+        ids = list(s.scalars().all())
+
+        links = [
+            {"weather_id": id, "forecast_id": forecast_id}
+            for id, forecasts in zip(ids, forecast_ids)
+            for forecast_id in dict.fromkeys(forecasts)
+        ]
+        if links:
+            await session.execute(insert(weather_forecast_table), links)
+
+        return ids
+
+    async def save(self, session: AsyncSession, weather: Weather):
+        session.add(weather)
+        await session.flush()
+        await publish_invalidation(session, Weather.__tablename__, weather.id)
+        await session.commit()
+        return weather
+
+    async def delete(self, session: AsyncSession, weather: Weather):
+        await session.delete(weather)
+        await publish_invalidation(session, Weather.__tablename__, weather.id)
+        await session.commit()
+
+    @staticmethod
+    def _load_options(with_region: bool, with_forecasts: bool):
+        options = []
+        if with_region:
+            options.append(joinedload(Weather.region))
+        if with_forecasts:
+            options.append(selectinload(Weather.forecasts))
+        return options
+
+    @staticmethod
+    def _search_conditions(
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        region_id: int | None,
+        weather_condition: WeatherCondition | None,
+        subtree_path: str | None,
     ):
         conditions = [true()]
 
@@ -34,23 +192,348 @@ class WeatherRepository:
         if weather_condition is not None:
             conditions.append(Weather.weather_condition == weather_condition)
 
+        if subtree_path is not None:
+            conditions.append(
+                Weather.region_id.in_(
+                    select(Region.id).where(prefix_range(Region.path, subtree_path))
+                )
+            )
+
+        return conditions
+
+    @staticmethod
+    def _rows_query():
+        """
+        Selects only the columns of `WeatherDto` instead of ORM entities, so
+        the whole page is read with a single statement
+        """
+        forecast_ids = (
+            select(func.array_agg(weather_forecast_table.c.forecast_id))
+            .where(weather_forecast_table.c.weather_id == Weather.id)
+            .scalar_subquery()
+        )
+        return select(
+            Weather.id,
+            Region.name.label("region_name"),
+            Weather.temperature,
+            Weather.humidity,
+            Weather.wind_speed,
+            Weather.weather_condition,
+            Weather.precipitation_amount,
+            Weather.measurement_date_time,
+            forecast_ids.label("weather_forecast"),
+        ).join(Region, Region.id == Weather.region_id)
+
+
+class WeatherRollupRepository:
+    """
+    Keeps `weather_rollups` in sync with `weather`. New weather is merged into
+    existing buckets, while updated and deleted weather makes its buckets to
+    be recomputed, since min and max can not be subtracted. Rows retained by
+    retention are the only history of deleted weather and are left as is
+    """
+
+    async def add(self, session: AsyncSession, weather_ids: list[int]):
+        for granularity in RollupGranularity:
+            await session.execute(
+                merge_weather_rollups(
+                    select_weather_rollups(granularity).where(
+                        Weather.id == any_(ids_array(weather_ids))
+                    )
+                )
+            )
+
+    async def refresh(self, session: AsyncSession, keys: set[tuple[int, datetime]]):
+        """
+        Recomputes buckets containing given pairs of region id and measurement
+        date time. Changes of weather must be flushed before
+        """
+        for granularity in RollupGranularity:
+            buckets = {
+                (region_id, truncate_date_time(date_time, granularity))
+                for region_id, date_time in keys
+            }
+            length = rollup_bucket_length(granularity)
+
+            await session.execute(
+                delete(WeatherRollup).where(
+                    WeatherRollup.granularity == granularity,
+                    tuple_(WeatherRollup.region_id, WeatherRollup.bucket).in_(buckets),
+                    ~WeatherRollup.retained,
+                )
+            )
+            await session.execute(
+                insert(WeatherRollup).from_select(
+                    self._rollup_columns(),
+                    select_weather_rollups(granularity).where(
+                        or_(
+                            *(
+                                and_(
+                                    Weather.region_id == region_id,
+                                    Weather.measurement_date_time >= bucket,
+                                    Weather.measurement_date_time < bucket + length,
+                                )
+                                for region_id, bucket in buckets
+                            )
+                        )
+                    ),
+                )
+            )
+
+    async def rebuild(self, session: AsyncSession):
+        await session.execute(delete(WeatherRollup).where(~WeatherRollup.retained))
+        for granularity in RollupGranularity:
+            await session.execute(
+                insert(WeatherRollup).from_select(
+                    self._rollup_columns(), select_weather_rollups(granularity)
+                )
+            )
+
+    async def aggregate(
+        self,
+        session: AsyncSession,
+        unit: str,
+        source: RollupGranularity,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        region_id: int | None,
+    ):
+        """
+        Aggregates rollups of `source` granularity into buckets of `unit`.
+        Range is half-open and has to be aligned to `source` buckets
+        """
+        bucket = _date_trunc(unit, WeatherRollup.bucket).label("bucket")
+        count = func.sum(WeatherRollup.count)
+        columns = [WeatherRollup.region_id, bucket, count.label("count")]
+        for metric in ROLLUP_METRICS:
+            columns += [
+                (func.sum(getattr(WeatherRollup, f"{metric}_sum")) / count).label(
+                    f"{metric}_avg"
+                ),
+                func.min(getattr(WeatherRollup, f"{metric}_min")).label(
+                    f"{metric}_min"
+                ),
+                func.max(getattr(WeatherRollup, f"{metric}_max")).label(
+                    f"{metric}_max"
+                ),
+            ]
+        for condition in WeatherCondition:
+            name = f"{condition.lower()}_count"
+            columns.append(func.sum(getattr(WeatherRollup, name)).label(name))
+
+        conditions = [WeatherRollup.granularity == source]
+        if start_date_time is not None:
+            conditions.append(WeatherRollup.bucket >= start_date_time)
+        if end_date_time is not None:
+            conditions.append(WeatherRollup.bucket < end_date_time)
+        if region_id is not None:
+            conditions.append(WeatherRollup.region_id == region_id)
+
         q = (
-            select(Weather)
-            .where(and_(*conditions))
-            .order_by(Weather.id)
-            .offset(offset)
-            .limit(size)
+            select(*columns)
+            .where(*conditions)
+            .group_by(WeatherRollup.region_id, bucket)
+            .order_by(WeatherRollup.region_id, bucket)
         )
         s = await session.execute(q)
 
-        return s.scalars().all()
+        return s.all()
 
-    async def save(self, session: AsyncSession, weather: Weather):
-        session.add(weather)
-        await session.flush()
-        await session.commit()
-        return weather
+    async def aggregate_weather(
+        self,
+        session: AsyncSession,
+        unit: str,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        region_id: int | None,
+    ):
+        """Same as `aggregate`, but reads raw weather for unaligned ranges"""
+        bucket = _date_trunc(unit, Weather.measurement_date_time).label("bucket")
+        columns = [Weather.region_id, bucket, func.count().label("count")]
+        for metric in ROLLUP_METRICS:
+            column = getattr(Weather, metric)
+            columns += [
+                func.avg(column).label(f"{metric}_avg"),
+                func.min(column).label(f"{metric}_min"),
+                func.max(column).label(f"{metric}_max"),
+            ]
+        for condition in WeatherCondition:
+            columns.append(
+                func.count()
+                .filter(Weather.weather_condition == condition)
+                .label(f"{condition.lower()}_count")
+            )
 
-    async def delete(self, session: AsyncSession, weather: Weather):
-        await session.delete(weather)
-        await session.commit()
+        conditions = [true()]
+        if start_date_time is not None:
+            conditions.append(Weather.measurement_date_time >= start_date_time)
+        if end_date_time is not None:
+            conditions.append(Weather.measurement_date_time < end_date_time)
+        if region_id is not None:
+            conditions.append(Weather.region_id == region_id)
+
+        q = (
+            select(*columns)
+            .where(*conditions)
+            .group_by(Weather.region_id, bucket)
+            .order_by(Weather.region_id, bucket)
+        )
+        s = await session.execute(q)
+
+        return s.all()
+
+    @staticmethod
+    def _rollup_columns():
+        return [column.name for column in WeatherRollup.__table__.columns]
+
+
+def select_weather_rollups(
+    granularity: RollupGranularity,
+    weather: FromClause = Weather.__table__,
+    retained: bool = False,
+):
+    """Selects rows of `weather_rollups` computed from rows of `weather`"""
+    bucket = _date_trunc(granularity.lower(), weather.c.measurement_date_time)
+    columns = [
+        weather.c.region_id,
+        literal(granularity, WeatherRollup.granularity.type),
+        bucket,
+        func.count(),
+    ]
+    for metric in ROLLUP_METRICS:
+        column = weather.c[metric]
+        columns += [func.sum(column), func.min(column), func.max(column)]
+    for condition in WeatherCondition:
+        columns.append(func.count().filter(weather.c.weather_condition == condition))
+    columns.append(literal(retained))
+
+    return select(*columns).group_by(weather.c.region_id, bucket)
+
+
+def merge_weather_rollups(rollups: Select):
+    """Inserts `rollups` merging them into existing rows of their buckets"""
+    q = pg_insert(WeatherRollup).from_select(
+        [column.name for column in WeatherRollup.__table__.columns], rollups
+    )
+    excluded = q.excluded
+    values = {"count": WeatherRollup.count + excluded["count"]}
+    for metric in ROLLUP_METRICS:
+        values[f"{metric}_sum"] = (
+            getattr(WeatherRollup, f"{metric}_sum") + excluded[f"{metric}_sum"]
+        )
+        values[f"{metric}_min"] = func.least(
+            getattr(WeatherRollup, f"{metric}_min"), excluded[f"{metric}_min"]
+        )
+        values[f"{metric}_max"] = func.greatest(
+            getattr(WeatherRollup, f"{metric}_max"), excluded[f"{metric}_max"]
+        )
+    for condition in WeatherCondition:
+        name = f"{condition.lower()}_count"
+        values[name] = getattr(WeatherRollup, name) + excluded[name]
+
+    return q.on_conflict_do_update(
+        index_elements=[
+            WeatherRollup.region_id,
+            WeatherRollup.granularity,
+            WeatherRollup.bucket,
+            WeatherRollup.retained,
+        ],
+        set_=values,
+    )
+
+
+def _date_trunc(unit: str, column):
+    # Unit is inlined, otherwise bound parameters of SELECT and GROUP BY differ
+    return func.date_trunc(literal_column(f"'{unit}'"), column)
+
+
+class WeatherPartitionRepository:
+    """
+    Manages monthly range partitions of the `weather` table. Partitions are
+    named `weather_YYYY_MM`, rows out of their ranges go to `weather_default`
+    """
+
+    async def lock(self, session: AsyncSession):
+        """Serializes partitions maintenance between workers until commit"""
+        await session.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext('weather_partitions'))")
+        )
+
+    async def get_names(self, session: AsyncSession):
+        q = text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'weather'::regclass"
+        )
+        s = await session.execute(q)
+        return list(s.scalars().all())
+
+    async def create(
+        self, session: AsyncSession, name: str, start: datetime, end: datetime
+    ):
+        """
+        Creates partition for [start, end) range. Rows of this range, which
+        were already put into the default partition, are moved into it
+        """
+        await session.execute(
+            text(
+                f'CREATE TABLE "{name}" '
+                "(LIKE weather INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            )
+        )
+        await session.execute(
+            text(
+                "WITH moved AS ("
+                "DELETE FROM weather_default WHERE measurement_date_time >= :start "
+                "AND measurement_date_time < :end RETURNING *"
+                f') INSERT INTO "{name}" SELECT * FROM moved'
+            ),
+            {"start": start, "end": end},
+        )
+        await session.execute(
+            text(
+                f'ALTER TABLE weather ATTACH PARTITION "{name}" '
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+        )
+
+    async def detach(self, session: AsyncSession, name: str):
+        """
+        Only catalog is updated, partition remains as a standalone table with
+        `_detached` suffix, which can be archived or dropped separately.
+        References to weather are not guarded by FKs, so links of detached
+        weather with forecasts are deleted and regions, which have it as
+        current, are left without current weather. Returns ids of those regions
+        """
+        await session.execute(text(f'ALTER TABLE weather DETACH PARTITION "{name}"'))
+        await session.execute(text(f'ALTER TABLE "{name}" RENAME TO "{name}_detached"'))
+
+        # Writers of the partition are blocked by the detach until commit
+        detached = table(f"{name}_detached", column("id"), column("region_id"))
+        await session.execute(
+            delete(weather_forecast_table).where(
+                weather_forecast_table.c.weather_id.in_(select(detached.c.id))
+            )
+        )
+        await session.execute(
+            insert(Change).from_select(
+                ["entity", "entity_id", "region_id", "operation"],
+                select(
+                    literal(ChangeEntity.WEATHER, Change.entity.type),
+                    detached.c.id,
+                    detached.c.region_id,
+                    literal(ChangeOperation.DELETE, Change.operation.type),
+                ),
+            )
+        )
+        q = (
+            update(Region)
+            .where(Region.current_weather_id.in_(select(detached.c.id)))
+            .values(current_weather_id=None)
+            .returning(Region.id)
+            .execution_options(synchronize_session=False)
+        )
+        s = await session.execute(q)
+        region_ids = s.scalars().all()
+        await publish_invalidations(session, Region.__tablename__, region_ids)
+        return region_ids
@@ -1,11 +1,27 @@
 from datetime import datetime
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, Query
+from annotated_types import Len
+from fastapi import APIRouter, Body, Depends, Query, status
+from fastapi.responses import StreamingResponse
 
 from if_else_2024.auth.dependencies import authenticate_user
-from if_else_2024.core.dependencies import DbSessionDep, WeatherServiceDep
-from if_else_2024.weather.dto import CreateWeatherDto, UpdateWeatherDto, WeatherDto
+from if_else_2024.core.dependencies import (
+    DatabaseManagerDep,
+    DbSessionDep,
+    WeatherBufferServiceDep,
+    WeatherServiceDep,
+)
+from if_else_2024.core.dto import BatchDto
+from if_else_2024.weather.dto import (
+    AggregationGranularity,
+    BatchWeatherResultDto,
+    CreateWeatherDto,
+    UpdateWeatherDto,
+    WeatherAggregateDto,
+    WeatherDto,
+    WeatherExportFormat,
+)
 from if_else_2024.weather.models import WeatherCondition
 
 router = APIRouter(prefix="/region", tags=["Погода"])
@@ -21,6 +37,9 @@ router = APIRouter(prefix="/region", tags=["Погода"])
         "Параметры `regionId` и `weatherCondition` используются для фильтрации "
         "по соответствующим полям."
         "\n\n"
+        "Параметр `subtreeRegionId` оставляет только погоду в указанном регионе "
+        "и всех его дочерних регионах на любой глубине."
+        "\n\n"
         "Параметры `from` и `size` позволяют реализовать пагинацию. Первый "
         "параметр отвечает за количество пропущенных элементов от начала. "
         "Второй - за количество элементов на странице"
@@ -38,6 +57,7 @@ async def search_weather(
     ] = None,
     offset: Annotated[int, Query(alias="from")] = 0,
     size: Annotated[int, Query(alias="size")] = 10,
+    subtree_region_id: Annotated[int | None, Query(alias="subtreeRegionId")] = None,
 ) -> list[WeatherDto]:
     weather = await service.search(
         session,
@@ -47,10 +67,103 @@ async def search_weather(
         weather_condition,
         offset,
         size,
+        subtree_region_id,
     )
     return list(map(WeatherDto.model_validate, weather))
 
 
+EXPORT_MEDIA_TYPES = {
+    WeatherExportFormat.NDJSON: "application/x-ndjson",
+    WeatherExportFormat.CSV: "text/csv",
+}
+
+
+@router.get(
+    "/weather/export",
+    summary="Выгрузка истории погоды в формате NDJSON или CSV",
+    description=(
+        "Принимает те же фильтры, что и `GET /region/weather/search`, но "
+        "возвращает все подходящие записи без пагинации. Записи читаются из БД "
+        "порциями и отдаются клиенту по мере чтения, поэтому размер выгрузки "
+        "не ограничен."
+        "\n\n"
+        "Параметр `format` задает формат выгрузки: `NDJSON` (по умолчанию) - "
+        "по одному JSON объекту на строку, `CSV` - таблица с заголовком. В CSV "
+        "поле `weatherForecast` содержит id прогнозов через пробел."
+    ),
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()}
+        }
+    },
+    dependencies=[Depends(authenticate_user)],
+)
+async def export_weather(
+    db: DatabaseManagerDep,
+    service: WeatherServiceDep,
+    start_date_time: Annotated[datetime | None, Query(alias="startDateTime")] = None,
+    end_date_time: Annotated[datetime | None, Query(alias="endDateTime")] = None,
+    region_id: Annotated[int | None, Query(alias="regionId")] = None,
+    weather_condition: Annotated[
+        WeatherCondition | None, Query(alias="weatherCondition")
+    ] = None,
+    subtree_region_id: Annotated[int | None, Query(alias="subtreeRegionId")] = None,
+    format: Annotated[WeatherExportFormat, Query()] = WeatherExportFormat.NDJSON,
+):
+    content = await service.export(
+        db,
+        start_date_time,
+        end_date_time,
+        region_id,
+        weather_condition,
+        subtree_region_id,
+        format,
+    )
+
+    extension = format.lower()
+    return StreamingResponse(
+        content,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="weather.{extension}"'
+        },
+    )
+
+
+@router.get(
+    "/weather/aggregate",
+    summary="Агрегированная статистика погоды по периодам",
+    description=(
+        "Возвращает для каждого региона и периода количество записей о погоде, "
+        "среднее, минимальное и максимальное значения показателей и количество "
+        "записей с каждым из `weatherCondition`."
+        "\n\n"
+        "Параметр `granularity` задает длину периода: `HOUR`, `DAY`, `WEEK`, "
+        "`MONTH` или `YEAR`. Параметры `startDateTime` и `endDateTime` задают "
+        "полуинтервал `[startDateTime, endDateTime)`, параметр `regionId` - "
+        "регион."
+        "\n\n"
+        "Статистика читается из заранее посчитанных почасовых и посуточных "
+        "агрегатов. Если границы периода не выровнены по часу (для `HOUR`) или "
+        "по суткам (для остальных), то она считается по исходным записям, что "
+        "медленнее."
+    ),
+    dependencies=[Depends(authenticate_user)],
+)
+async def aggregate_weather(
+    session: DbSessionDep,
+    service: WeatherServiceDep,
+    granularity: Annotated[AggregationGranularity, Query()],
+    start_date_time: Annotated[datetime | None, Query(alias="startDateTime")] = None,
+    end_date_time: Annotated[datetime | None, Query(alias="endDateTime")] = None,
+    region_id: Annotated[int | None, Query(alias="regionId")] = None,
+) -> list[WeatherAggregateDto]:
+    return await service.aggregate(
+        session, granularity, start_date_time, end_date_time, region_id
+    )
+
+
 @router.post(
     "/weather",
     summary="Создать новую погоду и сделать её текущей для региона по region_id",
@@ -65,16 +178,119 @@ async def create_weather_for_region(
     return WeatherDto.model_validate(weather)
 
 
+@router.post(
+    "/weather/buffered",
+    summary="Принять погоду для отложенной записи",
+    description=(
+        "Принимает погоду в том же формате, что и `POST /region/weather`, и "
+        "сразу отвечает кодом `202`. Погода записывается в БД пакетами в "
+        "фоне, как при `POST /region/weather/batch`, поэтому она появляется с "
+        "задержкой до нескольких секунд, а ошибки (например, несуществующий "
+        "регион) клиенту не возвращаются."
+        "\n\n"
+        "Если очередь на запись заполнена, то возвращается код `503` с "
+        "заголовком `Retry-After`."
+    ),
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "description": "Очередь на запись заполнена"
+        },
+    },
+    dependencies=[Depends(authenticate_user)],
+)
+async def create_weather_buffered(
+    service: WeatherBufferServiceDep,
+    dto: CreateWeatherDto,
+):
+    service.submit(dto)
+
+
+@router.post(
+    "/weather/batch",
+    summary="Создать множество записей о погоде за один запрос",
+    description=(
+        "Принимает массив объектов в том же формате, что и `POST /region/weather`"
+        " (не более 10000 за запрос). Для каждого элемента возвращается "
+        "результат с его индексом: код `201` и `id` созданной погоды, либо код "
+        "ошибки и её описание. Ошибка в одном элементе не отменяет создание "
+        "остальных."
+        "\n\n"
+        "Для каждого региона текущей становится самая поздняя по "
+        "`measurementDateTime` погода из запроса, если она не старше текущей "
+        "погоды региона."
+    ),
+    dependencies=[Depends(authenticate_user)],
+)
+async def create_weather_batch(
+    session: DbSessionDep,
+    service: WeatherServiceDep,
+    dtos: Annotated[list[CreateWeatherDto], Body(), Len(1, 10000)],
+) -> list[BatchWeatherResultDto]:
+    return await service.create_many_for_regions(session, dtos)
+
+
+@router.get(
+    "/weather/batch",
+    summary="Получить текущую погоду множества регионов за один запрос",
+    description=(
+        "Параметр `regionId` указывается несколько раз (не более 1000). В поле "
+        "`found` возвращается текущая погода по id региона, в поле `missing` - "
+        "id регионов, которых не существует или в которых нет текущей погоды."
+    ),
+    dependencies=[Depends(authenticate_user)],
+)
+async def get_weather_batch(
+    session: DbSessionDep,
+    service: WeatherServiceDep,
+    region_ids: Annotated[list[int], Query(alias="regionId"), Len(1, 1000)],
+) -> BatchDto[WeatherDto]:
+    weather = await service.get_current_for_regions(session, region_ids)
+    return BatchDto[WeatherDto].of(region_ids, weather)
+
+
+@router.get(
+    "/weather/events",
+    summary="Подписка на изменения текущей погоды в регионах",
+    description=(
+        "Поток Server-Sent Events. Параметр `regionId` указывается несколько "
+        "раз (не более 1000) и задает регионы, изменения текущей погоды в "
+        "которых будут отправляться клиенту."
+        "\n\n"
+        "Каждое событие `weather` содержит `regionId` и текущую погоду региона "
+        "`weather` в том же формате, что и `GET /region/weather/{regionId}`, "
+        "либо `null`, если текущей погоды больше нет. Событие отправляется при "
+        "создании, изменении, назначении и удалении текущей погоды. Текущее "
+        "состояние при подключении не отправляется."
+        "\n\n"
+        "Если клиент не успевает читать события, то сервер закрывает поток, и "
+        "клиенту нужно переподключиться. При отсутствии событий периодически "
+        "отправляются комментарии, чтобы соединение не закрывалось по таймауту."
+    ),
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+    dependencies=[Depends(authenticate_user)],
+)
+async def stream_weather_events(
+    service: WeatherServiceDep,
+    region_ids: Annotated[list[int], Query(alias="regionId"), Len(1, 1000)],
+):
+    return StreamingResponse(
+        service.stream_events(region_ids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get(
     "/weather/{region_id}",
     summary="Получить данные текущей погоды в регионе по region_id",
     dependencies=[Depends(authenticate_user)],
 )
 async def get_weather_by_region_id(
-    session: DbSessionDep, service: WeatherServiceDep, region_id: int
+    db: DatabaseManagerDep, service: WeatherServiceDep, region_id: int
 ) -> WeatherDto:
-    weather = await service.get_current_for_region(session, region_id)
-    return WeatherDto.model_validate(weather)
+    return await service.get_current_dto_for_region(db, region_id)
 
 
 @router.put(
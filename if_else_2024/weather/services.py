@@ -1,25 +1,80 @@
+import asyncio
+import logging
+import math
 from datetime import datetime
 
+from fastapi import status
+from sqlalchemy import exc
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from if_else_2024.core.exceptions import EntityNotFoundException
+from if_else_2024.changes.models import ChangeEntity, ChangeOperation
+from if_else_2024.changes.repositories import ChangeRepository
+from if_else_2024.core.db_manager import DatabaseManager
+from if_else_2024.core.events import EventHub, format_sse_event
+from if_else_2024.core.exceptions import (
+    AppException,
+    EntityNotFoundException,
+    ServiceUnavailableException,
+)
+from if_else_2024.core.invalidation import publish_invalidation
+from if_else_2024.core.metrics import MetricsRegistry
+from if_else_2024.core.singleflight import SingleFlight
 from if_else_2024.forecasts.repositories import ForecastRepository
+from if_else_2024.regions.models import Region
 from if_else_2024.regions.repositories import RegionRepository
-from if_else_2024.weather.dto import CreateWeatherDto, UpdateWeatherDto
-from if_else_2024.weather.models import Weather, WeatherCondition
-from if_else_2024.weather.repositories import WeatherRepository
+from if_else_2024.weather.dto import (
+    AggregatedValueDto,
+    AggregationGranularity,
+    BatchWeatherResultDto,
+    CreateWeatherDto,
+    UpdateWeatherDto,
+    WeatherAggregateDto,
+    WeatherDto,
+    WeatherEventDto,
+    WeatherExportFormat,
+)
+from if_else_2024.weather.models import RollupGranularity, Weather, WeatherCondition
+from if_else_2024.weather.repositories import (
+    WeatherPartitionRepository,
+    WeatherRepository,
+    WeatherRollupRepository,
+)
+from if_else_2024.weather.utils import (
+    ROLLUP_METRICS,
+    encode_weather_csv,
+    encode_weather_ndjson,
+    month_start,
+    parse_weather_partition_name,
+    truncate_date_time,
+    weather_partition_name,
+)
+
+logger = logging.getLogger(__name__)
 
 
 class WeatherService:
     def __init__(
         self,
         weather_repository: WeatherRepository,
+        rollup_repository: WeatherRollupRepository,
         forecast_repository: ForecastRepository,
         region_repository: RegionRepository,
+        change_repository: ChangeRepository,
+        events: EventHub,
+        current_flights: SingleFlight,
+        export_batch_size: int,
     ):
         self._weather_repository = weather_repository
+        self._rollup_repository = rollup_repository
         self._forecast_repository = forecast_repository
         self._region_repository = region_repository
+        self._change_repository = change_repository
+        self._events = events
+        # Regions, whose current weather is to be pushed to subscribers
+        self._changed_region_ids: set[int] = set()
+        self._changed = asyncio.Event()
+        self._current_flights = current_flights
+        self._export_batch_size = export_batch_size
 
     async def create_current_for_region(
         self, session: AsyncSession, dto: CreateWeatherDto
@@ -28,13 +83,10 @@ class WeatherService:
         if region is None:
             raise EntityNotFoundException("Region with given id was not found")
 
-        forecasts = [
-            await self._forecast_repository.get_by_region_and_id(
-                session, dto.region_id, id
-            )
-            for id in dto.weather_forecast
-        ]
-        if None in forecasts:
+        forecasts, missing = await self._forecast_repository.get_by_region_and_ids(
+            session, dto.region_id, dto.weather_forecast
+        )
+        if missing:
             raise EntityNotFoundException(
                 "Forecast with one of given ids was not found"
             )
@@ -42,28 +94,129 @@ class WeatherService:
         weather = Weather(
             **dto.model_dump(exclude=["weather_forecast", "region_id"]),
             region=region,
-            forecasts=forecasts
+            forecasts=forecasts,
         )
         region.current_weather = weather
 
         session.add(weather)
         session.add(region)
         await session.flush()
+        await self._rollup_repository.add(session, [weather.id])
+        await self._add_change(session, weather, ChangeOperation.CREATE)
+        # Current weather of the region is changed bypassing its repository
+        await publish_invalidation(session, Region.__tablename__, region.id)
         await session.commit()
 
         return weather
 
+    async def create_many_for_regions(
+        self, session: AsyncSession, dtos: list[CreateWeatherDto]
+    ):
+        """
+        Validates all items with two set-based queries, inserts the valid ones
+        in bulk and makes the newest of them current for their regions.
+        Invalid items are reported in results and do not abort the batch
+        """
+        region_ids = await self._region_repository.get_existing_ids(
+            session, {dto.region_id for dto in dtos}
+        )
+        forecasts_regions = await self._forecast_repository.get_region_ids_by_ids(
+            session, {id for dto in dtos for id in dto.weather_forecast}
+        )
+
+        results: list[BatchWeatherResultDto] = []
+        accepted: list[CreateWeatherDto] = []
+        for index, dto in enumerate(dtos):
+            exception: AppException | None = None
+            if dto.region_id not in region_ids:
+                exception = EntityNotFoundException(
+                    "Region with given id was not found"
+                )
+            elif any(
+                forecasts_regions.get(id) != dto.region_id
+                for id in dto.weather_forecast
+            ):
+                exception = EntityNotFoundException(
+                    "Forecast with one of given ids was not found"
+                )
+
+            if exception is None:
+                accepted.append(dto)
+                result = BatchWeatherResultDto(
+                    index=index, status_code=status.HTTP_201_CREATED
+                )
+            else:
+                result = BatchWeatherResultDto(
+                    index=index,
+                    status_code=exception.status_code,
+                    details=exception.details,
+                )
+            results.append(result)
+
+        if len(accepted) == 0:
+            return results
+
+        ids = await self._weather_repository.insert_many(
+            session,
+            [dto.model_dump(exclude=["weather_forecast"]) for dto in accepted],
+            [dto.weather_forecast for dto in accepted],
+        )
+        await self._rollup_repository.add(session, ids)
+        await self._change_repository.add_many(
+            session,
+            ChangeEntity.WEATHER,
+            ChangeOperation.CREATE,
+            [(id, dto.region_id) for id, dto in zip(ids, accepted)],
+        )
+
+        newest: dict[int, tuple[datetime, int]] = {}
+        for id, dto in zip(ids, accepted):
+            if (
+                dto.region_id not in newest
+                or newest[dto.region_id][0] <= dto.measurement_date_time
+            ):
+                newest[dto.region_id] = (dto.measurement_date_time, id)
+        await self._region_repository.set_current_weather_if_newer(
+            session, [id for _, id in newest.values()]
+        )
+
+        await session.commit()
+
+        created = iter(ids)
+        for result in results:
+            if result.status_code == status.HTTP_201_CREATED:
+                result.id = next(created)
+
+        return results
+
     async def get_current_for_region(self, session: AsyncSession, region_id: int):
         region = await self._region_repository.get_by_id(session, region_id)
         if region is None:
             raise EntityNotFoundException("Region with given id was not found")
 
-        weather: Weather = await region.awaitable_attrs.current_weather
+        weather = await self._get_current_with_relationships(session, region)
         if weather is None:
             raise EntityNotFoundException("There is no current weather in this region")
 
         return weather
 
+    async def get_current_dto_for_region(self, db: DatabaseManager, region_id: int):
+        """Concurrent lookups of the same region share one query"""
+        return await self._current_flights.do(
+            region_id, lambda: self._load_current_dto(db, region_id)
+        )
+
+    async def get_current_for_regions(
+        self, session: AsyncSession, region_ids: list[int]
+    ):
+        """
+        Returns mapping from region id to its current weather. Missing regions
+        and regions without current weather are omitted
+        """
+        return await self._weather_repository.get_current_for_regions(
+            session, region_ids
+        )
+
     async def search(
         self,
         session: AsyncSession,
@@ -73,6 +226,7 @@ class WeatherService:
         weather_condition: WeatherCondition | None,
         offset: int,
         size: int,
+        subtree_region_id: int | None = None,
     ):
         return list(
             await self._weather_repository.search(
@@ -83,9 +237,71 @@ class WeatherService:
                 weather_condition,
                 offset,
                 size,
+                await self._get_subtree_path(session, subtree_region_id),
             )
         )
 
+    async def export(
+        self,
+        db: DatabaseManager,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        region_id: int | None,
+        weather_condition: WeatherCondition | None,
+        subtree_region_id: int | None,
+        format: WeatherExportFormat,
+    ):
+        """
+        Checks filters right away, so errors are raised before the response is
+        started, and returns the iterator of encoded chunks of the export
+        """
+        async with db.create_session() as session:
+            subtree_path = await self._get_subtree_path(session, subtree_region_id)
+
+        return self._stream_export(
+            db,
+            start_date_time,
+            end_date_time,
+            region_id,
+            weather_condition,
+            subtree_path,
+            format,
+        )
+
+    def stream_events(self, region_ids: list[int]):
+        """Yields encoded server-sent events with changes of current weather"""
+        return self._events.stream(region_ids)
+
+    def invalidate_current(self, region_id: int | None):
+        """
+        Must be subscribed to invalidations of regions, which are published
+        with every change of their current weather, so changes made by all
+        workers reach subscribers of this one
+        """
+        if region_id is None:
+            self._changed_region_ids.update(self._events.keys())
+        elif self._events.has_subscribers(region_id):
+            self._changed_region_ids.add(region_id)
+        else:
+            return
+        self._changed.set()
+
+    async def publish_events(self, db: DatabaseManager):
+        """Pushes current weather of changed regions until cancelled"""
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            region_ids, self._changed_region_ids = self._changed_region_ids, set()
+            try:
+                async with db.create_session() as session:
+                    await self._publish_current(session, list(region_ids))
+            except Exception as ex:
+                logger.error(
+                    "Failed to publish current weather of %d regions",
+                    len(region_ids),
+                    exc_info=ex,
+                )
+
     async def update_current_for_region(
         self, session: AsyncSession, region_id: int, dto: UpdateWeatherDto
     ):
@@ -93,19 +309,20 @@ class WeatherService:
         if region is None:
             raise EntityNotFoundException("Region with given id was not found")
 
-        weather: Weather = await region.awaitable_attrs.current_weather
+        weather = await self._get_current_with_relationships(session, region)
         if weather is None:
             raise EntityNotFoundException("There is no current weather in this region")
 
-        forecasts = [
-            await self._forecast_repository.get_by_region_and_id(session, region_id, id)
-            for id in dto.weather_forecast
-        ]
-        if None in forecasts:
+        forecasts, missing = await self._forecast_repository.get_by_region_and_ids(
+            session, region_id, dto.weather_forecast
+        )
+        if missing:
             raise EntityNotFoundException(
                 "Forecast with one of given ids was not found"
             )
 
+        previous_key = (weather.region_id, weather.measurement_date_time)
+
         region.name = dto.region_name
         weather.temperature = dto.temperature
         weather.humidity = dto.humidity
@@ -116,6 +333,12 @@ class WeatherService:
         weather.forecasts = forecasts
 
         await session.flush()
+        await self._rollup_repository.refresh(
+            session, {previous_key, (weather.region_id, weather.measurement_date_time)}
+        )
+        await self._add_change(session, weather, ChangeOperation.UPDATE)
+        # Name of the region is changed bypassing its repository
+        await publish_invalidation(session, Region.__tablename__, region.id)
         await session.commit()
 
         return weather
@@ -149,6 +372,11 @@ class WeatherService:
 
         await session.delete(weather)
         await session.flush()
+        await self._rollup_repository.refresh(
+            session, {(weather.region_id, weather.measurement_date_time)}
+        )
+        await self._add_change(session, weather, ChangeOperation.DELETE)
+        await publish_invalidation(session, Region.__tablename__, region_id)
         await session.commit()
 
     async def delete_by_id(self, session: AsyncSession, region_id: int, id: int):
@@ -162,9 +390,357 @@ class WeatherService:
                 "There is no weather with given id in this region"
             )
 
-        if weather.id == region.current_weather_id:
+        was_current = weather.id == region.current_weather_id
+        if was_current:
             region.current_weather_id = None
 
         await session.delete(weather)
         await session.flush()
+        await self._rollup_repository.refresh(
+            session, {(weather.region_id, weather.measurement_date_time)}
+        )
+        await self._add_change(session, weather, ChangeOperation.DELETE)
+        if was_current:
+            await publish_invalidation(session, Region.__tablename__, region_id)
+        await session.commit()
+
+    async def aggregate(
+        self,
+        session: AsyncSession,
+        granularity: AggregationGranularity,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        region_id: int | None,
+    ):
+        """
+        Reads hourly rollups for hours and daily rollups for coarser buckets.
+        Raw weather is aggregated only if range bounds are not aligned to them
+        """
+        source = (
+            RollupGranularity.HOUR
+            if granularity == AggregationGranularity.HOUR
+            else RollupGranularity.DAY
+        )
+        aligned = all(
+            date_time is None or truncate_date_time(date_time, source) == date_time
+            for date_time in (start_date_time, end_date_time)
+        )
+
+        unit = granularity.lower()
+        if aligned:
+            rows = await self._rollup_repository.aggregate(
+                session, unit, source, start_date_time, end_date_time, region_id
+            )
+        else:
+            rows = await self._rollup_repository.aggregate_weather(
+                session, unit, start_date_time, end_date_time, region_id
+            )
+
+        return [self._to_aggregate_dto(row) for row in rows]
+
+    async def rebuild_rollups(self, session: AsyncSession):
+        await self._rollup_repository.rebuild(session)
+        await session.commit()
+
+    async def _publish_current(self, session: AsyncSession, region_ids: list[int]):
+        """
+        Pushes current weather of regions to their subscribers. Is called after
+        commit, so subscribers never see changes which were rolled back
+        """
+        region_ids = [id for id in region_ids if self._events.has_subscribers(id)]
+        if len(region_ids) == 0:
+            return
+
+        current = await self._weather_repository.get_current_for_regions(
+            session, region_ids
+        )
+        for region_id in region_ids:
+            weather = current.get(region_id)
+            dto = WeatherEventDto(
+                region_id=region_id,
+                weather=None if weather is None else WeatherDto.model_validate(weather),
+            )
+            self._events.publish(
+                region_id,
+                format_sse_event("weather", dto.model_dump_json(by_alias=True)),
+            )
+
+    async def _get_subtree_path(
+        self, session: AsyncSession, subtree_region_id: int | None
+    ):
+        if subtree_region_id is None:
+            return None
+
+        subtree_region = await self._region_repository.get_by_id(
+            session, subtree_region_id
+        )
+        if subtree_region is None:
+            raise EntityNotFoundException("Region with given id was not found")
+        return subtree_region.path
+
+    async def _stream_export(
+        self,
+        db: DatabaseManager,
+        start_date_time: datetime | None,
+        end_date_time: datetime | None,
+        region_id: int | None,
+        weather_condition: WeatherCondition | None,
+        subtree_path: str | None,
+        format: WeatherExportFormat,
+    ):
+        """Yields encoded chunks of the export, one per fetched batch of rows"""
+        # Request scoped session is closed before the response is streamed,
+        # so the export holds its own one
+        async with db.create_session() as session:
+            batches = self._weather_repository.stream(
+                session,
+                start_date_time,
+                end_date_time,
+                region_id,
+                weather_condition,
+                subtree_path,
+                self._export_batch_size,
+            )
+
+            if format == WeatherExportFormat.CSV:
+                yield encode_weather_csv([], with_header=True)
+                async for rows in batches:
+                    yield encode_weather_csv(rows)
+            else:
+                async for rows in batches:
+                    yield encode_weather_ndjson(rows)
+
+    async def _add_change(
+        self, session: AsyncSession, weather: Weather, operation: ChangeOperation
+    ):
+        await self._change_repository.add_many(
+            session,
+            ChangeEntity.WEATHER,
+            operation,
+            [(weather.id, weather.region_id)],
+        )
+
+    async def _load_current_dto(self, db: DatabaseManager, region_id: int):
+        async with db.create_session() as session:
+            weather = await self.get_current_for_region(session, region_id)
+            return WeatherDto.model_validate(weather)
+
+    async def _get_current_with_relationships(
+        self, session: AsyncSession, region: Region
+    ):
+        if region.current_weather_id is None:
+            return None
+        return await self._weather_repository.get_by_id(
+            session, region.current_weather_id, with_region=True, with_forecasts=True
+        )
+
+    @staticmethod
+    def _to_aggregate_dto(row):
+        values = row._mapping
+        return WeatherAggregateDto(
+            region_id=values["region_id"],
+            bucket_start=values["bucket"],
+            count=values["count"],
+            weather_conditions={
+                condition: values[f"{condition.lower()}_count"]
+                for condition in WeatherCondition
+            },
+            **{
+                metric: AggregatedValueDto(
+                    avg=values[f"{metric}_avg"],
+                    min=values[f"{metric}_min"],
+                    max=values[f"{metric}_max"],
+                )
+                for metric in ROLLUP_METRICS
+            },
+        )
+
+
+""" Errors of the database, after which the same batch may be inserted """
+_TRANSIENT_ERRORS = (exc.OperationalError, exc.TimeoutError)
+
+
+class WeatherBufferService:
+    """
+    Write-behind buffer of created weather. Accepted weather waits in a
+    bounded queue and is inserted in batches, when `batch_size` items are
+    collected or `flush_interval` seconds have passed. A batch failed on
+    transient errors is retried `retries` times with exponential backoff
+    from `retry_delay` seconds and then is flushed first again
+    """
+
+    def __init__(
+        self,
+        weather_service: WeatherService,
+        metrics: MetricsRegistry,
+        size: int,
+        batch_size: int,
+        flush_interval: float,
+        retries: int,
+        retry_delay: float,
+    ):
+        self._weather_service = weather_service
+        self._metrics = metrics
+        self._queue: asyncio.Queue[CreateWeatherDto] = asyncio.Queue()
+        # The failed batch, which is put back at the head of the queue
+        self._requeued: list[CreateWeatherDto] = []
+        self._size = size
+        # Includes the batch being flushed, so `size` bounds all buffered weather
+        self._pending = 0
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._closed = False
+
+    def submit(self, dto: CreateWeatherDto):
+        if self._closed:
+            raise ServiceUnavailableException("Weather buffer is closed")
+        if self._pending >= self._size:
+            self._metrics.inc("weather_buffer_rejected_total")
+            raise ServiceUnavailableException(
+                "Weather buffer is full", math.ceil(self._flush_interval)
+            )
+
+        self._queue.put_nowait(dto)
+        self._set_pending(1)
+
+    def close(self):
+        """Stops accepting weather. `run` returns after the rest is flushed"""
+        self._closed = True
+
+    async def run(self, db: DatabaseManager):
+        while True:
+            batch = await self._collect()
+            if batch:
+                await self._flush(db, batch)
+            elif self._closed:
+                return
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._flush_interval
+        batch, self._requeued = self._requeued, []
+        while len(batch) < self._batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            timeout = deadline - loop.time()
+            if self._closed or timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except TimeoutError:
+                break
+
+        return batch
+
+    async def _flush(self, db: DatabaseManager, batch: list[CreateWeatherDto]):
+        try:
+            results = await self._insert(db, batch)
+        except _TRANSIENT_ERRORS as ex:
+            if not self._closed:
+                # Still counted as pending, so new weather is rejected when full
+                self._requeued = batch
+                self._metrics.inc("weather_buffer_requeued_total", len(batch))
+                logger.error("Requeued %d buffered weather", len(batch), exc_info=ex)
+                return
+            self._lose(batch, ex)
+            return
+        except Exception as ex:
+            self._lose(batch, ex)
+            return
+
+        self._set_pending(-len(batch))
+
+        failed = [
+            result
+            for result in results
+            if result.status_code != status.HTTP_201_CREATED
+        ]
+        self._metrics.inc("weather_buffer_flushed_total", len(results) - len(failed))
+        if failed:
+            self._metrics.inc("weather_buffer_invalid_total", len(failed))
+            logger.warning(
+                "Dropped %d invalid buffered weather, first error: %s",
+                len(failed),
+                failed[0].details,
+            )
+
+    async def _insert(self, db: DatabaseManager, batch: list[CreateWeatherDto]):
+        delay = self._retry_delay
+        for attempt in range(self._retries + 1):
+            try:
+                async with db.create_session() as session:
+                    return await self._weather_service.create_many_for_regions(
+                        session, batch
+                    )
+            except _TRANSIENT_ERRORS as ex:
+                if attempt == self._retries:
+                    raise
+                logger.warning(
+                    "Failed to flush %d buffered weather. Retrying in %.1fs",
+                    len(batch),
+                    delay,
+                    exc_info=ex,
+                )
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    def _lose(self, batch: list[CreateWeatherDto], ex: Exception):
+        # Weather is already acknowledged, so there is nobody to report to
+        self._set_pending(-len(batch))
+        self._metrics.inc("weather_buffer_lost_total", len(batch))
+        logger.error("Lost %d buffered weather", len(batch), exc_info=ex)
+
+    def _set_pending(self, delta: int):
+        self._pending += delta
+        self._metrics.set("weather_buffer_size", self._pending)
+
+
+class WeatherPartitionService:
+    def __init__(
+        self,
+        repository: WeatherPartitionRepository,
+        months_ahead: int,
+        detach_after_months: int | None,
+    ):
+        self._repository = repository
+        self._months_ahead = months_ahead
+        self._detach_after_months = detach_after_months
+
+    async def maintain(self, session: AsyncSession, now: datetime | None = None):
+        """
+        Creates partitions from the current month up to `months_ahead` months
+        forward and detaches ones older than `detach_after_months` months
+        """
+        now = datetime.now() if now is None else now
+
+        await self._repository.lock(session)
+        names = set(await self._repository.get_names(session))
+
+        for offset in range(self._months_ahead + 1):
+            start = month_start(now, offset)
+            name = weather_partition_name(start)
+            if name not in names:
+                await self._repository.create(
+                    session, name, start, month_start(start, 1)
+                )
+                logger.info("Created weather partition %s", name)
+
+        if self._detach_after_months is not None:
+            oldest_kept = month_start(now, -self._detach_after_months)
+            for name in names:
+                start = parse_weather_partition_name(name)
+                if start is not None and start < oldest_kept:
+                    region_ids = await self._repository.detach(session, name)
+                    logger.info(
+                        "Detached weather partition %s, reset %d current weather",
+                        name,
+                        len(region_ids),
+                    )
+
         await session.commit()
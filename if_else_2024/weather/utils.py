@@ -0,0 +1,69 @@
+import csv
+import io
+import re
+from datetime import datetime, timedelta
+from typing import Sequence
+
+from if_else_2024.weather.dto import WeatherDto
+from if_else_2024.weather.models import RollupGranularity
+
+CSV_HEADER = [
+    field.serialization_alias or name for name, field in WeatherDto.model_fields.items()
+]
+
+
+def encode_weather_ndjson(rows: Sequence) -> str:
+    return "".join(
+        WeatherDto.model_validate(row).model_dump_json(by_alias=True) + "\n"
+        for row in rows
+    )
+
+
+def encode_weather_csv(rows: Sequence, with_header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if with_header:
+        writer.writerow(CSV_HEADER)
+
+    for row in rows:
+        values = WeatherDto.model_validate(row).model_dump(mode="json")
+        values["weather_forecast"] = " ".join(map(str, values["weather_forecast"]))
+        writer.writerow(values.values())
+
+    return buffer.getvalue()
+
+
+PARTITION_NAME_PATTERN = re.compile(r"^weather_(\d{4})_(\d{2})$")
+
+
+def month_start(date_time: datetime, months_offset: int = 0) -> datetime:
+    months = date_time.year * 12 + date_time.month - 1 + months_offset
+    return datetime(months // 12, months % 12 + 1, 1)
+
+
+def weather_partition_name(month: datetime) -> str:
+    return f"weather_{month.year:04d}_{month.month:02d}"
+
+
+def parse_weather_partition_name(name: str) -> datetime | None:
+    """Returns start of the month covered by partition, if it is a monthly one"""
+    match = PARTITION_NAME_PATTERN.match(name)
+    if match is None:
+        return None
+    return datetime(int(match[1]), int(match[2]), 1)
+
+
+ROLLUP_METRICS = ("temperature", "humidity", "wind_speed", "precipitation_amount")
+
+
+def truncate_date_time(date_time: datetime, granularity: RollupGranularity) -> datetime:
+    date_time = date_time.replace(minute=0, second=0, microsecond=0)
+    if granularity == RollupGranularity.DAY:
+        date_time = date_time.replace(hour=0)
+    return date_time
+
+
+def rollup_bucket_length(granularity: RollupGranularity) -> timedelta:
+    if granularity == RollupGranularity.DAY:
+        return timedelta(days=1)
+    return timedelta(hours=1)
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from if_else_2024.changes.models import Change, ChangeEntity, ChangeOperation
+from if_else_2024.changes.repositories import ChangeRepository
+from if_else_2024.changes.services import ChangeService
+from if_else_2024.core.exceptions import ResourceGoneException
+from if_else_2024.core.metrics import MetricsRegistry
+from if_else_2024.retention.dto import RetentionAction, RetentionPolicy, RetentionTarget
+from if_else_2024.retention.repositories import RetentionRepository
+from if_else_2024.retention.services import RetentionService
+from if_else_2024.utils import encode_cursor
+from if_else_2024.weather.repositories import WeatherRollupRepository
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_change(session: AsyncSession, changed_at: datetime):
+    """Every change is written by its own transaction"""
+    change = Change(
+        entity=ChangeEntity.WEATHER,
+        entity_id=1,
+        region_id=1,
+        operation=ChangeOperation.CREATE,
+        changed_at=changed_at,
+    )
+    session.add(change)
+    await session.commit()
+    await session.refresh(change)
+    return change
+
+
+def get_cursor(change: Change):
+    return encode_cursor([change.transaction_id, change.id])
+
+
+async def test_only_prefix_of_log_older_than_horizon_is_deleted(
+    session: AsyncSession,
+):
+    first, second = [
+        await add_change(session, datetime(2024, 1, day)) for day in (1, 2)
+    ]
+    kept = await add_change(session, datetime(2024, 1, 20))
+    # Written by a transaction started before the horizon, but after `kept`
+    late = await add_change(session, datetime(2024, 1, 3))
+
+    policy = RetentionPolicy(
+        target=RetentionTarget.CHANGES, action=RetentionAction.DELETE, afterDays=10
+    )
+    service = RetentionService(
+        RetentionRepository(),
+        WeatherRollupRepository(),
+        MetricsRegistry(),
+        [policy],
+        1,
+        10,
+    )
+    await service.run(session, datetime(2024, 1, 21))
+
+    s = await session.execute(select(Change.id).order_by(Change.id))
+    assert s.scalars().all() == [kept.id, late.id]
+
+    change_service = ChangeService(ChangeRepository())
+    with pytest.raises(ResourceGoneException):
+        await change_service.get_since(session, get_cursor(first), None, 10)
+
+    changes, _ = await change_service.get_since(session, get_cursor(kept), None, 10)
+    assert [change.id for change in changes] == [late.id]
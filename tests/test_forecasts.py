@@ -0,0 +1,59 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from if_else_2024.changes.repositories import ChangeRepository
+from if_else_2024.core.cache import EntityCache
+from if_else_2024.core.exceptions import EntityAlreadyExistsException
+from if_else_2024.core.metrics import MetricsRegistry
+from if_else_2024.forecasts.dto import CreateForecastDto, UpdateForecastDto
+from if_else_2024.forecasts.models import Forecast
+from if_else_2024.forecasts.repositories import ForecastRepository
+from if_else_2024.forecasts.services import ForecastService
+from if_else_2024.regions.models import Region
+from if_else_2024.regions.repositories import RegionRepository
+from if_else_2024.utils import TtlCache
+from if_else_2024.weather.models import WeatherCondition
+
+pytestmark = pytest.mark.anyio
+
+
+def create_forecast_service():
+    metrics = MetricsRegistry()
+    return ForecastService(
+        ForecastRepository(EntityCache(Forecast, TtlCache(60, 100), metrics)),
+        RegionRepository(EntityCache(Region, TtlCache(60, 100), metrics)),
+        ChangeRepository(),
+        1000,
+        TtlCache(60, 100),
+    )
+
+
+async def test_forecasts_for_taken_date_time_are_conflicting(
+    session: AsyncSession, region: Region
+):
+    service = create_forecast_service()
+    dtos = [
+        CreateForecastDto(
+            regionId=region.id,
+            dateTime=datetime(2024, 1, day),
+            temperature=-5,
+            weatherCondition=WeatherCondition.SNOW,
+        )
+        for day in (1, 2)
+    ]
+    forecast = await service.create(session, dtos[0])
+    await service.create(session, dtos[1])
+
+    dto = UpdateForecastDto(
+        temperature=-6,
+        weatherCondition=WeatherCondition.SNOW,
+        dateTime=dtos[1].date_time,
+    )
+    with pytest.raises(EntityAlreadyExistsException):
+        await service.update_by_id(session, forecast.id, dto)
+    await session.rollback()
+
+    with pytest.raises(EntityAlreadyExistsException):
+        await service.create(session, dtos[0])
@@ -0,0 +1,132 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from if_else_2024.changes.repositories import ChangeRepository
+from if_else_2024.core.cache import EntityCache
+from if_else_2024.core.exceptions import EntityNotFoundException
+from if_else_2024.core.metrics import MetricsRegistry
+from if_else_2024.core.singleflight import SingleFlight
+from if_else_2024.regions.dto import CreateRegionDto
+from if_else_2024.regions.models import Region, RegionType
+from if_else_2024.regions.repositories import RegionRepository
+from if_else_2024.regions.services import RegionNameIndex, RegionService
+from if_else_2024.utils import TtlCache
+
+pytestmark = pytest.mark.anyio
+
+
+def create_region_repository():
+    return RegionRepository(EntityCache(Region, TtlCache(60, 100), MetricsRegistry()))
+
+
+def create_region_service(names: RegionNameIndex):
+    return RegionService(
+        create_region_repository(),
+        names,
+        ChangeRepository(),
+        SingleFlight("region", MetricsRegistry()),
+    )
+
+
+async def test_parent_created_by_other_worker_is_found(
+    session: AsyncSession, region: Region
+):
+    names = RegionNameIndex(create_region_repository())
+    await names.load(session)
+    # Created by another worker, whose invalidation has not arrived yet
+    parent = Region(
+        region_type_id=region.region_type_id,
+        account_id=region.account_id,
+        name="Moscow Oblast",
+        latitude=55.5,
+        longitude=37.5,
+    )
+    session.add(parent)
+    await session.commit()
+
+    dto = CreateRegionDto(
+        name="Khimki",
+        parentRegion=parent.name,
+        regionType=region.region_type_id,
+        latitude=55.9,
+        longitude=37.4,
+    )
+    child = await create_region_service(names).create(session, region.account_id, dto)
+
+    assert child.parent_region_id == parent.id
+
+
+async def test_names_of_failed_refresh_are_reloaded(
+    session: AsyncSession, region: Region, monkeypatch: pytest.MonkeyPatch
+):
+    repository = create_region_repository()
+    names = RegionNameIndex(repository)
+    await names.load(session)
+    names.invalidate(region.id)
+
+    get_names = repository.get_names
+
+    async def fail(*args, **kwargs):
+        raise ConnectionError
+
+    monkeypatch.setattr(repository, "get_names", fail)
+    with pytest.raises(ConnectionError):
+        await names.get_id(session, region.name)
+
+    monkeypatch.setattr(repository, "get_names", get_names)
+    assert await names.get_id(session, region.name) == region.id
+
+
+async def test_region_type_is_checked_by_its_constraint(
+    session: AsyncSession, region: Region
+):
+    names = RegionNameIndex(create_region_repository())
+    service = create_region_service(names)
+    # Created by another worker, whose invalidation has not arrived yet
+    region_type = RegionType(type="town")
+    session.add(region_type)
+    await session.commit()
+
+    dto = CreateRegionDto(
+        name="Khimki",
+        parentRegion=None,
+        regionType=region_type.id,
+        latitude=55.9,
+        longitude=37.4,
+    )
+    created = await service.create(session, region.account_id, dto)
+    assert created.region_type_id == region_type.id
+
+    dto = CreateRegionDto(
+        name="Dubna",
+        parentRegion=None,
+        regionType=region_type.id + 1,
+        latitude=56.7,
+        longitude=37.2,
+    )
+    with pytest.raises(EntityNotFoundException):
+        await service.create(session, region.account_id, dto)
+
+
+async def test_name_freed_by_other_worker_is_not_conflicting(
+    session: AsyncSession, region: Region
+):
+    names = RegionNameIndex(create_region_repository())
+    await names.load(session)
+    # Renamed by another worker, whose invalidation has not arrived yet
+    name = region.name
+    region.name = "Moskva"
+    await session.commit()
+
+    dto = CreateRegionDto(
+        name=name,
+        parentRegion=None,
+        regionType=region.region_type_id,
+        latitude=55.9,
+        longitude=37.4,
+    )
+    created = await create_region_service(names).create(
+        session, region.account_id, dto
+    )
+
+    assert created.name == name
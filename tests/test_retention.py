@@ -0,0 +1,194 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from if_else_2024.core.metrics import MetricsRegistry
+from if_else_2024.forecasts.models import Forecast
+from if_else_2024.regions.models import Region
+from if_else_2024.retention.dto import RetentionAction, RetentionPolicy, RetentionTarget
+from if_else_2024.retention.repositories import RetentionRepository
+from if_else_2024.retention.services import RetentionService
+from if_else_2024.weather.models import (
+    RollupGranularity,
+    Weather,
+    WeatherCondition,
+    WeatherRollup,
+    weather_forecast_table,
+)
+from if_else_2024.weather.repositories import WeatherRollupRepository
+
+pytestmark = pytest.mark.anyio
+
+
+async def apply(session: AsyncSession, policy: RetentionPolicy, now: datetime):
+    service = RetentionService(
+        RetentionRepository(),
+        WeatherRollupRepository(),
+        MetricsRegistry(),
+        [policy],
+        1,
+        10,
+    )
+    await service.run(session, now)
+
+
+async def get_rollups(session: AsyncSession):
+    """Retained rows and rows of existing weather of buckets are summed up"""
+    s = await session.execute(
+        select(
+            WeatherRollup.granularity,
+            WeatherRollup.bucket,
+            func.sum(WeatherRollup.count),
+        )
+        .group_by(WeatherRollup.granularity, WeatherRollup.bucket)
+        .order_by(WeatherRollup.granularity, WeatherRollup.bucket)
+    )
+    return s.all()
+
+
+def create_weather(region: Region, measurement_date_time: datetime):
+    return Weather(
+        region=region,
+        temperature=-4,
+        humidity=80,
+        wind_speed=3,
+        weather_condition=WeatherCondition.SNOW,
+        precipitation_amount=1,
+        measurement_date_time=measurement_date_time,
+    )
+
+
+@pytest.mark.parametrize(
+    "action, rollups",
+    [
+        (
+            RetentionAction.DOWNSAMPLE_HOURLY,
+            [
+                (RollupGranularity.HOUR, datetime(2024, 1, 1, 10), 2),
+                (RollupGranularity.HOUR, datetime(2024, 1, 3, 10), 1),
+                (RollupGranularity.DAY, datetime(2024, 1, 1), 2),
+                (RollupGranularity.DAY, datetime(2024, 1, 3), 1),
+            ],
+        ),
+        (
+            RetentionAction.DOWNSAMPLE_DAILY,
+            [
+                (RollupGranularity.HOUR, datetime(2024, 1, 3, 10), 1),
+                (RollupGranularity.DAY, datetime(2024, 1, 1), 2),
+                (RollupGranularity.DAY, datetime(2024, 1, 3), 1),
+            ],
+        ),
+        (
+            RetentionAction.DELETE,
+            [
+                (RollupGranularity.HOUR, datetime(2024, 1, 3, 10), 1),
+                (RollupGranularity.DAY, datetime(2024, 1, 3), 1),
+            ],
+        ),
+    ],
+)
+async def test_rollups_of_deleted_weather_survive_refresh_and_rebuild(
+    session: AsyncSession,
+    region: Region,
+    action: RetentionAction,
+    rollups: list[tuple],
+):
+    weather = [
+        create_weather(region, measurement_date_time)
+        for measurement_date_time in (
+            datetime(2024, 1, 1, 10),
+            datetime(2024, 1, 1, 10, 30),
+            datetime(2024, 1, 3, 10),
+        )
+    ]
+    session.add_all(weather)
+    await session.flush()
+    rollup_repository = WeatherRollupRepository()
+    await rollup_repository.add(session, [w.id for w in weather])
+    await session.commit()
+
+    policy = RetentionPolicy(target=RetentionTarget.WEATHER, action=action, afterDays=1)
+    await apply(session, policy, datetime(2024, 1, 3, 12))
+
+    await rollup_repository.refresh(
+        session, {(region.id, w.measurement_date_time) for w in weather}
+    )
+    assert await get_rollups(session) == rollups
+
+    await rollup_repository.rebuild(session)
+    assert await get_rollups(session) == rollups
+
+
+async def test_rollups_of_weather_kept_by_retention_are_recomputed(
+    session: AsyncSession, region: Region
+):
+    old, current, recent = weather = [
+        create_weather(region, measurement_date_time)
+        for measurement_date_time in (
+            datetime(2024, 1, 1, 10),
+            datetime(2024, 1, 1, 11),
+            # After the cutoff, but in the same day
+            datetime(2024, 1, 2, 14),
+        )
+    ]
+    session.add_all(weather)
+    await session.flush()
+    region.current_weather_id = current.id
+    rollup_repository = WeatherRollupRepository()
+    await rollup_repository.add(session, [w.id for w in weather])
+    await session.commit()
+
+    policy = RetentionPolicy(
+        target=RetentionTarget.WEATHER,
+        action=RetentionAction.DOWNSAMPLE_HOURLY,
+        afterDays=1,
+    )
+    await apply(session, policy, datetime(2024, 1, 3, 12))
+
+    region.current_weather_id = None
+    for w in (current, recent):
+        await session.delete(w)
+    await session.flush()
+    await rollup_repository.refresh(
+        session, {(region.id, w.measurement_date_time) for w in (current, recent)}
+    )
+    await session.commit()
+
+    assert await get_rollups(session) == [
+        (RollupGranularity.HOUR, datetime(2024, 1, 1, 10), 1),
+        (RollupGranularity.DAY, datetime(2024, 1, 1), 1),
+    ]
+
+
+async def test_expired_forecasts_are_deleted_with_links_of_kept_weather(
+    session: AsyncSession, region: Region
+):
+    forecast = Forecast(
+        region=region,
+        date_time=datetime(2024, 1, 1),
+        temperature=-5,
+        weather_condition=WeatherCondition.SNOW,
+    )
+    weather = Weather(
+        region=region,
+        temperature=-4,
+        humidity=80,
+        wind_speed=3,
+        weather_condition=WeatherCondition.SNOW,
+        precipitation_amount=1,
+        measurement_date_time=datetime(2024, 1, 10),
+        forecasts=[forecast],
+    )
+    session.add(weather)
+    await session.commit()
+
+    policy = RetentionPolicy(
+        target=RetentionTarget.FORECASTS, action=RetentionAction.DELETE, afterDays=5
+    )
+    await apply(session, policy, datetime(2024, 1, 11))
+
+    assert (await session.execute(select(Forecast.id))).all() == []
+    assert (await session.execute(select(weather_forecast_table))).all() == []
+    assert (await session.execute(select(Weather.id))).scalars().all() == [weather.id]
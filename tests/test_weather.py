@@ -0,0 +1,227 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import pytest
+from fastapi import status
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from if_else_2024.changes.repositories import ChangeRepository
+from if_else_2024.core.cache import EntityCache
+from if_else_2024.core.events import EventHub
+from if_else_2024.core.metrics import MetricsRegistry
+from if_else_2024.core.singleflight import SingleFlight
+from if_else_2024.forecasts.models import Forecast
+from if_else_2024.forecasts.repositories import ForecastRepository
+from if_else_2024.regions.models import Region
+from if_else_2024.regions.repositories import RegionRepository
+from if_else_2024.regions.utils import make_region_path
+from if_else_2024.utils import TtlCache
+from if_else_2024.weather.dto import (
+    BatchWeatherResultDto,
+    CreateWeatherDto,
+    WeatherExportFormat,
+)
+from if_else_2024.weather.models import Weather, WeatherCondition
+from if_else_2024.weather.repositories import (
+    WeatherRepository,
+    WeatherRollupRepository,
+)
+from if_else_2024.weather.services import WeatherBufferService, WeatherService
+
+pytestmark = pytest.mark.anyio
+
+
+def create_weather_service():
+    """Caches are not shared, so every service starts with a cold cache"""
+    metrics = MetricsRegistry()
+    return WeatherService(
+        WeatherRepository(),
+        WeatherRollupRepository(),
+        ForecastRepository(EntityCache(Forecast, TtlCache(60, 100), metrics)),
+        RegionRepository(EntityCache(Region, TtlCache(60, 100), metrics)),
+        ChangeRepository(),
+        EventHub("weather", metrics, 16, 15),
+        SingleFlight("current_weather", metrics),
+        1000,
+    )
+
+
+async def test_statements_of_weather_create_do_not_depend_on_forecasts_count(
+    session: AsyncSession, region: Region, statements: list
+):
+    forecasts = [
+        Forecast(
+            region=region,
+            date_time=datetime(2024, 1, 1, hour),
+            temperature=-5,
+            weather_condition=WeatherCondition.SNOW,
+        )
+        for hour in range(20)
+    ]
+    session.add_all(forecasts)
+    await session.commit()
+
+    counts = []
+    for count in (1, len(forecasts)):
+        dto = CreateWeatherDto(
+            regionId=region.id,
+            temperature=-4,
+            humidity=80,
+            windSpeed=3,
+            weatherCondition=WeatherCondition.SNOW,
+            precipitationAmount=1,
+            measurementDateTime=datetime(2024, 1, 1, count),
+            weatherForecast=[forecast.id for forecast in forecasts[:count]],
+        )
+        statements.clear()
+        await create_weather_service().create_current_for_region(session, dto)
+        counts.append(len(statements))
+
+    assert counts[0] == counts[1]
+
+
+class FlakyWeatherService:
+    """Fails with lost connection a given number of times"""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.batches: list[list[CreateWeatherDto]] = []
+
+    async def create_many_for_regions(
+        self, session: AsyncSession, dtos: list[CreateWeatherDto]
+    ):
+        if self.failures > 0:
+            self.failures -= 1
+            raise OperationalError("INSERT", {}, ConnectionError())
+        self.batches.append(dtos)
+        return [
+            BatchWeatherResultDto(index=index, status_code=status.HTTP_201_CREATED)
+            for index in range(len(dtos))
+        ]
+
+
+class FakeDatabaseManager:
+    def __init__(self, session: AsyncSession | None = None):
+        self.session = session
+
+    @asynccontextmanager
+    async def create_session(self):
+        yield self.session
+
+
+async def test_buffered_weather_is_requeued_on_transient_errors():
+    weather_service = FlakyWeatherService(3)
+    metrics = MetricsRegistry()
+    buffer = WeatherBufferService(weather_service, metrics, 10, 10, 0.01, 1, 0)
+    dtos = [
+        CreateWeatherDto(
+            regionId=1,
+            temperature=-4,
+            humidity=80,
+            windSpeed=3,
+            weatherCondition=WeatherCondition.SNOW,
+            precipitationAmount=1,
+            measurementDateTime=datetime(2024, 1, 1, hour),
+            weatherForecast=[],
+        )
+        for hour in range(2)
+    ]
+    buffer.submit(dtos[0])
+    task = asyncio.create_task(buffer.run(FakeDatabaseManager()))
+    while not weather_service.batches:
+        await asyncio.sleep(0)
+    buffer.submit(dtos[1])
+    buffer.close()
+    await task
+
+    assert weather_service.batches == [[dtos[0]], [dtos[1]]]
+    assert metrics.get("weather_buffer_requeued_total") == 1
+    assert metrics.get("weather_buffer_lost_total") is None
+    assert metrics.get("weather_buffer_size") == 0
+
+
+async def test_current_weather_changed_by_other_worker_is_pushed(
+    session: AsyncSession, region: Region
+):
+    weather_service = create_weather_service()
+    stream = weather_service.stream_events([region.id])
+    message = asyncio.create_task(anext(stream))
+    publisher = asyncio.create_task(
+        weather_service.publish_events(FakeDatabaseManager(session))
+    )
+    await asyncio.sleep(0)
+
+    # Changed by another worker, only its invalidation arrives
+    weather = Weather(
+        region=region,
+        temperature=-4,
+        humidity=80,
+        wind_speed=3,
+        weather_condition=WeatherCondition.SNOW,
+        precipitation_amount=1,
+        measurement_date_time=datetime(2024, 1, 1),
+    )
+    region.current_weather = weather
+    await session.commit()
+    weather_service.invalidate_current(region.id)
+
+    event = await asyncio.wait_for(message, 5)
+    publisher.cancel()
+    await stream.aclose()
+
+    assert event.startswith("event: weather\n")
+    assert f'"id":{weather.id}' in event
+
+
+async def test_export_is_limited_to_subtree(session: AsyncSession, region: Region):
+    child = Region(
+        region_type_id=region.region_type_id,
+        account_id=region.account_id,
+        name="Khimki",
+        latitude=55.9,
+        longitude=37.4,
+    )
+    other = Region(
+        region_type_id=region.region_type_id,
+        account_id=region.account_id,
+        name="Tver",
+        latitude=56.9,
+        longitude=35.9,
+    )
+    session.add_all([child, other])
+    await session.flush()
+    region.path = make_region_path(None, region.id)
+    child.path = make_region_path(region.path, child.id)
+    other.path = make_region_path(None, other.id)
+    for parent in (region, child, other):
+        session.add(
+            Weather(
+                region=parent,
+                temperature=-4,
+                humidity=80,
+                wind_speed=3,
+                weather_condition=WeatherCondition.SNOW,
+                precipitation_amount=1,
+                measurement_date_time=datetime(2024, 1, 1),
+            )
+        )
+    await session.commit()
+
+    chunks = await create_weather_service().export(
+        FakeDatabaseManager(session),
+        None,
+        None,
+        None,
+        None,
+        region.id,
+        WeatherExportFormat.NDJSON,
+    )
+    lines = "".join([chunk async for chunk in chunks]).splitlines()
+
+    assert sorted(json.loads(line)["regionName"] for line in lines) == [
+        "Khimki",
+        "Moscow",
+    ]
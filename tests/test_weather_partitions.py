@@ -0,0 +1,123 @@
+import re
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from if_else_2024.changes.models import Change, ChangeEntity, ChangeOperation
+from if_else_2024.forecasts.models import Forecast
+from if_else_2024.regions.models import Region
+from if_else_2024.weather.models import (
+    Weather,
+    WeatherCondition,
+    weather_forecast_table,
+)
+from if_else_2024.weather.repositories import (
+    WeatherPartitionRepository,
+    WeatherRepository,
+)
+from if_else_2024.weather.services import WeatherPartitionService
+
+pytestmark = pytest.mark.anyio
+
+PARTITION_PATTERN = re.compile(r" on (weather_(?:\d{4}_\d{2}|default))\b")
+
+
+async def maintain(
+    session: AsyncSession,
+    now: datetime,
+    months_ahead: int,
+    detach_after_months: int | None = None,
+):
+    service = WeatherPartitionService(
+        WeatherPartitionRepository(), months_ahead, detach_after_months
+    )
+    await service.maintain(session, now)
+
+
+async def get_scanned_partitions(
+    session: AsyncSession, statement: str, parameters: dict
+):
+    connection = await session.connection()
+    s = await connection.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+    return set(PARTITION_PATTERN.findall("\n".join(s.scalars().all())))
+
+
+@pytest.mark.parametrize(
+    "start_date_time, end_date_time, partitions",
+    [
+        (datetime(2024, 2, 3), datetime(2024, 2, 20), {"weather_2024_02"}),
+        (
+            datetime(2024, 2, 15),
+            datetime(2024, 3, 10),
+            {"weather_2024_02", "weather_2024_03"},
+        ),
+        (datetime(2024, 4, 1), None, {"weather_2024_04", "weather_default"}),
+    ],
+)
+async def test_search_scans_only_partitions_of_date_range(
+    session: AsyncSession,
+    statements: list,
+    start_date_time: datetime,
+    end_date_time: datetime | None,
+    partitions: set[str],
+):
+    await maintain(session, datetime(2024, 1, 15), 3)
+
+    statements.clear()
+    await WeatherRepository().search(
+        session, start_date_time, end_date_time, None, None, 0, 10
+    )
+    [(statement, parameters)] = statements
+
+    assert await get_scanned_partitions(session, statement, parameters) == partitions
+
+
+async def test_detach_removes_references_to_detached_weather(
+    session: AsyncSession, region: Region
+):
+    await maintain(session, datetime(2024, 1, 15), 1)
+
+    forecast = Forecast(
+        region=region,
+        date_time=datetime(2024, 1, 20),
+        temperature=-5,
+        weather_condition=WeatherCondition.SNOW,
+    )
+    old, new = (
+        Weather(
+            region=region,
+            temperature=-4,
+            humidity=80,
+            wind_speed=3,
+            weather_condition=WeatherCondition.SNOW,
+            precipitation_amount=1,
+            measurement_date_time=measurement_date_time,
+            forecasts=[forecast],
+        )
+        for measurement_date_time in (datetime(2024, 1, 20), datetime(2024, 2, 20))
+    )
+    session.add_all([old, new])
+    await session.flush()
+    region.current_weather_id = old.id
+    await session.commit()
+
+    await maintain(session, datetime(2024, 3, 15), 0, 1)
+
+    names = await WeatherPartitionRepository().get_names(session)
+    assert "weather_2024_01" not in names and "weather_2024_02" in names
+
+    s = await session.execute(select(weather_forecast_table.c.weather_id))
+    assert s.scalars().all() == [new.id]
+
+    await session.refresh(region)
+    assert region.current_weather_id is None
+
+    s = await session.execute(
+        select(Change.entity_id).where(
+            Change.entity == ChangeEntity.WEATHER,
+            Change.operation == ChangeOperation.DELETE,
+        )
+    )
+    assert s.scalars().all() == [old.id]